@@ -0,0 +1,105 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Minimum Container Python API.
+
+Backends are looked up by name and their module, with its client
+library, is only imported on first use::
+
+    api = mincntr.get_api('docker')
+
+Other packages add backends through the ``mincntr.backends`` entry
+point group, or at runtime with register_backend().  Importing mincntr
+itself must stay cheap: keep it free of third party imports.
+"""
+
+import importlib
+import threading
+
+ENTRY_POINT_GROUP = 'mincntr.backends'
+
+# Built in backends, as 'module:attribute'.  Also declared as entry
+# points in setup.cfg, but resolved without scanning the installed
+# distributions.
+_BACKENDS = {
+    'docker': 'mincntr.docker_api:DockerAPI',
+    'multi-docker': 'mincntr.multi_docker_api:MultiDockerAPI',
+    'kubernetes': 'mincntr.k8s_api:KubernetesAPI',
+    'aio-docker': 'mincntr.aio_docker_api:AsyncDockerAPI',
+    'aio-kubernetes': 'mincntr.aio_k8s_api:AsyncKubernetesAPI',
+}
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def _entry_points():
+    """Map name -> 'module:attribute' of the installed entry points."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        import pkg_resources
+        return dict((ep.name, '%s:%s' % (ep.module_name, ep.attrs[0]))
+                    for ep in pkg_resources.iter_entry_points(
+                        ENTRY_POINT_GROUP))
+    eps = metadata.entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    return dict((ep.name, ep.value) for ep in eps)
+
+
+def _load(target):
+    module_name, _, attr = target.partition(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def register_backend(name, target):
+    """Register a backend class, or its 'module:attribute' path."""
+    with _lock:
+        _loaded.pop(name, None)
+        _BACKENDS[name] = target
+
+
+def backends():
+    """Names of the built in, registered and installed backends."""
+    names = set(_BACKENDS)
+    names.update(_entry_points())
+    return sorted(names)
+
+
+def get_backend(name):
+    """Return the backend class called name, importing it if needed.
+
+    Unknown names are looked up among the installed entry points, which
+    is only done then.  Raises ValueError if there is no such backend.
+    """
+    with _lock:
+        if name in _loaded:
+            return _loaded[name]
+        target = _BACKENDS.get(name)
+        if target is None:
+            target = _entry_points().get(name)
+            if target is None:
+                raise ValueError("Unknown mincntr backend %r" % name)
+        cls = target if callable(target) else _load(target)
+        _loaded[name] = cls
+        return cls
+
+
+def get_api(name, **kwargs):
+    """Create an instance of the backend called name.
+
+    The keyword arguments are passed on to the backend constructor.
+    """
+    return get_backend(name)(**kwargs)
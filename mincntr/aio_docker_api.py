@@ -0,0 +1,230 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""asyncio Docker backend talking to the Engine API through aiohttp.
+
+Requires Python 3.5 or later and the ``aio`` extra (aiohttp).
+"""
+
+import functools
+import logging
+import os
+import shlex
+import struct
+
+import aiohttp
+
+from mincntr import api
+from mincntr import utils
+
+LOG = logging.getLogger(__name__)
+
+STREAM_HEADER_SIZE_BYTES = 8
+
+
+def demultiplex(buf):
+    """Strip the stdout/stderr frame headers from a non-TTY stream."""
+    chunks = []
+    view = memoryview(buf)
+    walker = 0
+    while len(buf) - walker >= STREAM_HEADER_SIZE_BYTES:
+        _, length = struct.unpack_from('>BxxxL', buf, walker)
+        start = walker + STREAM_HEADER_SIZE_BYTES
+        walker = start + length
+        chunks.append(view[start:walker])
+    return b''.join(chunks)
+
+
+class DockerError(Exception):
+    def __init__(self, status, message):
+        super(DockerError, self).__init__('%s: %s' % (status, message))
+        self.status = status
+
+
+def wrap_container_exception(f):
+    async def wrapped(self, *args, **kwargs):
+        try:
+            return await f(self, *args, **kwargs)
+        except Exception as e:
+            raise utils.container_error(e, args, kwargs, LOG)
+
+    return functools.wraps(f)(wrapped)
+
+
+class AsyncDockerAPI(api.AsyncAPIBase):
+    """Docker backend sharing one aiohttp session per instance.
+
+    ``url`` accepts the same ``unix://`` and ``tcp://`` forms as
+    ``DOCKER_HOST``; ``limit`` caps the number of simultaneous
+    connections to the daemon.  Containers are addressed by name or ID
+    directly in the request path, so no lookup round trip is needed.
+    """
+
+    def __init__(self, url=None, ver='1.20', timeout=60, limit=100):
+        url = url or os.getenv('DOCKER_HOST', 'unix://var/run/docker.sock')
+        if url.startswith('unix://'):
+            self._socket_path = '/' + url[len('unix://'):].lstrip('/')
+            self._base_url = 'http://localunixsocket'
+        else:
+            self._socket_path = None
+            self._base_url = url.replace('tcp://', 'http://', 1).rstrip('/')
+        self._version = ver
+        self._timeout = timeout
+        self._limit = limit
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            if self._socket_path:
+                connector = aiohttp.UnixConnector(path=self._socket_path,
+                                                  limit=self._limit)
+            else:
+                connector = aiohttp.TCPConnector(limit=self._limit)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _url(self, path):
+        return '%s/v%s%s' % (self._base_url, self._version, path)
+
+    async def _request(self, method, path, params=None, json=None,
+                       result='json', missing_ok=False):
+        session = self._get_session()
+        async with session.request(method, self._url(path), params=params,
+                                   json=json) as resp:
+            if missing_ok and resp.status == 404:
+                return None
+            if resp.status >= 400:
+                raise DockerError(resp.status, await resp.text())
+            if result == 'json':
+                if resp.status == 204:
+                    return None
+                return await resp.json(content_type=None)
+            return await resp.read()
+
+    async def _action(self, container_uuid, action):
+        LOG.debug("%s container %s ...", action, container_uuid)
+        await self._request('POST', '/containers/%s/%s' % (container_uuid,
+                                                           action))
+
+    # Container operations
+
+    @wrap_container_exception
+    async def list(self):
+        containers = await self._request('GET', '/containers/json',
+                                         params={'all': '1'})
+        # No details loader: inspect() is the coroutine for those.
+        return [api.docker_summary_container(c) for c in containers or []]
+
+    @wrap_container_exception
+    async def create(self, name, image, **kwargs):
+        LOG.debug('Creating container with image %s name %s', image, name)
+        image_repo, image_tag = utils.parse_docker_image(image)
+        params = {'fromImage': image_repo}
+        if image_tag:
+            params['tag'] = image_tag
+        try:
+            # The pull progress is streamed back; wait for it to finish.
+            await self._request('POST', '/images/create', params=params,
+                                result='raw')
+            command = kwargs.get('command')
+            if command is not None and not isinstance(command, list):
+                command = shlex.split(command)
+            environment = kwargs.get('environment')
+            if isinstance(environment, dict):
+                environment = ['%s=%s' % item for item in environment.items()]
+            config = {'Image': image,
+                      'Hostname': kwargs.get('uuid'),
+                      'Cmd': command,
+                      'Env': environment}
+            memory = kwargs.get('memory')
+            if memory is not None:
+                config['HostConfig'] = {'Memory': memory}
+            await self._request('POST', '/containers/create',
+                                params={'name': name},
+                                json=dict((k, v) for k, v in config.items()
+                                          if v is not None))
+            return True
+        except DockerError:
+            return False
+
+    @wrap_container_exception
+    async def delete(self, container_uuid):
+        LOG.debug("container_delete %s", container_uuid)
+        return await self._request('DELETE',
+                                   '/containers/%s' % container_uuid,
+                                   missing_ok=True)
+
+    @wrap_container_exception
+    async def inspect(self, container_uuid):
+        LOG.debug("container_show %s", container_uuid)
+        result = await self._request('GET',
+                                     '/containers/%s/json' % container_uuid,
+                                     missing_ok=True)
+        if result is None:
+            return
+        return result.get('State')
+
+    @wrap_container_exception
+    async def restart(self, container_uuid):
+        return await self._action(container_uuid, 'restart')
+
+    @wrap_container_exception
+    async def stop(self, container_uuid):
+        return await self._action(container_uuid, 'stop')
+
+    @wrap_container_exception
+    async def start(self, container_uuid):
+        return await self._action(container_uuid, 'start')
+
+    @wrap_container_exception
+    async def pause(self, container_uuid):
+        return await self._action(container_uuid, 'pause')
+
+    @wrap_container_exception
+    async def unpause(self, container_uuid):
+        return await self._action(container_uuid, 'unpause')
+
+    @wrap_container_exception
+    async def logs(self, container_uuid):
+        LOG.debug("container_logs %s", container_uuid)
+        output = await self._request(
+            'GET', '/containers/%s/logs' % container_uuid,
+            params={'stdout': '1', 'stderr': '1'}, result='raw')
+        return {'output': demultiplex(output or b'')}
+
+    @wrap_container_exception
+    async def execute(self, container_uuid, command):
+        LOG.debug("container_exec %s command %s",
+                  container_uuid, command)
+        if not isinstance(command, list):
+            command = shlex.split(command)
+        exec_res = await self._request(
+            'POST', '/containers/%s/exec' % container_uuid,
+            json={'Cmd': command, 'AttachStdout': True,
+                  'AttachStderr': True, 'Tty': False})
+        output = await self._request(
+            'POST', '/exec/%s/start' % exec_res['Id'],
+            json={'Detach': False, 'Tty': False}, result='raw')
+        return {'output': demultiplex(output or b'')}
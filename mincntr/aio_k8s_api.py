@@ -0,0 +1,151 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""asyncio Kubernetes backend talking to the apiserver through aiohttp.
+
+Requires Python 3.5 or later and the ``aio`` extra (aiohttp).
+"""
+
+import logging
+import os
+import shlex
+
+import aiohttp
+
+from mincntr import api as mincntr_api
+from mincntr import utils
+
+LOG = logging.getLogger(__name__)
+
+# Channel numbers of the v4.channel.k8s.io exec subprotocol.
+STDOUT_CHANNEL = 1
+STDERR_CHANNEL = 2
+
+DELETE_OPTIONS = {'apiVersion': 'v1', 'kind': 'DeleteOptions',
+                  'gracePeriodSeconds': 0}
+
+
+class AsyncKubernetesAPI(mincntr_api.AsyncAPIBase):
+    """Kubernetes backend sharing one aiohttp session per instance.
+
+    ``url`` defaults to ``KUBERNETES_MASTER``, then to the local
+    insecure port of the apiserver.
+    """
+
+    def __init__(self, url=None, namespace='default', timeout=60,
+                 limit=100):
+        url = url or os.getenv('KUBERNETES_MASTER', 'http://127.0.0.1:8080/')
+        self._base_url = url.rstrip('/')
+        self._namespace = namespace
+        self._timeout = timeout
+        self._limit = limit
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._limit),
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _pod_path(self, name=''):
+        path = '/api/v1/namespaces/%s/pods' % self._namespace
+        if name:
+            path += '/' + name
+        return path
+
+    async def _request(self, method, path, result='json', missing_ok=False,
+                       **kwargs):
+        session = self._get_session()
+        async with session.request(method, self._base_url + path,
+                                   **kwargs) as resp:
+            if missing_ok and resp.status == 404:
+                return None
+            resp.raise_for_status()
+            if result == 'json':
+                return await resp.json()
+            return await resp.read()
+
+    async def list(self):
+        pods = await self._request('GET', '/api/v1/pods')
+        # No details loader: inspect() is the coroutine for those.
+        return [mincntr_api.pod_container(item) for item in pods['items']]
+
+    async def create(self, name, image, **kwargs):
+        pod_manifest = {'apiVersion': 'v1',
+                        'kind': 'Pod',
+                        'metadata': {'color': 'blue',
+                                     'name': name},
+                        'spec': {'containers': [
+                            utils.pod_container_spec(name, image, **kwargs)]}}
+        return await self._request('POST', self._pod_path(),
+                                   json=pod_manifest)
+
+    async def start(self, container_uuid):
+        pass
+
+    async def stop(self, container_uuid):
+        pass
+
+    async def restart(self, container_uuid):
+        pass
+
+    async def pause(self, container_uuid):
+        pass
+
+    async def unpause(self, container_uuid):
+        pass
+
+    async def delete(self, container_uuid):
+        return await self._request('DELETE', self._pod_path(container_uuid),
+                                   missing_ok=True, json=DELETE_OPTIONS)
+
+    async def inspect(self, container_uuid):
+        pod = await self._request('GET', self._pod_path(container_uuid),
+                                  missing_ok=True)
+        if pod is None:
+            return
+        return pod.get('status')
+
+    async def logs(self, container_uuid):
+        output = await self._request(
+            'GET', self._pod_path(container_uuid) + '/log', result='raw')
+        return {'output': output}
+
+    async def execute(self, container_uuid, command):
+        if not isinstance(command, list):
+            command = shlex.split(command)
+        params = [('stdout', 'true'), ('stderr', 'true')]
+        params.extend(('command', arg) for arg in command)
+        url = self._base_url + self._pod_path(container_uuid) + '/exec'
+        output = []
+        session = self._get_session()
+        async with session.ws_connect(
+                url, params=params,
+                protocols=('v4.channel.k8s.io',)) as ws:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.BINARY or not msg.data:
+                    continue
+                if msg.data[0] in (STDOUT_CHANNEL, STDERR_CHANNEL):
+                    output.append(msg.data[1:])
+        return {'output': b''.join(output)}
@@ -10,15 +10,676 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import calendar
 import collections
+from concurrent import futures
+import logging
+import posixpath
+import threading
+import time
 
 import abc
 import six
+from six.moves import queue
+
+from mincntr import instrumentation
+from mincntr import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class Container(object):
+    """A container as listed by a backend.
+
+    uuid, name, image, state (one of the wait_for() states) and created
+    (seconds since the epoch) come from the list response; fields the
+    backend does not report are None.  details is the full inspect data
+    of the backend, fetched by load(container) on first access and kept.
+
+    Records compare by uuid and name, so two listings of the same
+    container are equal.  For callers of the former
+    namedtuple('Container', ['uuid', 'name']) they still behave as that
+    pair: they unpack, index, compare equal to it and have _asdict().
+    """
+
+    # No per-record __dict__: large inventories stay small.
+    __slots__ = ('uuid', 'name', 'image', 'state', 'created',
+                 '_load', '_details')
+
+    _fields = ('uuid', 'name')
+
+    def __init__(self, uuid, name, image=None, state=None, created=None,
+                 load=None):
+        self.uuid = uuid
+        self.name = name
+        self.image = image
+        self.state = state
+        self.created = created
+        self._load = load
+        self._details = None
+
+    @property
+    def details(self):
+        """Inspect data of the container, or None if it is gone."""
+        if self._details is None and self._load is not None:
+            self._details = self._load(self)
+        return self._details
+
+    def _key(self):
+        return (self.uuid, self.name)
+
+    def __eq__(self, other):
+        if isinstance(other, Container):
+            return self._key() == other._key()
+        if isinstance(other, tuple):
+            return self._key() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __iter__(self):
+        return iter(self._key())
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return self._key()[index]
+
+    def _asdict(self):
+        return collections.OrderedDict(zip(self._fields, self._key()))
+
+    def __repr__(self):
+        return ('Container(uuid=%r, name=%r, image=%r, state=%r, '
+                'created=%r)' % (self.uuid, self.name, self.image,
+                                 self.state, self.created))
+
+
+# Outcome of one item of a bulk operation: exactly one of result and
+# error is set.
+BulkResult = collections.namedtuple('BulkResult', ['item', 'result', 'error'])
+
+DEFAULT_CONCURRENCY = 10
+
+# Size of the pieces file copies are streamed in.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Resource usage of a container at a point in time (seconds since the
+# epoch, taken when the sample was received).  cpu_percent is relative
+# to one CPU; the byte counters are cumulative.  Fields a backend does
+# not report are None.
+StatsSample = collections.namedtuple('StatsSample', [
+    'item', 'timestamp', 'cpu_percent', 'memory_usage', 'memory_limit',
+    'rx_bytes', 'tx_bytes', 'read_bytes', 'write_bytes'])
+
+DEFAULT_STATS_INTERVAL = 10
+
+# Stream identifiers used by streaming exec; Docker frames and the
+# Kubernetes channel protocol number them the same way.
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+
+# Further event kinds of execute_many(): a container's command exited,
+# with its exit code as data, or could not be run, with the exception.
+EXIT = 'exit'
+ERROR = 'error'
+
+# One piece of execute_many() output, tagged with its container.
+ExecEvent = collections.namedtuple('ExecEvent', ['item', 'stream', 'data'])
+
+# Container states understood by wait_for().  A container that does not
+# exist (any more) is DELETED.
+CREATED = 'created'
+RUNNING = 'running'
+PAUSED = 'paused'
+STOPPED = 'stopped'
+DELETED = 'deleted'
+STATES = (CREATED, RUNNING, PAUSED, STOPPED, DELETED)
+
+
+# Container records from list responses, shared by the blocking and the
+# asyncio backends.
+
+def docker_summary_state(entry):
+    """State of a Docker containers/json entry."""
+    state = entry.get('State')
+    if state:
+        return {'created': CREATED,
+                'running': RUNNING,
+                'restarting': RUNNING,
+                'paused': PAUSED}.get(state, STOPPED)
+    # Before API 1.23 only the human readable status is there.
+    status = entry.get('Status') or ''
+    if status.startswith('Up'):
+        return PAUSED if '(Paused)' in status else RUNNING
+    if status.startswith('Created') or not status:
+        return CREATED
+    return STOPPED
+
+
+def docker_summary_container(entry, load=None):
+    """Container of a Docker containers/json entry."""
+    names = entry.get('Names') or ['']
+    return Container(entry['Id'], names[0].lstrip('/'),
+                     image=entry.get('Image'),
+                     state=docker_summary_state(entry),
+                     created=entry.get('Created'), load=load)
+
+
+# Pod phase -> container state.
+_PHASE_STATES = {'Pending': CREATED,
+                 'Running': RUNNING,
+                 'Succeeded': STOPPED,
+                 'Failed': STOPPED}
+
+
+def _parse_time(value):
+    """Seconds since the epoch of an API timestamp, or None."""
+    if not value:
+        return None
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def pod_container(pod, load=None):
+    """Container of a decoded Kubernetes pod."""
+    metadata = pod.get('metadata') or {}
+    containers = (pod.get('spec') or {}).get('containers') or [{}]
+    return Container(
+        metadata.get('uid'), metadata.get('name'),
+        image=containers[0].get('image'),
+        state=_PHASE_STATES.get((pod.get('status') or {}).get('phase')),
+        created=_parse_time(metadata.get('creationTimestamp')), load=load)
+
+
+class ExecTimeout(Exception):
+    pass
+
+
+class ExecStream(object):
+    """Output of a running command as an iterator of (stream, data).
+
+    exit_code stays None until the iterator is exhausted.  When timeout
+    is given and runs out, iteration raises ExecTimeout; backends also
+    apply it as read timeout so a silent command cannot block forever.
+    """
+
+    def __init__(self, chunks, get_exit_code, close=None, timeout=None):
+        self._chunks = chunks
+        self._get_exit_code = get_exit_code
+        self._close = close
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = time.time() + timeout
+        self.exit_code = None
+
+    def _expired(self):
+        return self._deadline is not None and time.time() >= self._deadline
+
+    def __iter__(self):
+        try:
+            try:
+                for item in self._chunks:
+                    yield item
+                    if self._expired():
+                        raise ExecTimeout()
+            except ExecTimeout:
+                raise
+            except Exception:
+                if self._expired():
+                    raise ExecTimeout()
+                raise
+            self.exit_code = self._get_exit_code()
+        finally:
+            if self._close is not None:
+                self._close()
+
+
+class ExecManyStream(object):
+    """Merged output of one command run in many containers.
+
+    Iterating yields an ExecEvent for every chunk of STDOUT or STDERR as
+    it arrives, then one EXIT or ERROR event per container as it
+    finishes; exit_codes and errors fill in along the way.  open_stream
+    returns the ExecStream of one item and is called with at most
+    concurrency streams open.  Output is buffered up to buffer_size
+    events; stopping iteration early cancels the remaining execs.
+    """
+
+    def __init__(self, items, open_stream, concurrency=DEFAULT_CONCURRENCY,
+                 buffer_size=1000):
+        self._items = list(items)
+        self._open_stream = open_stream
+        self._concurrency = max(1, min(concurrency, len(self._items) or 1))
+        self._events = queue.Queue(buffer_size)
+        self._cancelled = threading.Event()
+        self.exit_codes = {}
+        self.errors = {}
+
+    def _put(self, event):
+        while not self._cancelled.is_set():
+            try:
+                self._events.put(event, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, item):
+        if self._cancelled.is_set():
+            return
+        try:
+            stream = self._open_stream(item)
+            chunks = iter(stream)
+            try:
+                for stream_id, data in chunks:
+                    if not self._put(ExecEvent(item, stream_id, data)):
+                        return
+            finally:
+                # Closes the exec connection when cancelled midway.
+                chunks.close()
+        except Exception as e:
+            self._put(ExecEvent(item, ERROR, e))
+        else:
+            self._put(ExecEvent(item, EXIT, stream.exit_code))
+
+    def __iter__(self):
+        if not self._items:
+            return
+        pool = futures.ThreadPoolExecutor(max_workers=self._concurrency)
+        try:
+            for item in self._items:
+                pool.submit(self._run, item)
+            pending = len(self._items)
+            while pending:
+                event = self._events.get()
+                if event.stream == EXIT:
+                    self.exit_codes[event.item] = event.data
+                    pending -= 1
+                elif event.stream == ERROR:
+                    self.errors[event.item] = event.data
+                    pending -= 1
+                yield event
+        finally:
+            self._cancelled.set()
+            pool.shutdown(wait=False)
+
+
+class StateWaiter(object):
+    """Containers a wait_for() call is still waiting on.
+
+    Backends call check() with a function returning the current state
+    of a container every time their view of the containers changes,
+    always under the same lock.  A container is done once it has been
+    seen in the wanted state, even if it leaves it again later.
+    """
+
+    def __init__(self, containers, state):
+        if state not in STATES:
+            raise ValueError("Unknown container state %r" % state)
+        if isinstance(containers, six.string_types):
+            containers = [containers]
+        self.state = state
+        self._pending = set(containers)
+        self._done = threading.Event()
+
+    def check(self, get_state):
+        self._pending = set(c for c in self._pending
+                            if get_state(c) != self.state)
+        if not self._pending:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+def _check_tar(stream, errors, container_uuid):
+    """Raise if the tar run by a default archive method failed."""
+    if stream.exit_code:
+        raise Exception("tar failed in container %s with exit code %s: %s"
+                        % (container_uuid, stream.exit_code,
+                           b''.join(errors).decode('utf-8', 'replace')))
+
+
+def downsample(samples, interval):
+    """Keep at most one StatsSample per container every interval seconds."""
+    last = {}
+    for sample in samples:
+        previous = last.get(sample.item)
+        if previous is None or sample.timestamp - previous >= interval:
+            last[sample.item] = sample.timestamp
+            yield sample
+
+
+class _Window(object):
+    """Running aggregate of the samples of one container and window."""
+
+    def __init__(self, start):
+        self.start = start
+        self.cpu_sum = 0.0
+        self.cpu_count = 0
+        self.memory_peak = None
+        self.last = None
+
+    def add(self, sample):
+        if sample.cpu_percent is not None:
+            self.cpu_sum += sample.cpu_percent
+            self.cpu_count += 1
+        if sample.memory_usage is not None:
+            self.memory_peak = max(self.memory_peak or 0,
+                                   sample.memory_usage)
+        self.last = sample
+
+    def result(self):
+        cpu_percent = None
+        if self.cpu_count:
+            cpu_percent = self.cpu_sum / self.cpu_count
+        return self.last._replace(timestamp=self.start,
+                                  cpu_percent=cpu_percent,
+                                  memory_usage=self.memory_peak)
+
+
+def aggregate(samples, window):
+    """Combine the StatsSamples of each container per window seconds.
+
+    Yields one sample per container and window, stamped with the start
+    of the window: the mean CPU, the peak memory and the latest
+    counters.  A window is yielded once a later sample of its container
+    arrives, or when samples ends.  Only a running total is kept.
+    """
+    windows = {}
+    for sample in samples:
+        start = sample.timestamp - sample.timestamp % window
+        current = windows.get(sample.item)
+        if current is not None and current.start != start:
+            yield current.result()
+            current = None
+        if current is None:
+            current = windows[sample.item] = _Window(start)
+        current.add(sample)
+    for current in windows.values():
+        yield current.result()
+
+
+def run_many(func, items, concurrency=DEFAULT_CONCURRENCY):
+    """Call func on every item with at most concurrency calls in flight.
+
+    Returns a list of BulkResult in the order of items.  An exception
+    raised for one item is recorded in its BulkResult and does not
+    affect the others.
+    """
+    items = list(items)
+    if not items:
+        return []
+    concurrency = max(1, min(concurrency, len(items)))
+    func = instrumentation.propagate(func)
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        fs = [pool.submit(func, item) for item in items]
+        results = []
+        for item, f in zip(items, fs):
+            error = f.exception()
+            if error is not None:
+                results.append(BulkResult(item, None, error))
+            else:
+                results.append(BulkResult(item, f.result(), None))
+    return results
 
-Container = collections.namedtuple('Container', ['uuid', 'name'])
 
 @six.add_metaclass(abc.ABCMeta)
 class APIBase(object):
+    # Name of the backend in metrics, and where instrumented calls report
+    # to; see mincntr.instrumentation.
+    BACKEND = None
+    _instrumentation = instrumentation.NOOP
+
+    @abc.abstractmethod
+    def list(self):
+        pass
+
+    @abc.abstractmethod
+    def create(self, name, image, **kwargs):
+        pass
+
+    @abc.abstractmethod
+    def start(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def stop(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def restart(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def pause(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def unpause(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def inspect(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def logs(self, container_uuid):
+        pass
+
+    @abc.abstractmethod
+    def execute(self, container_uuid, command):
+        pass
+
+    def stream_logs(self, container_uuid, since=None, tail=None,
+                    timestamps=False, follow=False, lines=False):
+        """Iterate over the logs of a container without buffering them.
+
+        since is a UNIX timestamp or datetime, tail a number of lines.
+        With follow the iterator keeps waiting for new output; with
+        lines it yields whole lines instead of chunks as they arrive.
+
+        Backends that cannot stream fall back to a single logs() chunk.
+        """
+        chunks = iter([self.logs(container_uuid)['output']])
+        if lines:
+            return utils.iter_lines(chunks)
+        return chunks
+
+    def stream_execute(self, container_uuid, command, stdin=None,
+                       timeout=None):
+        """Run command and return an ExecStream of its output.
+
+        stdin may be a byte string, a file object or an iterable of byte
+        strings; it is fed to the command while output is read.
+
+        Backends that cannot stream fall back to execute(), with the
+        whole output as one STDOUT chunk and no exit code.
+        """
+        output = self.execute(container_uuid, command)['output']
+        return ExecStream(iter([(STDOUT, output)]), lambda: None)
+
+    def get_archive(self, container_uuid, path,
+                    chunk_size=STREAM_CHUNK_SIZE):
+        """Iterate over a tar archive of path, a file or directory.
+
+        The archive is streamed: only one chunk, of at most chunk_size
+        bytes on backends with an archive endpoint, is held at a time.
+
+        Backends without one run tar in the container through
+        stream_execute(), so the image needs a tar binary.
+        """
+        path = path.rstrip('/') or '/'
+        directory, name = posixpath.split(path)
+        stream = self.stream_execute(
+            container_uuid,
+            ['tar', 'cf', '-', '-C', directory or '/', name or '.'])
+        errors = []
+        for stream_id, data in stream:
+            if stream_id == STDOUT:
+                yield data
+            elif len(errors) < 16:
+                errors.append(data)
+        _check_tar(stream, errors, container_uuid)
+
+    def put_archive(self, container_uuid, path, data,
+                    chunk_size=STREAM_CHUNK_SIZE):
+        """Extract a tar archive into the directory path.
+
+        data is a byte string, a file object or an iterable of byte
+        strings, sent on in pieces of chunk_size bytes as it is read.
+        Backends without an archive endpoint run tar like get_archive().
+        """
+        stream = self.stream_execute(
+            container_uuid, ['tar', 'xf', '-', '-C', path],
+            stdin=utils.iter_chunks(data, chunk_size))
+        errors = []
+        for stream_id, chunk in stream:
+            if stream_id == STDERR and len(errors) < 16:
+                errors.append(chunk)
+        _check_tar(stream, errors, container_uuid)
+        return True
+
+    def stats(self, container_uuid, interval=None):
+        """Iterate over StatsSamples of a container until closed.
+
+        Backends with a stats stream follow it, keeping at most one
+        sample every interval seconds if interval is given.  The others
+        poll every interval, DEFAULT_STATS_INTERVAL by default.
+        """
+        return self.stats_many([container_uuid],
+                               interval or DEFAULT_STATS_INTERVAL)
+
+    def stats_many(self, container_uuids, interval=DEFAULT_STATS_INTERVAL,
+                   window=None, concurrency=DEFAULT_CONCURRENCY):
+        """Sample many containers every interval seconds, until closed.
+
+        Every round takes one sample per container, with at most
+        concurrency requests in flight over the backend's pooled
+        connections, rather than keeping a full-rate stream open per
+        container.  Containers that cannot be sampled are left out of
+        the round.  With window, the samples are aggregate()d.
+        """
+        samples = self._poll_stats(list(container_uuids), interval,
+                                   concurrency)
+        if window:
+            return aggregate(samples, window)
+        return samples
+
+    def _poll_stats(self, container_uuids, interval, concurrency):
+        while True:
+            started = time.time()
+            for sample in self._sample_stats(container_uuids, concurrency):
+                yield sample
+            time.sleep(max(0, interval - (time.time() - started)))
+
+    def _sample_stats(self, container_uuids, concurrency):
+        """Return one StatsSample per container that could be sampled.
+
+        Backends that can sample many containers in one request
+        override this; the default calls _sample_stat() per container.
+        """
+        samples = []
+        for result in run_many(self._sample_stat, container_uuids,
+                               concurrency):
+            if result.error is not None:
+                LOG.debug("Could not sample %s: %s", result.item,
+                          result.error)
+            elif result.result is not None:
+                samples.append(result.result)
+        return samples
+
+    def _sample_stat(self, container_uuid):
+        """Return one StatsSample of a container, or None."""
+        raise NotImplementedError()
+
+    @instrumentation.instrumented
+    def execute_many(self, container_uuids, command,
+                     concurrency=DEFAULT_CONCURRENCY, timeout=None):
+        """Run command in many containers, at most concurrency at once.
+
+        Returns an ExecManyStream of their interleaved output and exit
+        codes.  timeout applies to each container as in
+        stream_execute().  The execs run as the stream is read, after
+        this call returned, and are not part of it in instrumentation.
+        """
+        return ExecManyStream(
+            container_uuids,
+            lambda container_uuid: self.stream_execute(
+                container_uuid, command, timeout=timeout),
+            concurrency)
+
+    def wait_for(self, containers, state, timeout=None):
+        """Wait until one container, or each of a list, reaches state.
+
+        state is one of STATES.  Returns True once every container has
+        been seen in that state, or False when timeout seconds pass
+        first.  Backends follow their event stream rather than polling.
+        """
+        raise NotImplementedError()
+
+    # Bulk operations.  Each returns one BulkResult per item, in order.
+
+    @instrumentation.instrumented
+    def create_many(self, specs, concurrency=DEFAULT_CONCURRENCY):
+        """Create containers from dicts of create() keyword arguments."""
+        return run_many(lambda spec: self.create(**spec), specs,
+                        concurrency)
+
+    @instrumentation.instrumented
+    def start_many(self, container_uuids, concurrency=DEFAULT_CONCURRENCY):
+        return self._action_many('start', container_uuids, concurrency)
+
+    @instrumentation.instrumented
+    def stop_many(self, container_uuids, concurrency=DEFAULT_CONCURRENCY):
+        return self._action_many('stop', container_uuids, concurrency)
+
+    @instrumentation.instrumented
+    def restart_many(self, container_uuids,
+                     concurrency=DEFAULT_CONCURRENCY):
+        return self._action_many('restart', container_uuids, concurrency)
+
+    @instrumentation.instrumented
+    def pause_many(self, container_uuids, concurrency=DEFAULT_CONCURRENCY):
+        return self._action_many('pause', container_uuids, concurrency)
+
+    @instrumentation.instrumented
+    def unpause_many(self, container_uuids,
+                     concurrency=DEFAULT_CONCURRENCY):
+        return self._action_many('unpause', container_uuids, concurrency)
+
+    @instrumentation.instrumented
+    def delete_many(self, container_uuids, concurrency=DEFAULT_CONCURRENCY):
+        return self._action_many('delete', container_uuids, concurrency)
+
+    def _action_many(self, action, container_uuids, concurrency):
+        """Run a single-container action over many containers.
+
+        Backends that can resolve names up front, or batch the action
+        server side, override this.
+        """
+        return run_many(getattr(self, action), container_uuids, concurrency)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class AsyncAPIBase(object):
+    """Non-blocking counterpart of APIBase.
+
+    Every method is a coroutine and has the same meaning and return
+    value as its APIBase namesake.  Implementations live in the
+    ``aio_*`` modules and need Python 3.5 or later.
+    """
+
     @abc.abstractmethod
     def list(self):
         pass
@@ -61,4 +722,8 @@ class APIBase(object):
 
     @abc.abstractmethod
     def execute(self, container_uuid, command):
-        pass
\ No newline at end of file
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
@@ -10,25 +10,48 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import collections
+import copy
+from concurrent import futures
 import contextlib
 import functools
 import logging
 import os
+import socket
+import struct
+import threading
+import time
 import uuid
 
-from distutils.version import StrictVersion
+import requests
 import six
 
 import docker
 from docker import client
 from docker import errors
 from docker import tls
+from docker.unixconn import unixconn
 
-import api
+from mincntr import api
+from mincntr import instrumentation
+from mincntr import scheduler
+from mincntr import utils
 
 LOG = logging.getLogger(__name__)
 
 
+_parsed_versions = {}
+
+
+def _parse_version(version):
+    try:
+        return _parsed_versions[version]
+    except KeyError:
+        parsed = tuple(int(part) for part in version.split('.'))
+        _parsed_versions[version] = parsed
+        return parsed
+
+
 def compare_version(v1, v2):
     """Compare docker versions
 
@@ -41,8 +64,8 @@ def compare_version(v1, v2):
     >>> compare_version(v2, v2)
     0
     """
-    s1 = StrictVersion(v1)
-    s2 = StrictVersion(v2)
+    s1 = _parse_version(v1)
+    s2 = _parse_version(v2)
     if s1 == s2:
         return 0
     elif s1 > s2:
@@ -51,28 +74,276 @@ def compare_version(v1, v2):
         return 1
 
 
+_library_versions = {}
+
+
 def is_docker_library_version_atleast(version):
-    if compare_version(docker.version, version) <= 0:
-        return True
-    return False
+    # The installed library cannot change under us, so remember answers.
+    try:
+        return _library_versions[version]
+    except KeyError:
+        result = compare_version(docker.version, version) <= 0
+        _library_versions[version] = result
+        return result
+
+
+DockerFeatures = collections.namedtuple('DockerFeatures', [
+    'api_version',
+    'supports_host_config',
+    'supports_exec',
+    'supports_stats',
+    'supports_stats_oneshot',
+    'supports_archive',
+])
+
+
+def negotiate_features(docker):
+    """Work out what the daemon and the library both support.
+
+    Requests go out with the client's pinned API version, so the usable
+    version is the lower of that and the daemon's.
+    """
+    server_version = docker.version(api_version=False)['ApiVersion']
+    api_version = server_version
+    if compare_version(docker.api_version, server_version) > 0:
+        api_version = docker.api_version
+
+    def atleast(version):
+        return compare_version(api_version, version) <= 0
 
+    return DockerFeatures(
+        api_version=api_version,
+        supports_host_config=atleast('1.19'),
+        supports_exec=(atleast('1.15') and
+                       is_docker_library_version_atleast('1.2.0')),
+        supports_stats=atleast('1.17'),
+        supports_stats_oneshot=atleast('1.19'),
+        supports_archive=atleast('1.20'),
+    )
 
-def is_docker_api_version_atleast(docker, version):
-    if compare_version(docker.version()['ApiVersion'], version) <= 0:
-        return True
-    return False
 
+PULL_ALWAYS = 'always'
+PULL_IF_NOT_PRESENT = 'if-not-present'
+PULL_NEVER = 'never'
+PULL_POLICIES = (PULL_ALWAYS, PULL_IF_NOT_PRESENT, PULL_NEVER)
+
+
+def default_pull_policy(image):
+    """Pull floating tags every time, anything else only when missing."""
+    image_repo, image_tag = utils.parse_docker_image(image)
+    if image_tag in (None, 'latest'):
+        return PULL_ALWAYS
+    return PULL_IF_NOT_PRESENT
+
+
+class ImageCache(object):
+    """Cache of locally present image IDs with single-flight pulls.
+
+    Entries expire after ``ttl`` seconds so images removed behind our
+    back are noticed eventually.  Concurrent pulls of the same image
+    are merged: one pull runs and the other callers wait for it.
+    """
+
+    def __init__(self, ttl=60):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._images = {}
+        self._pulls = utils.SingleFlight()
+
+    def get(self, image):
+        with self._lock:
+            entry = self._images.get(image)
+            if entry is None:
+                return None
+            image_id, expires = entry
+            if expires < time.time():
+                del self._images[image]
+                return None
+            return image_id
+
+    def put(self, image, image_id):
+        with self._lock:
+            self._images[image] = (image_id, time.time() + self._ttl)
+
+    def invalidate(self, image=None):
+        with self._lock:
+            if image is None:
+                self._images.clear()
+            else:
+                self._images.pop(image, None)
 
-def parse_docker_image(image):
-    image_parts = image.split(':', 1)
+    def ensure(self, docker, image, policy=None):
+        """Make sure image is present locally and return its ID."""
+        policy = policy or default_pull_policy(image)
+        if policy not in PULL_POLICIES:
+            raise ValueError("Unknown pull policy %s" % policy)
 
-    image_repo = image_parts[0]
-    image_tag = None
+        if policy != PULL_ALWAYS:
+            image_id = self.get(image)
+            if image_id:
+                return image_id
+            try:
+                image_id = docker.inspect_image(image)['Id']
+            except errors.NotFound:
+                if policy == PULL_NEVER:
+                    raise
+            else:
+                self.put(image, image_id)
+                return image_id
+
+        return self._pulls.do(image, self._pull, docker, image)
+
+    def _pull(self, docker, image):
+        image_repo, image_tag = utils.parse_docker_image(image)
+        docker.pull(image_repo, tag=image_tag)
+        # pull() reports failures in its output; inspect raises instead.
+        image_id = docker.inspect_image(image)['Id']
+        self.put(image, image_id)
+        return image_id
+
+
+class InspectCache(object):
+    """Short lived cache of container inspect data.
+
+    Entries are keyed by container ID and expire after ``ttl`` seconds;
+    mutating calls invalidate them right away.  Concurrent misses for
+    the same container are merged into one inspect request.  Every
+    caller gets its own copy of the cached dict.
+    """
+
+    def __init__(self, ttl=1):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inspects = utils.SingleFlight()
+        # Bumped by every invalidation, so that requests sent before it
+        # are neither joined nor cached.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    def get(self, docker_id):
+        with self._lock:
+            entry = self._entries.get(docker_id)
+            if entry is not None and entry[1] < time.time():
+                del self._entries[docker_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def invalidate(self, docker_id=None):
+        with self._lock:
+            self._generation += 1
+            if docker_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(docker_id, None)
+
+    def stats(self):
+        """Dict of the hits, misses, requests (misses that reached the
+        daemon, the others joined one in flight) and current size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'requests': self.requests, 'size': len(self._entries)}
+
+    def fetch(self, docker, name_or_id):
+        """Inspect data of a container, or None if there is none."""
+        info = self.get(name_or_id)
+        if info is None:
+            with self._lock:
+                generation = self._generation
+            info = self._inspects.do((name_or_id, generation), self._inspect,
+                                     docker, name_or_id, generation)
+        return copy.deepcopy(info)
+
+    def _inspect(self, docker, name_or_id, generation):
+        with self._lock:
+            self.requests += 1
+        try:
+            info = docker.inspect_container(name_or_id)
+        except errors.NotFound:
+            return None
+        with self._lock:
+            if self._generation == generation:
+                self._entries[info['Id']] = (info, time.time() + self._ttl)
+        return info
+
+
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class ChunkedUnixHTTPConnection(unixconn.UnixHTTPConnection):
+    """UnixHTTPConnection that can send bodies of unknown length.
+
+    urllib3 sends those, e.g. generators, through request_chunked(),
+    which the plain httplib connection of docker-py lacks.  Each chunk
+    goes out as it is, without being copied into a framing buffer.
+    """
+
+    def request_chunked(self, method, url, body=None, headers=None):
+        headers = headers or {}
+        header_keys = set(k.lower() for k in headers)
+        self.putrequest(method, url,
+                        skip_accept_encoding='accept-encoding' in header_keys,
+                        skip_host='host' in header_keys)
+        for header, value in headers.items():
+            self.putheader(header, value)
+        if 'transfer-encoding' not in header_keys:
+            self.putheader('Transfer-Encoding', 'chunked')
+        self.endheaders()
+        if isinstance(body, (bytes, six.text_type)):
+            body = [body]
+        for chunk in body or []:
+            if not chunk:
+                continue
+            if isinstance(chunk, six.text_type):
+                chunk = chunk.encode('utf-8')
+            self.send(('%x\r\n' % len(chunk)).encode('ascii'))
+            self.send(chunk)
+            self.send(b'\r\n')
+        self.send(b'0\r\n\r\n')
 
-    if len(image_parts) > 1:
-        image_tag = image_parts[1]
 
-    return image_repo, image_tag
+class ChunkedUnixHTTPConnectionPool(unixconn.UnixHTTPConnectionPool):
+
+    def _new_conn(self):
+        return ChunkedUnixHTTPConnection(self.base_url, self.socket_path,
+                                         self.timeout)
+
+
+class PooledUnixAdapter(unixconn.UnixAdapter):
+    """UnixAdapter keeping up to pool_maxsize idle connections.
+
+    The stock adapter keeps a separate single-connection pool per URL,
+    so keep-alive connections are only reused for the very same path
+    and concurrent callers open and throw away a socket per request.
+    Here one pool serves every request to the socket.
+    """
+
+    def __init__(self, socket_url, timeout=60,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        super(PooledUnixAdapter, self).__init__(socket_url, timeout)
+        self._pool_maxsize = pool_maxsize
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(self.socket_path)
+            if pool:
+                return pool
+
+            pool = ChunkedUnixHTTPConnectionPool(
+                url, self.socket_path, self.timeout)
+            pool.pool = pool.QueueCls(self._pool_maxsize)
+            for _ in range(self._pool_maxsize):
+                pool.pool.put(None)
+            self.pools[self.socket_path] = pool
+
+        return pool
 
 
 class DockerHTTPClient(client.Client):
@@ -81,7 +352,10 @@ class DockerHTTPClient(client.Client):
                  timeout=60,
                  ca_cert=None,
                  client_key=None,
-                 client_cert=None):
+                 client_cert=None,
+                 inspect_workers=10,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 scheduler=None):
 
         if ca_cert and client_key and client_cert:
             ssl_config = tls.TLSConfig(client_cert=(client_cert, client_key),
@@ -94,61 +368,574 @@ class DockerHTTPClient(client.Client):
                                                version=ver,
                                                timeout=timeout,
                                                tls=ssl_config)
+        self._resize_pool(pool_maxsize)
+        self.inspect_workers = inspect_workers
+        # scheduler.Scheduler every request waits for, if any.  Keyed by
+        # url: base_url is the same for every unix socket.
+        self.scheduler = scheduler
+        self.url = url
+        # Time of the last failure to reach the daemon; None once it
+        # answers again.
+        self.last_failure = None
+        self._features = None
+        self._features_lock = threading.Lock()
 
-    def list_instances(self, inspect=False):
-        res = []
-        for container in self.containers(all=True):
-            info = self.inspect_container(container['Id'])
-            if not info:
-                continue
-            if inspect:
-                res.append(info)
-            else:
-                res.append(info['Config'].get('Hostname'))
+    def _resize_pool(self, pool_maxsize):
+        """Keep up to pool_maxsize connections to the daemon alive."""
+        adapter = self.get_adapter(self.base_url)
+        if isinstance(adapter, unixconn.UnixAdapter):
+            self._custom_adapter = PooledUnixAdapter(
+                'http+unix://' + adapter.socket_path, adapter.timeout,
+                pool_maxsize=pool_maxsize)
+            self.mount('http+docker://', self._custom_adapter)
+        else:
+            adapter.init_poolmanager(adapter._pool_connections, pool_maxsize)
+
+    @property
+    def features(self):
+        """DockerFeatures of this connection, negotiated on first use."""
+        if self._features is None:
+            with self._features_lock:
+                if self._features is None:
+                    self._features = negotiate_features(self)
+        return self._features
+
+    def reconnect(self):
+        """Drop pooled connections; the daemon may have been upgraded."""
+        self.close()
+        with self._features_lock:
+            self._features = None
+
+    def send(self, request, **kwargs):
+        stream = kwargs.pop('stream', False)
+        with scheduler.slot(self.scheduler, self.url,
+                            request.method) as ticket:
+            try:
+                # Only up to the headers: the body is read outside the
+                # slot, below or by the caller.
+                response = super(DockerHTTPClient, self).send(
+                    request, stream=True, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.last_failure = time.time()
+                if isinstance(e, requests.ConnectionError):
+                    # The daemon may come back as another version.  No
+                    # lock: negotiate_features() itself gets here.
+                    self._features = None
+                raise
+            ticket.status = response.status_code
+        self.last_failure = None
+        body = request.body
+        sent = len(body) if isinstance(body, (bytes, six.text_type)) else 0
+        if stream:
+            # Not read yet; only the announced length is known.
+            received = int(response.headers.get('Content-Length') or 0)
+        else:
+            received = len(response.content)
+        instrumentation.record_request(sent, received)
+        return response
+
+    def _inspect_or_none(self, docker_id):
+        try:
+            return self.inspect_container(docker_id)
+        except errors.NotFound:
+            # Removed between the listing and the inspect.
+            return None
+
+    def list_instances(self, inspect=False, summary=False, max_workers=None):
+        """List all containers on the daemon, in daemon order.
+
+        With ``summary`` the ``containers()`` entries are returned as they
+        are, which costs a single round trip.  Otherwise every container
+        is inspected through a pool of ``max_workers`` threads (defaulting
+        to ``inspect_workers``) and either the inspect data or the
+        hostname is returned.
+        """
+        containers = self.containers(all=True)
+        if summary:
+            return containers
+        if not containers:
+            return []
+
+        max_workers = min(max_workers or self.inspect_workers,
+                          len(containers))
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            inspect_container = instrumentation.propagate(
+                self._inspect_or_none)
+            infos = pool.map(inspect_container,
+                             [c['Id'] for c in containers])
+            res = []
+            for info in infos:
+                if not info:
+                    continue
+                if inspect:
+                    res.append(info)
+                else:
+                    res.append(info['Config'].get('Hostname'))
         return res
 
 
+STREAM_HEADER_SIZE_BYTES = 8
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _read_exactly(raw, size):
+    data = raw.read(size)
+    while data and len(data) < size:
+        more = raw.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def demultiplex_stream(raw, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield (stream, data) pairs from a multiplexed attach stream.
+
+    Frame payloads are read straight off ``raw`` in pieces of at most
+    chunk_size bytes, so memory use does not depend on frame size.
+    """
+    while True:
+        header = _read_exactly(raw, STREAM_HEADER_SIZE_BYTES)
+        if len(header) < STREAM_HEADER_SIZE_BYTES:
+            return
+        stream, length = struct.unpack('>BxxxL', header)
+        while length:
+            data = raw.read(min(length, chunk_size))
+            if not data:
+                return
+            length -= len(data)
+            yield stream, data
+
+
+def _stats_sample(container_uuid, stats):
+    """StatsSample from a /containers/{id}/stats document."""
+    cpu = stats.get('cpu_stats') or {}
+    precpu = stats.get('precpu_stats') or {}
+    cpu_percent = None
+    system_delta = ((cpu.get('system_cpu_usage') or 0) -
+                    (precpu.get('system_cpu_usage') or 0))
+    if precpu.get('system_cpu_usage') and system_delta > 0:
+        usage = cpu.get('cpu_usage') or {}
+        cpu_delta = (usage.get('total_usage', 0) -
+                     (precpu.get('cpu_usage') or {}).get('total_usage', 0))
+        cpus = (cpu.get('online_cpus') or
+                len(usage.get('percpu_usage') or ()) or 1)
+        cpu_percent = 100.0 * cpu_delta / system_delta * cpus
+
+    # API < 1.21 reports a single "network".
+    networks = stats.get('networks')
+    if networks is None and stats.get('network'):
+        networks = {'eth0': stats['network']}
+    rx_bytes = tx_bytes = None
+    if networks is not None:
+        rx_bytes = sum(n.get('rx_bytes', 0) for n in networks.values())
+        tx_bytes = sum(n.get('tx_bytes', 0) for n in networks.values())
+
+    read_bytes = write_bytes = None
+    io = (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive')
+    if io is not None:
+        read_bytes = sum(e['value'] for e in io if e.get('op') == 'Read')
+        write_bytes = sum(e['value'] for e in io if e.get('op') == 'Write')
+
+    memory = stats.get('memory_stats') or {}
+    return api.StatsSample(container_uuid, time.time(), cpu_percent,
+                           memory.get('usage'), memory.get('limit'),
+                           rx_bytes, tx_bytes, read_bytes, write_bytes)
+
+
+def _write_stdin(sock, stdin):
+    try:
+        for chunk in utils.iter_chunks(stdin, STREAM_CHUNK_SIZE):
+            sock.sendall(chunk)
+        # Half-close so the command sees EOF on its stdin.
+        sock.shutdown(socket.SHUT_WR)
+    except Exception:
+        LOG.warning("Error while writing exec stdin", exc_info=True)
+
+
+def _strip_name(name):
+    if name and name.startswith('/'):
+        return name[1:]
+    return name
+
+
+# Container event -> state the container is in afterwards.  stop and
+# kill are always followed by die.
+_EVENT_STATES = {'create': api.CREATED,
+                 'start': api.RUNNING,
+                 'restart': api.RUNNING,
+                 'unpause': api.RUNNING,
+                 'pause': api.PAUSED,
+                 'die': api.STOPPED}
+
+
+class ContainerIndex(object):
+    """Name and ID to container ID index kept current from /events.
+
+    The index is filled from a single ``containers(all=True)`` call and
+    then updated by a background thread following the daemon event
+    stream, so resolving a container does not cost a daemon round trip.
+    Whenever the event stream drops the index is rebuilt from scratch.
+
+    It also tracks the state of every container, which lets any number
+    of wait_for() callers share the one event stream.
+    """
+
+    SHORT_ID_LENGTH = 12
+
+    def __init__(self, docker, sync_timeout=10, retry_interval=1):
+        self._docker = docker
+        self._sync_timeout = sync_timeout
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._names = {}
+        self._ids = {}
+        self._short_ids = {}
+        self._states = {}
+        self._waiters = set()
+        self._synced = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._response = None
+
+    @property
+    def synced(self):
+        return self._synced.is_set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run,
+                                            name='mincntr-docker-events')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop following events, ending the stream being read."""
+        with self._lock:
+            self._stopped = True
+            self._thread = None
+            response, self._response = self._response, None
+        self._synced.clear()
+        if response is not None:
+            # Closing the response does not wake up a blocked read.
+            try:
+                sock = self._docker._get_raw_response_socket(response)
+                getattr(sock, '_sock', sock).shutdown(socket.SHUT_RDWR)
+            except Exception:
+                LOG.debug("Could not shut the event stream down",
+                          exc_info=True)
+
+    def lookup(self, name_or_id):
+        """Return the full container ID for a name or ID, or None."""
+        if not self._synced.wait(self._sync_timeout):
+            return None
+        with self._lock:
+            return self._lookup_locked(name_or_id)
+
+    def _lookup_locked(self, name_or_id):
+        key = _strip_name(name_or_id)
+        if key in self._names:
+            return self._names[key]
+        if key in self._ids:
+            return key
+        return self._short_ids.get(key)
+
+    def count(self, state=None):
+        """Number of containers, or of those in state; None until synced."""
+        with self._lock:
+            if not self._synced.is_set():
+                return None
+            if state is None:
+                return len(self._ids)
+            return sum(1 for s in six.itervalues(self._states) if s == state)
+
+    def state(self, name_or_id):
+        """Return the state of a container, or None until synced."""
+        with self._lock:
+            return self._state_locked(name_or_id)
+
+    def _state_locked(self, name_or_id):
+        if not self._synced.is_set():
+            return None
+        docker_id = self._lookup_locked(name_or_id)
+        if docker_id is None:
+            return api.DELETED
+        return self._states.get(docker_id)
+
+    def wait_for(self, containers, state, timeout=None):
+        """See APIBase.wait_for; containers are names or IDs."""
+        waiter = api.StateWaiter(containers, state)
+        with self._lock:
+            self._waiters.add(waiter)
+            waiter.check(self._state_locked)
+        try:
+            return waiter.wait(timeout)
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def _notify_locked(self):
+        for waiter in self._waiters:
+            waiter.check(self._state_locked)
+
+    def add(self, docker_id, name, state=None):
+        name = _strip_name(name)
+        with self._lock:
+            state = state or self._states.get(docker_id)
+            self._discard_locked(docker_id)
+            self._names[name] = docker_id
+            self._ids[docker_id] = name
+            self._short_ids[docker_id[:self.SHORT_ID_LENGTH]] = docker_id
+            if state is not None:
+                self._states[docker_id] = state
+            self._notify_locked()
+
+    def set_state(self, docker_id, state):
+        with self._lock:
+            if docker_id in self._ids:
+                self._states[docker_id] = state
+                self._notify_locked()
+
+    def discard(self, docker_id):
+        with self._lock:
+            self._discard_locked(docker_id)
+            self._notify_locked()
+
+    def _discard_locked(self, docker_id):
+        name = self._ids.pop(docker_id, None)
+        if name is not None and self._names.get(name) == docker_id:
+            del self._names[name]
+        self._short_ids.pop(docker_id[:self.SHORT_ID_LENGTH], None)
+        self._states.pop(docker_id, None)
+
+    def resync(self):
+        """Rebuild the index from a single container listing.
+
+        Returns the timestamp to resume the event stream from.  It is
+        taken before the listing so no event can fall into the gap;
+        replaying an event that is already reflected is harmless.
+        """
+        since = int(time.time()) - 1
+        names, ids, short_ids, states = {}, {}, {}, {}
+        for container in self._docker.containers(all=True):
+            docker_id = container['Id']
+            states[docker_id] = api.docker_summary_state(container)
+            for name in container.get('Names') or []:
+                # Linked containers also show up as '/other/alias'.
+                name = _strip_name(name)
+                if '/' not in name:
+                    names[name] = docker_id
+                    ids[docker_id] = name
+            ids.setdefault(docker_id, None)
+            short_ids[docker_id[:self.SHORT_ID_LENGTH]] = docker_id
+        with self._lock:
+            self._names = names
+            self._ids = ids
+            self._short_ids = short_ids
+            self._states = states
+            self._synced.set()
+            self._notify_locked()
+        return since
+
+    def handle_event(self, event):
+        if event.get('Type', 'container') != 'container':
+            return
+        status = event.get('Action') or event.get('status')
+        docker_id = event.get('id')
+        if not docker_id:
+            return
+        if status == 'destroy':
+            self.discard(docker_id)
+            return
+        if status in ('create', 'rename'):
+            actor = event.get('Actor') or {}
+            name = (actor.get('Attributes') or {}).get('name')
+            if name is None:
+                try:
+                    name = self._docker.inspect_container(docker_id)['Name']
+                except errors.NotFound:
+                    # Already gone again; its destroy event follows.
+                    return
+            self.add(docker_id, name, _EVENT_STATES.get(status))
+        elif status in _EVENT_STATES:
+            self.set_state(docker_id, _EVENT_STATES[status])
+
+    def _events(self, since):
+        """Open the event stream, keeping its response for stop()."""
+        docker = self._docker
+        response = docker.get(docker._url('/events'),
+                              params={'since': since}, stream=True)
+        docker._raise_for_status(response)
+        with self._lock:
+            if self._stopped:
+                response.close()
+                return iter(())
+            self._response = response
+        return docker._stream_helper(response, decode=True)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                since = self.resync()
+                for event in self._events(since):
+                    if self._stopped:
+                        return
+                    self.handle_event(event)
+                if self._stopped:
+                    return
+                LOG.warning("Docker event stream closed, resyncing")
+            except Exception:
+                if self._stopped:
+                    return
+                LOG.warning("Docker event stream dropped, resyncing",
+                            exc_info=True)
+                time.sleep(self._retry_interval)
+            self._synced.clear()
+
+
 def wrap_container_exception(f):
     def wrapped(self, *args, **kwargs):
         try:
             return f(self, *args, **kwargs)
         except Exception as e:
-            container_uuid = None
-            if 'container_uuid' in kwargs:
-                container_uuid = kwargs.get('container_uuid')
-            elif 'container' in kwargs:
-                container_uuid = kwargs.get('container').uuid
-
-            LOG.exception("Error while connect to docker "
-                          "container %s", container_uuid)
-            raise Exception("Docker internal Error: %s" % str(e))
+            raise utils.container_error(e, args, kwargs, LOG)
 
     return functools.wraps(f)(wrapped)
 
 
 class DockerAPI(api.APIBase):
-    def __init__(self):
-        pass
+    BACKEND = 'docker'
+
+    def __init__(self, url=None, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pull_policy=None, image_cache_ttl=60, inspect_cache_ttl=1,
+                 instrumentation=None, **client_kwargs):
+        """Docker backend.
+
+        url defaults to DOCKER_HOST, then to the local unix socket.  The
+        remaining keyword arguments (ver, timeout, TLS files, ...) are
+        passed on to DockerHTTPClient; scheduler is a
+        scheduler.Scheduler, possibly shared with other backends, that
+        paces the requests to the daemon.  instrumentation is an
+        instrumentation.Instrumentation that calls are reported to.
+        Container inspect data is reused for inspect_cache_ttl seconds,
+        unless a call made through this object changes the container.
+        """
+        if instrumentation is not None:
+            self._instrumentation = instrumentation
+        self._url = url or os.getenv('DOCKER_HOST',
+                                     'unix://var/run/docker.sock')
+        self._client_kwargs = dict(client_kwargs, pool_maxsize=pool_maxsize)
+        self._lock = threading.Lock()
+        self._pull_policy = pull_policy
+        self._images = ImageCache(ttl=image_cache_ttl)
+        self._inspects = InspectCache(ttl=inspect_cache_ttl)
+
+    # APIBase action name -> DockerHTTPClient method.
+    _ACTIONS = {'start': 'start',
+                'stop': 'stop',
+                'restart': 'restart',
+                'pause': 'pause',
+                'unpause': 'unpause',
+                'delete': 'remove_container'}
 
     _client = None
+    _index = None
 
     @contextlib.contextmanager
     def docker_for_container(self):
         if self._client is None:
-            self._client = DockerHTTPClient(
-                url=os.getenv('DOCKER_HOST', 'unix://var/run/docker.sock'))
+            with self._lock:
+                if self._client is None:
+                    self._client = DockerHTTPClient(url=self._url,
+                                                    **self._client_kwargs)
         yield self._client
 
-    @staticmethod
-    def _find_container_by_name(docker, name):
+    def close(self):
+        """Stop following daemon events and drop pooled connections.
+
+        The object can still be used afterwards; the index and the
+        daemon features are then worked out again on first use.
+        """
+        with self._lock:
+            index, self._index = self._index, None
+            client = self._client
+        if index is not None:
+            index.stop()
+        if client is not None:
+            client.reconnect()
+
+    def _container_index(self, docker):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    index = ContainerIndex(docker)
+                    index.start()
+                    self._index = index
+        return self._index
+
+    def _find_container_by_name(self, docker, name):
+        index = self._container_index(docker)
+        docker_id = index.lookup(name)
+        if docker_id:
+            return docker_id
+        # Not indexed (yet): the event may still be in flight, or the
+        # index is resyncing.  Ask the daemon for this one container.
         try:
-            for info in docker.list_instances(inspect=True):
-                if info.get('Name') == name:
-                    return info
+            info = docker.inspect_container(name)
         except errors.APIError as e:
             if e.response.status_code != 404:
                 raise
-        return {}
+            return None
+        index.add(info['Id'], info['Name'])
+        return info['Id']
+
+    def _inspect_container(self, docker, container_uuid):
+        """Cached inspect data of a container, None if there is none."""
+        index = self._container_index(docker)
+        docker_id = index.lookup(container_uuid)
+        info = self._inspects.fetch(docker, docker_id or container_uuid)
+        if info is not None and not docker_id:
+            # Not indexed (yet): the event may still be in flight.
+            index.add(info['Id'], info['Name'])
+        return info
+
+    def invalidate_inspect(self, container_uuid=None):
+        """Drop the cached inspect data of a container, or of all.
+
+        Calls made through this object that change a container do so
+        themselves; this is for changes made by other clients.
+        """
+        docker_id = None
+        if container_uuid is not None and self._index is not None:
+            docker_id = self._index.lookup(container_uuid)
+        self._inspects.invalidate(docker_id or container_uuid)
+
+    def inspect_cache_stats(self):
+        """Hit and miss counts of the inspect cache, see InspectCache."""
+        return self._inspects.stats()
+
+    @property
+    def last_failure(self):
+        """When the daemon last could not be reached, None if it answers."""
+        if self._client is None:
+            return None
+        return self._client.last_failure
+
+    def find(self, container_uuid):
+        """Return the ID of a container on this daemon, or None."""
+        with self.docker_for_container() as docker:
+            return self._find_container_by_name(docker, container_uuid)
+
+    def count(self, state=None):
+        """Containers on this daemon, or those in state, from the index.
+
+        Returns None until the index has synced.
+        """
+        with self.docker_for_container() as docker:
+            return self._container_index(docker).count(state)
 
     def _encode_utf8(self, value):
         if six.PY2 and not isinstance(value, unicode):
@@ -157,36 +944,52 @@ class DockerAPI(api.APIBase):
 
     # Container operations
 
+    @instrumentation.instrumented
     @wrap_container_exception
     def list(self):
+        """Return a Container for every container on the daemon.
+
+        Costs a single round trip; the inspect data of a container is
+        only fetched when its details are first accessed.
+        """
+        load = self._container_details
+        with self.docker_for_container() as docker:
+            return [api.docker_summary_container(container, load)
+                    for container in docker.list_instances(summary=True)]
+
+    def _container_details(self, container):
         with self.docker_for_container() as docker:
-            return docker.list_instances()
+            return self._inspect_container(docker, container.uuid)
 
+    @instrumentation.instrumented
     @wrap_container_exception
     def create(self, name, image, **kwargs):
         with self.docker_for_container() as docker:
             container_uuid = kwargs.get(uuid)
             LOG.debug('Creating container with image %s name %s', image, name)
             try:
-                image_repo, image_tag = parse_docker_image(image)
-                docker.pull(image_repo, tag=image_tag)
-                docker.inspect_image(self._encode_utf8(image))
+                self._images.ensure(docker, image,
+                                    kwargs.get('pull_policy') or
+                                    self._pull_policy)
                 container_kwargs = {'name': name,
                                     'hostname': container_uuid,
                                     'command': kwargs.get('command'),
                                     'environment': kwargs.get('environment')}
                 memory = kwargs.get('memory')
-                if is_docker_api_version_atleast(docker, '1.19'):
+                if docker.features.supports_host_config:
                     if memory is not None:
                         container_kwargs['host_config'] = {'mem_limit': memory}
                 else:
                     container_kwargs['mem_limit'] = memory
 
-                docker.create_container(image, **container_kwargs)
+                res = docker.create_container(image, **container_kwargs)
+                if name:
+                    self._container_index(docker).add(res['Id'], name)
                 return True
             except errors.APIError:
                 return False
 
+    @instrumentation.instrumented
     @wrap_container_exception
     def delete(self, container_uuid):
         LOG.debug("container_delete %s", container_uuid)
@@ -195,8 +998,12 @@ class DockerAPI(api.APIBase):
                                                      container_uuid)
             if not docker_id:
                 return None
-            return docker.remove_container(docker_id)
+            result = docker.remove_container(docker_id)
+            self._container_index(docker).discard(docker_id)
+            self._inspects.invalidate(docker_id)
+            return result
 
+    @instrumentation.instrumented
     @wrap_container_exception
     def inspect(self, container_uuid):
         LOG.debug("container_show %s", container_uuid)
@@ -204,16 +1011,14 @@ class DockerAPI(api.APIBase):
             # container = objects.Container.get_by_uuid(
             #  container_uuid)
             try:
-                docker_id = self._find_container_by_name(docker,
-                                                         container_uuid)
-                if not docker_id:
-                    LOG.exception("Can not find docker instance with %s,"
-                                  "set it to Error status",
-                                  container_uuid)
+                result = self._inspect_container(docker, container_uuid)
+                if not result:
+                    LOG.debug("Can not find docker instance with %s",
+                              container_uuid)
                     # container.status = 'ERROR'
                     # container.save()
                     # return container
-                result = docker.inspect_container(docker_id)
+                    return None
                 status = result.get('State')
                 # if status:
                 #     if status.get('Error') is True:
@@ -242,35 +1047,81 @@ class DockerAPI(api.APIBase):
         with self.docker_for_container() as docker:
             docker_id = self._find_container_by_name(docker,
                                                      container_uuid)
-            result = getattr(docker, docker_func)(docker_id)
+            try:
+                result = getattr(docker, docker_func)(docker_id)
+            finally:
+                # None would drop the whole cache.
+                if docker_id is not None:
+                    self._inspects.invalidate(docker_id)
             # container = objects.Container.get_by_uuid(
             #                                           container_uuid)
             # container.status = status
             # container.save()
             return result
 
+    def _action_many(self, action, container_uuids, concurrency):
+        container_uuids = list(container_uuids)
+        docker_func = self._ACTIONS[action]
+        with self.docker_for_container() as docker:
+            # Resolve every name once, before fanning out.
+            docker_ids = dict((container_uuid,
+                               self._find_container_by_name(docker,
+                                                            container_uuid))
+                              for container_uuid in set(container_uuids))
+            index = self._container_index(docker)
+
+            def run(container_uuid):
+                docker_id = docker_ids[container_uuid]
+                if not docker_id:
+                    if action == 'delete':
+                        return None
+                    raise Exception("Docker internal Error: container %s "
+                                    "not found" % container_uuid)
+                try:
+                    result = getattr(docker, docker_func)(docker_id)
+                finally:
+                    self._inspects.invalidate(docker_id)
+                if action == 'delete':
+                    index.discard(docker_id)
+                return result
+
+            return api.run_many(run, container_uuids, concurrency)
+
+    @instrumentation.instrumented
     def restart(self, container_uuid):
         return self._container_action(container_uuid,
                                       'RUNNING',
                                       'restart')
 
+    @instrumentation.instrumented
     def stop(self, container_uuid):
         return self._container_action(container_uuid,
                                       'STOPPED', 'stop')
 
+    @instrumentation.instrumented
     def start(self, container_uuid):
         return self._container_action(container_uuid,
                                       'RUNNING', 'start')
 
+    @instrumentation.instrumented
     def pause(self, container_uuid):
         return self._container_action(container_uuid,
                                       'PAUSED', 'pause')
 
+    @instrumentation.instrumented
     def unpause(self, container_uuid):
         return self._container_action(container_uuid,
                                       'RUNNING',
                                       'unpause')
 
+    @instrumentation.instrumented
+    @wrap_container_exception
+    def wait_for(self, containers, state, timeout=None):
+        with self.docker_for_container() as docker:
+            return self._container_index(docker).wait_for(containers, state,
+                                                          timeout)
+
+    @instrumentation.instrumented
     @wrap_container_exception
     def logs(self, container_uuid):
         LOG.debug("container_logs %s", container_uuid)
@@ -279,6 +1130,110 @@ class DockerAPI(api.APIBase):
                                                      container_uuid)
             return {'output': docker.logs(docker_id)}
 
+    @instrumentation.instrumented
+    @wrap_container_exception
+    def stream_logs(self, container_uuid, since=None, tail=None,
+                    timestamps=False, follow=False, lines=False):
+        LOG.debug("container_logs %s (streaming)", container_uuid)
+        with self.docker_for_container() as docker:
+            info = self._inspect_container(docker, container_uuid)
+            if info is None:
+                raise Exception("Docker internal Error: container %s "
+                                "not found" % container_uuid)
+            docker_id = info['Id']
+            tty = info['Config']['Tty']
+            params = {'stdout': 1, 'stderr': 1,
+                      'timestamps': timestamps and 1 or 0,
+                      'follow': follow and 1 or 0,
+                      'tail': 'all' if tail is None else tail}
+            if since is not None:
+                params['since'] = utils.to_timestamp(since)
+            response = docker._get(
+                docker._url('/containers/{0}/logs', docker_id),
+                params=params, stream=True,
+                timeout=None if follow else docker.timeout)
+            docker._raise_for_status(response)
+
+        if tty:
+            chunks = docker._stream_helper(response)
+        else:
+            chunks = (data for _, data in demultiplex_stream(response.raw))
+        if lines:
+            return utils.iter_lines(chunks)
+        return chunks
+
+    @instrumentation.instrumented
+    @wrap_container_exception
+    def stats(self, container_uuid, interval=None):
+        with self.docker_for_container() as docker:
+            docker_id = self._find_container_by_name(docker,
+                                                     container_uuid)
+            response = docker._get(
+                docker._url('/containers/{0}/stats', docker_id),
+                stream=True, timeout=None)
+            docker._raise_for_status(response)
+
+        samples = (_stats_sample(container_uuid, stats) for stats
+                   in docker._stream_helper(response, decode=True))
+        if interval:
+            return api.downsample(samples, interval)
+        return samples
+
+    def _sample_stat(self, container_uuid):
+        with self.docker_for_container() as docker:
+            docker_id = self._find_container_by_name(docker,
+                                                     container_uuid)
+            if not docker_id:
+                return None
+            url = docker._url('/containers/{0}/stats', docker_id)
+            if docker.features.supports_stats_oneshot:
+                response = docker._get(url, params={'stream': 0})
+                return _stats_sample(container_uuid,
+                                     docker._result(response, True))
+            # Older daemons always stream: take the first sample.
+            response = docker._get(url, stream=True)
+            docker._raise_for_status(response)
+            try:
+                for stats in docker._stream_helper(response, decode=True):
+                    return _stats_sample(container_uuid, stats)
+            finally:
+                response.close()
+
+    @instrumentation.instrumented
+    @wrap_container_exception
+    def get_archive(self, container_uuid, path,
+                    chunk_size=api.STREAM_CHUNK_SIZE):
+        with self.docker_for_container() as docker:
+            if not docker.features.supports_archive:
+                return super(DockerAPI, self).get_archive(
+                    container_uuid, path, chunk_size)
+            docker_id = self._find_container_by_name(docker,
+                                                     container_uuid)
+            response = docker._get(
+                docker._url('/containers/{0}/archive', docker_id),
+                params={'path': path}, stream=True)
+            docker._raise_for_status(response)
+        return response.iter_content(chunk_size)
+
+    @instrumentation.instrumented
+    @wrap_container_exception
+    def put_archive(self, container_uuid, path, data,
+                    chunk_size=api.STREAM_CHUNK_SIZE):
+        with self.docker_for_container() as docker:
+            if not docker.features.supports_archive:
+                return super(DockerAPI, self).put_archive(
+                    container_uuid, path, data, chunk_size)
+            docker_id = self._find_container_by_name(docker,
+                                                     container_uuid)
+            # A generator body goes out with chunked transfer encoding.
+            response = docker._put(
+                docker._url('/containers/{0}/archive', docker_id),
+                params={'path': path},
+                data=utils.iter_chunks(data, chunk_size))
+            docker._raise_for_status(response)
+            return response.status_code == 200
+
+    @instrumentation.instrumented
     @wrap_container_exception
     def execute(self, container_uuid, command):
         LOG.debug("container_exec %s command %s",
@@ -286,7 +1241,7 @@ class DockerAPI(api.APIBase):
         with self.docker_for_container() as docker:
             docker_id = self._find_container_by_name(docker,
                                                      container_uuid)
-            if is_docker_library_version_atleast('1.2.0'):
+            if docker.features.supports_exec:
                 create_res = docker.exec_create(docker_id, command, True,
                                                 True, False)
                 exec_output = docker.exec_start(create_res, False, False,
@@ -294,3 +1249,59 @@ class DockerAPI(api.APIBase):
             else:
                 exec_output = docker.execute(docker_id, command)
             return {'output': exec_output}
+
+    @instrumentation.instrumented
+    @wrap_container_exception
+    def stream_execute(self, container_uuid, command, stdin=None,
+                       timeout=None):
+        LOG.debug("container_exec %s command %s (streaming)",
+                  container_uuid, command)
+        with self.docker_for_container() as docker:
+            docker_id = self._find_container_by_name(docker,
+                                                     container_uuid)
+            return self._exec_stream(docker, docker_id, command, stdin,
+                                     timeout)
+
+    @instrumentation.instrumented
+    def execute_many(self, container_uuids, command,
+                     concurrency=api.DEFAULT_CONCURRENCY, timeout=None):
+        container_uuids = list(container_uuids)
+        with self.docker_for_container() as docker:
+            # Resolve every name once, before fanning out.
+            docker_ids = dict((container_uuid,
+                               self._find_container_by_name(docker,
+                                                            container_uuid))
+                              for container_uuid in set(container_uuids))
+
+        def open_stream(container_uuid):
+            docker_id = docker_ids[container_uuid]
+            if not docker_id:
+                raise Exception("Docker internal Error: container %s "
+                                "not found" % container_uuid)
+            return self._exec_stream(docker, docker_id, command, None,
+                                     timeout)
+
+        return api.ExecManyStream(container_uuids, open_stream, concurrency)
+
+    def _exec_stream(self, docker, docker_id, command, stdin, timeout):
+        exec_id = docker.exec_create(docker_id, command, stdout=True,
+                                     stderr=True,
+                                     stdin=stdin is not None)['Id']
+        response = docker._post_json(
+            docker._url('/exec/{0}/start', exec_id),
+            data={'Tty': False, 'Detach': False},
+            stream=True, timeout=timeout)
+        docker._raise_for_status(response)
+        if stdin is not None:
+            sock = docker._get_raw_response_socket(response)
+            writer = threading.Thread(target=_write_stdin,
+                                      args=(getattr(sock, '_sock', sock),
+                                            stdin))
+            writer.daemon = True
+            writer.start()
+
+        def exit_code():
+            return docker.exec_inspect(exec_id)['ExitCode']
+
+        return api.ExecStream(demultiplex_stream(response.raw), exit_code,
+                              close=response.close, timeout=timeout)
@@ -0,0 +1,233 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Per-operation latency, round trip and traffic instrumentation.
+
+API methods wrapped with :func:`instrumented` are timed, and every HTTP
+request a backend issues while such a call is running is attributed to
+it through :func:`record_request`.  Requests issued by background
+threads (event streams, watches) are not attributed to any call.
+
+Calls returning a lazy stream (stream_logs, stream_execute, stats) are
+timed up to the opening of the stream; reading it is not part of the
+call.  execute_many returns before it opens any exec at all, so the
+execs it runs are not part of it; those opened through stream_execute
+are recorded as calls of their own.
+
+The default :data:`NOOP` instrumentation costs one attribute check per
+call.  :class:`MetricsCollector` keeps histograms and counters and
+renders them in the Prometheus text exposition format.
+"""
+
+import collections
+import functools
+import os
+import tempfile
+import threading
+import time
+
+_local = threading.local()
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Operation(object):
+    """Round trips and traffic of one instrumented API call."""
+
+    __slots__ = ('backend', 'method', 'requests', 'bytes_sent',
+                 'bytes_received', '_lock')
+
+    def __init__(self, backend, method):
+        self.backend = backend
+        self.method = method
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Bulk operations record from several worker threads.
+        self._lock = threading.Lock()
+
+    def add_request(self, sent, received):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+
+def current_operation():
+    return getattr(_local, 'operation', None)
+
+
+def record_request(sent=0, received=0):
+    """Attribute one HTTP round trip to the running API call, if any."""
+    operation = getattr(_local, 'operation', None)
+    if operation is not None:
+        operation.add_request(sent, received)
+
+
+def propagate(func):
+    """Make func record into the caller's operation from another thread."""
+    operation = current_operation()
+    if operation is None:
+        return func
+
+    def wrapped(*args, **kwargs):
+        _local.operation = operation
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.operation = None
+
+    return wrapped
+
+
+class Instrumentation(object):
+    """Instrumentation that records nothing."""
+
+    enabled = False
+
+    def observe(self, operation, seconds, error):
+        pass
+
+
+NOOP = Instrumentation()
+
+
+def instrumented(f):
+    """Time an APIBase method and collect the requests it makes.
+
+    Uses the _instrumentation and BACKEND attributes of the instance.
+    Calls nested in an instrumented call are accounted to the outer one.
+    """
+    method = f.__name__
+
+    def wrapped(self, *args, **kwargs):
+        instrumentation = self._instrumentation
+        if not instrumentation.enabled or current_operation() is not None:
+            return f(self, *args, **kwargs)
+
+        operation = _local.operation = Operation(self.BACKEND, method)
+        error = True
+        start = time.time()
+        try:
+            result = f(self, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            _local.operation = None
+            instrumentation.observe(operation, time.time() - start, error)
+
+    return functools.wraps(f)(wrapped)
+
+
+class _Series(object):
+    __slots__ = ('buckets', 'count', 'sum', 'errors', 'requests',
+                 'bytes_sent', 'bytes_received')
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class MetricsCollector(Instrumentation):
+    """Latency histograms and traffic counters per backend and method."""
+
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='mincntr'):
+        self._bounds = tuple(sorted(buckets))
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._series = collections.defaultdict(
+            lambda: _Series(len(self._bounds)))
+
+    def observe(self, operation, seconds, error):
+        with self._lock:
+            series = self._series[(operation.backend, operation.method)]
+            for i, bound in enumerate(self._bounds):
+                if seconds <= bound:
+                    series.buckets[i] += 1
+                    break
+            series.count += 1
+            series.sum += seconds
+            series.errors += error and 1 or 0
+            series.requests += operation.requests
+            series.bytes_sent += operation.bytes_sent
+            series.bytes_received += operation.bytes_received
+
+    def snapshot(self):
+        """Return {(backend, method): counters} as plain dicts."""
+        with self._lock:
+            return dict((key, {'count': s.count,
+                               'sum': s.sum,
+                               'errors': s.errors,
+                               'requests': s.requests,
+                               'bytes_sent': s.bytes_sent,
+                               'bytes_received': s.bytes_received})
+                        for key, s in self._series.items())
+
+    def export(self):
+        """Render all series in the Prometheus text exposition format."""
+        name = self._prefix + '_operation_duration_seconds'
+        lines = ['# HELP %s Latency of mincntr API calls.' % name,
+                 '# TYPE %s histogram' % name]
+        counters = [
+            ('errors', 'operation_errors_total', 'Failed API calls.'),
+            ('requests', 'http_requests_total',
+             'HTTP round trips made by API calls.'),
+            ('bytes_sent', 'http_sent_bytes_total',
+             'Request bytes sent by API calls.'),
+            ('bytes_received', 'http_received_bytes_total',
+             'Response bytes received by API calls.'),
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for (backend, method), s in series:
+                labels = 'backend="%s",method="%s"' % (backend, method)
+                cumulative = 0
+                for bound, count in zip(self._bounds, s.buckets):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%r"} %d' %
+                                 (name, labels, bound, cumulative))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' %
+                             (name, labels, s.count))
+                lines.append('%s_sum{%s} %r' % (name, labels, s.sum))
+                lines.append('%s_count{%s} %d' % (name, labels, s.count))
+            for attr, suffix, help_text in counters:
+                counter = '%s_%s' % (self._prefix, suffix)
+                lines.append('# HELP %s %s' % (counter, help_text))
+                lines.append('# TYPE %s counter' % counter)
+                for (backend, method), s in series:
+                    lines.append('%s{backend="%s",method="%s"} %d' %
+                                 (counter, backend, method,
+                                  getattr(s, attr)))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Atomically write export() to path, e.g. for a textfile
+        collector.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.mincntr')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.export())
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
@@ -11,78 +11,824 @@
 # under the License.
 
 import contextlib
+import datetime
+import functools
+import json
 import logging
+import os
+import shlex
+import socket
+import ssl
+import threading
+import time
 
 from k8sclient.client import api_client
 from k8sclient.client.apis import apiv_api
-from k8sclient.tests import base
+from k8sclient.client import rest as rest_api
+import six
+from six.moves.urllib import parse as urlparse
+import websocket
 
-import api as mincntr_api
+from mincntr import api as mincntr_api
+from mincntr import instrumentation
+from mincntr import scheduler
+from mincntr import utils
 
 LOG = logging.getLogger(__name__)
 
+DELETE_OPTIONS = {'apiVersion': 'v1', 'kind': 'DeleteOptions'}
+# Remove the pods of a deleted controller along with it.
+DELETE_DEPENDENTS = dict(DELETE_OPTIONS, propagationPolicy='Background')
+
+METRICS_PATH = '/apis/metrics.k8s.io/v1beta1/namespaces/%s/pods'
+
+# Suffixes of resource quantities, longest first.
+_QUANTITY_SUFFIXES = [('Ki', 2 ** 10), ('Mi', 2 ** 20), ('Gi', 2 ** 30),
+                      ('Ti', 2 ** 40), ('n', 1e-9), ('u', 1e-6),
+                      ('m', 1e-3), ('k', 1e3), ('M', 1e6), ('G', 1e9),
+                      ('T', 1e12)]
+
+# Label tying the pods of a replica group to their controller.
+REPLICA_GROUP_LABEL = 'mincntr-replica-group'
+
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_POOL_MAXSIZE = 10
+
+# Exec subprotocols, newest first.  v5 adds closing a single channel,
+# which is how stdin EOF is signalled.
+EXEC_PROTOCOLS = ['v5.channel.k8s.io', 'v4.channel.k8s.io']
+ERROR_CHANNEL = 3
+CLOSE_CHANNEL = 255
+
+
+def _exit_code(status):
+    """Translate the status sent on the error channel to an exit code."""
+    if status.get('status') == 'Success':
+        return 0
+    if status.get('reason') == 'NonZeroExitCode':
+        for cause in (status.get('details') or {}).get('causes') or []:
+            if cause.get('reason') == 'ExitCode':
+                return int(cause['message'])
+    return None
+
+
+def _sslopt(key_file=None, cert_file=None, ca_certs=None):
+    """websocket-client sslopt for the TLS settings of the REST client."""
+    sslopt = {}
+    if cert_file:
+        sslopt['certfile'] = cert_file
+    if key_file:
+        sslopt['keyfile'] = key_file
+    if ca_certs:
+        sslopt.update(ca_certs=ca_certs, cert_reqs=ssl.CERT_REQUIRED)
+    return sslopt
+
+
+def parse_quantity(quantity):
+    """Return a resource quantity such as '250m' or '64Mi' as a float."""
+    for suffix, factor in _QUANTITY_SUFFIXES:
+        if quantity.endswith(suffix):
+            return float(quantity[:-len(suffix)]) * factor
+    return float(quantity)
+
+
+def _metrics_sample(pod_metrics):
+    """StatsSample from a metrics.k8s.io PodMetrics document.
+
+    The metrics API only reports CPU and memory, summed over the
+    containers of the pod.
+    """
+    cpu = memory = 0.0
+    for container in pod_metrics.get('containers') or []:
+        usage = container.get('usage') or {}
+        cpu += parse_quantity(usage.get('cpu', '0'))
+        memory += parse_quantity(usage.get('memory', '0'))
+    return mincntr_api.StatsSample(pod_metrics['metadata']['name'],
+                                   time.time(), cpu * 100, int(memory),
+                                   None, None, None, None, None)
+
+
+def _write_stdin(ws, stdin):
+    try:
+        for chunk in utils.iter_chunks(stdin, STREAM_CHUNK_SIZE):
+            ws.send_binary(six.int2byte(mincntr_api.STDIN) + chunk)
+        if ws.getsubprotocol() == EXEC_PROTOCOLS[0]:
+            ws.send_binary(six.int2byte(CLOSE_CHANNEL) +
+                           six.int2byte(mincntr_api.STDIN))
+    except Exception:
+        LOG.warning("Error while writing exec stdin", exc_info=True)
+
+
+def _size(data):
+    if not data:
+        return 0
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    return len(data)
+
+
+class InstrumentedRESTClient(rest_api.RESTClientObject):
+    """RESTClientObject reporting each round trip to instrumentation.
+
+    Requests wait for scheduler, a scheduler.Scheduler, if any; they
+    all count against endpoint, the apiserver URL.
+    """
+
+    def __init__(self, scheduler=None, endpoint=None, **kwargs):
+        super(InstrumentedRESTClient, self).__init__(**kwargs)
+        self.scheduler = scheduler
+        self.endpoint = endpoint
+
+    def slot(self, method):
+        """Context manager holding a scheduler slot for one request."""
+        return scheduler.slot(self.scheduler, self.endpoint, method)
+
+    def request(self, method, url, query_params=None, headers=None,
+                body=None, post_params=None):
+        received = None
+        with self.slot(method) as ticket:
+            try:
+                response = super(InstrumentedRESTClient, self).request(
+                    method, url, query_params=query_params,
+                    headers=headers, body=body, post_params=post_params)
+                ticket.status = response.status
+                received = response.data
+                return response
+            except rest_api.ApiException as e:
+                ticket.status = e.status
+                received = e.body
+                raise
+            finally:
+                if instrumentation.current_operation() is not None:
+                    instrumentation.record_request(
+                        _size(body and json.dumps(body)), _size(received))
+
+
+class PodInformer(object):
+    """Local pod cache kept current by a resourceVersion watch.
+
+    One list fills the cache, then a background thread follows a watch
+    from the returned resourceVersion.  Watches that time out are
+    resumed where they stopped.  When the apiserver answers "resource
+    version too old" (410 Gone), or the watch fails, everything is
+    listed again.
+
+    Pods are kept as api.Containers, whose states let wait_for()
+    callers all share the one watch.
+
+    list_pods() returns (pods, resource_version) and
+    watch_pods(resource_version) an iterator of watch events, pods being
+    decoded JSON objects; to_container(pod) makes their Containers.
+    """
+
+    def __init__(self, list_pods, watch_pods,
+                 to_container=mincntr_api.pod_container,
+                 sync_timeout=10, retry_interval=1):
+        self._list_pods = list_pods
+        self._watch_pods = watch_pods
+        self._to_container = to_container
+        self._sync_timeout = sync_timeout
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        # uid -> (namespace, Container)
+        self._pods = {}
+        self._names = {}
+        self._waiters = set()
+        self._resource_version = None
+        self._synced = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def synced(self):
+        return self._synced.is_set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run,
+                                            name='mincntr-pod-informer')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._thread = None
+        self._synced.clear()
+
+    def wait_for_sync(self):
+        return self._synced.wait(self._sync_timeout)
+
+    def list(self):
+        with self._lock:
+            return [container
+                    for _, container in six.itervalues(self._pods)]
+
+    def get_by_uid(self, uid):
+        with self._lock:
+            entry = self._pods.get(uid)
+        return entry and entry[1]
+
+    def get_by_name(self, name, namespace='default'):
+        with self._lock:
+            entry = self._pods.get(self._names.get((namespace, name)))
+        return entry and entry[1]
+
+    def state(self, name, namespace='default'):
+        """Return the state of a pod, or None until synced."""
+        with self._lock:
+            return self._state_locked((namespace, name))
+
+    def _state_locked(self, key):
+        if not self._synced.is_set():
+            return None
+        entry = self._pods.get(self._names.get(key))
+        if entry is None:
+            return mincntr_api.DELETED
+        return entry[1].state
+
+    def wait_for(self, names, state, timeout=None, namespace='default'):
+        """See APIBase.wait_for; pods are named within namespace."""
+        waiter = mincntr_api.StateWaiter(names, state)
+
+        def get_state(name):
+            return self._state_locked((namespace, name))
+
+        with self._lock:
+            self._waiters.add((waiter, get_state))
+            waiter.check(get_state)
+        try:
+            return waiter.wait(timeout)
+        finally:
+            with self._lock:
+                self._waiters.discard((waiter, get_state))
+
+    def _notify_locked(self):
+        for waiter, get_state in self._waiters:
+            waiter.check(get_state)
+
+    def relist(self):
+        pods, resource_version = self._list_pods()
+        by_uid, by_name = {}, {}
+        for pod in pods:
+            container = self._to_container(pod)
+            namespace = pod['metadata'].get('namespace')
+            by_uid[container.uuid] = (namespace, container)
+            by_name[(namespace, container.name)] = container.uuid
+        with self._lock:
+            self._pods = by_uid
+            self._names = by_name
+            self._resource_version = resource_version
+            self._synced.set()
+            self._notify_locked()
+
+    def handle_event(self, event):
+        """Apply one watch event; returns False if a relist is needed."""
+        obj = event.get('object') or {}
+        if event.get('type') == 'ERROR':
+            if obj.get('code') == 410:
+                return False
+            raise Exception("Pod watch failed: %s" % obj.get('message'))
+        metadata = obj.get('metadata') or {}
+        uid = metadata.get('uid')
+        key = (metadata.get('namespace'), metadata.get('name'))
+        with self._lock:
+            if event.get('type') == 'DELETED':
+                self._pods.pop(uid, None)
+                if self._names.get(key) == uid:
+                    del self._names[key]
+            elif event.get('type') in ('ADDED', 'MODIFIED'):
+                self._pods[uid] = (key[0], self._to_container(obj))
+                self._names[key] = uid
+            self._resource_version = metadata.get('resourceVersion',
+                                                  self._resource_version)
+            self._notify_locked()
+        return True
+
+    def _run(self):
+        need_list = True
+        while not self._stopped:
+            try:
+                if need_list:
+                    self.relist()
+                    need_list = False
+                for event in self._watch_pods(self._resource_version):
+                    if self._stopped:
+                        return
+                    if not self.handle_event(event):
+                        LOG.info("Pod watch resource version too old, "
+                                 "relisting")
+                        need_list = True
+                        break
+            except Exception:
+                if self._stopped:
+                    return
+                LOG.warning("Pod watch dropped, relisting", exc_info=True)
+                need_list = True
+                self._synced.clear()
+                time.sleep(self._retry_interval)
+
 
 class KubernetesAPI(mincntr_api.APIBase):
-    def __init__(self):
-        pass
+    BACKEND = 'kubernetes'
+
+    def __init__(self, url=None, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 key_file=None, cert_file=None, ca_certs=None,
+                 instrumentation=None, scheduler=None):
+        """Kubernetes backend.
+
+        url defaults to KUBERNETES_MASTER, then to the local insecure
+        port.  pool_maxsize is the number of keep-alive connections
+        kept per apiserver.  instrumentation is an
+        instrumentation.Instrumentation that calls are reported to.
+        scheduler is a scheduler.Scheduler, possibly shared with other
+        backends, that paces the requests to the apiserver.
+        """
+        if instrumentation is not None:
+            self._instrumentation = instrumentation
+        self._url = url or os.getenv('KUBERNETES_MASTER',
+                                     'http://127.0.0.1:8080/')
+        self._pool_maxsize = pool_maxsize
+        self._tls_kwargs = {'key_file': key_file,
+                            'cert_file': cert_file,
+                            'ca_certs': ca_certs}
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._loaders = {}
 
     _api = None
     _client = None
+    _informer = None
+    _watch_response = None
+
+    # Ask the apiserver to end watches after this long; they are resumed
+    # from the last resourceVersion seen.
+    WATCH_TIMEOUT = 300
 
     @contextlib.contextmanager
     def k8s_for_container(self):
         if self._api is None:
-            self._client = api_client.ApiClient('http://127.0.0.1:8080/')
-            self._api = apiv_api.ApivApi(self._client)
+            with self._lock:
+                if self._api is None:
+                    k8s_client = api_client.ApiClient(self._url,
+                                                      **self._tls_kwargs)
+                    rest = k8s_client.RESTClient.IMPL = (
+                        InstrumentedRESTClient(scheduler=self._scheduler,
+                                               endpoint=self._url,
+                                               **self._tls_kwargs))
+                    # The generated client keeps one connection per host;
+                    # let concurrent callers each keep theirs alive.
+                    for pool_manager in (rest.pool_manager,
+                                         rest.ssl_pool_manager):
+                        pool_manager.connection_pool_kw['maxsize'] = (
+                            self._pool_maxsize)
+                    self._client = k8s_client
+                    self._api = apiv_api.ApivApi(k8s_client)
         yield self._api
 
-    def list(self):
-        with self.k8s_for_container() as api:
-            return [mincntr_api.Container(item.metadata.uid,
-                                          item.metadata.name)
-                    for item in api.list_pod().items]
+    def _pod_loader(self, namespace):
+        """Details loader shared by the Containers of a namespace."""
+        loader = self._loaders.get(namespace)
+        if loader is None:
+            loader = self._loaders.setdefault(
+                namespace, functools.partial(self._pod_details, namespace))
+        return loader
+
+    def _pod_details(self, namespace, container):
+        try:
+            return self._get_json('/api/v1/namespaces/%s/pods/%s'
+                                  % (namespace, container.name))
+        except rest_api.ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def _to_container(self, pod):
+        namespace = (pod.get('metadata') or {}).get('namespace')
+        return mincntr_api.pod_container(
+            pod, self._pod_loader(namespace or 'default'))
+
+    def _list_pods(self):
+        pods = self._get_json('/api/v1/pods')
+        return (pods.get('items') or [],
+                (pods.get('metadata') or {}).get('resourceVersion'))
+
+    def _watch_pods(self, resource_version):
+        query_params = {'watch': 'true',
+                        'timeoutSeconds': self.WATCH_TIMEOUT}
+        if resource_version:
+            query_params['resourceVersion'] = resource_version
+        with self.k8s_for_container():
+            response = self._stream('/api/v1/pods', query_params)
+        with self._lock:
+            if self._informer is None:
+                # Closed meanwhile.
+                response.release_conn()
+                return
+            self._watch_response = response
+        try:
+            for line in utils.iter_lines(response.stream(STREAM_CHUNK_SIZE)):
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+        finally:
+            response.release_conn()
+
+    def close(self):
+        """Stop the pod informer and end its watch.
+
+        The object can still be used afterwards; the informer is then
+        started again on first use.
+        """
+        with self._lock:
+            informer, self._informer = self._informer, None
+            response, self._watch_response = self._watch_response, None
+        if informer is not None:
+            informer.stop()
+        if response is not None:
+            # Releasing the connection does not wake up a blocked read.
+            try:
+                response.connection.sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                LOG.debug("Could not shut the pod watch down",
+                          exc_info=True)
+
+    def informer(self):
+        """The PodInformer backing list(), started on first use."""
+        if self._informer is None:
+            with self._lock:
+                if self._informer is None:
+                    informer = PodInformer(self._list_pods,
+                                           self._watch_pods,
+                                           self._to_container)
+                    informer.start()
+                    self._informer = informer
+        return self._informer
 
+    def iter_pods(self, namespace=None, label_selector=None,
+                  field_selector=None, page_size=DEFAULT_PAGE_SIZE):
+        """Generate Containers for matching pods, one page at a time.
+
+        The selectors are evaluated by the apiserver and pages are
+        fetched with limit/continue only as the generator is consumed,
+        so stopping early never transfers the rest of the list.
+        """
+        if namespace:
+            path = '/api/v1/namespaces/%s/pods' % namespace
+        else:
+            path = '/api/v1/pods'
+        query_params = {'limit': page_size}
+        if label_selector:
+            query_params['labelSelector'] = label_selector
+        if field_selector:
+            query_params['fieldSelector'] = field_selector
+
+        while True:
+            page = self._get_json(path, query_params)
+            for item in page.get('items') or []:
+                yield self._to_container(item)
+            token = (page.get('metadata') or {}).get('continue')
+            if not token:
+                return
+            query_params['continue'] = token
+
+    @instrumentation.instrumented
+    def list(self, namespace=None, label_selector=None, field_selector=None):
+        """Return a list of Containers.
+
+        Without filters the answer comes from the pod informer.  With a
+        namespace or selector the apiserver does the filtering; use
+        iter_pods() to page through a large result lazily instead.
+        """
+        if namespace or label_selector or field_selector:
+            return list(self.iter_pods(namespace=namespace,
+                                       label_selector=label_selector,
+                                       field_selector=field_selector))
+        informer = self.informer()
+        if informer.wait_for_sync():
+            return informer.list()
+        # Not synced (yet): answer from the apiserver directly.
+        return list(self.iter_pods())
+
+    @instrumentation.instrumented
     def create(self, name, image, **kwargs):
         pod_manifest = {'apiVersion': 'v1',
                         'kind': 'Pod',
                         'metadata': {'color': 'blue',
                                      'name': name},
-                        'spec': {'containers': [{'image': image,
-                                                 'name': name}]}}
+                        'spec': {'containers': [
+                            utils.pod_container_spec(name, image, **kwargs)]}}
 
         with self.k8s_for_container() as api:
             return api.create_namespaced_pod(body=pod_manifest,
                                              namespace='default')
 
+    # Replica groups: many identical pods owned by one replication
+    # controller, so that creating, scaling or deleting all of them is a
+    # single write.
+
+    @instrumentation.instrumented
+    def create_replicas(self, name, image, replicas, namespace='default',
+                        timeout=None, **kwargs):
+        """Create replicas pods of image through one controller.
+
+        kwargs are those of create().  Returns iter_replicas() for the
+        new pods, which yields them as the controller creates them.
+        """
+        labels = {REPLICA_GROUP_LABEL: name}
+        controller = {
+            'apiVersion': 'v1',
+            'kind': 'ReplicationController',
+            'metadata': {'name': name, 'labels': labels},
+            'spec': {'replicas': replicas,
+                     'selector': labels,
+                     'template': {
+                         'metadata': {'labels': labels},
+                         'spec': {'containers': [utils.pod_container_spec(
+                             name, image, **kwargs)]}}}}
+        with self.k8s_for_container() as api:
+            api.create_namespaced_replication_controller(
+                body=controller, namespace=namespace)
+        return self.iter_replicas(name, replicas, namespace, timeout)
+
+    @instrumentation.instrumented
+    def scale_replicas(self, name, replicas, namespace='default'):
+        """Set the number of pods of a replica group."""
+        # The client sends patches as strategic merge patches, whose
+        # body is a partial object.
+        with self.k8s_for_container() as api:
+            return api.patch_namespaced_replication_controller(
+                body={'spec': {'replicas': replicas}},
+                namespace=namespace, name=name)
+
+    @instrumentation.instrumented
+    def delete_replicas(self, name, namespace='default'):
+        """Delete a replica group; its pods are removed in the background.
+
+        Apiservers older than 1.6 ignore the propagation policy and
+        leave the pods behind; scale to 0 first there.
+        """
+        with self.k8s_for_container() as api:
+            return api.delete_namespaced_replication_controller(
+                body=DELETE_DEPENDENTS, namespace=namespace, name=name)
+
+    def iter_replicas(self, name, count=None, namespace='default',
+                      timeout=None):
+        """Generate a Container for each pod of a replica group.
+
+        Pods that exist already come from one list call, the others
+        from a watch as they are added.  Stops after count pods or once
+        timeout seconds have passed.
+        """
+        selector = '%s=%s' % (REPLICA_GROUP_LABEL, name)
+        path = '/api/v1/namespaces/%s/pods' % namespace
+        deadline = None if timeout is None else time.time() + timeout
+        seen = set()
+
+        page = self._get_json(path, {'labelSelector': selector})
+        for item in page.get('items') or []:
+            seen.add(item['metadata']['uid'])
+            yield self._to_container(item)
+            if count is not None and len(seen) >= count:
+                return
+
+        query_params = {'watch': 'true', 'labelSelector': selector,
+                        'resourceVersion': page['metadata'].get(
+                            'resourceVersion')}
+        if deadline is not None:
+            query_params['timeoutSeconds'] = max(
+                1, int(deadline - time.time()))
+        with self.k8s_for_container():
+            response = self._stream(path, query_params)
+        try:
+            for line in utils.iter_lines(response.stream(STREAM_CHUNK_SIZE)):
+                if deadline is not None and time.time() >= deadline:
+                    return
+                if not line.strip():
+                    continue
+                event = json.loads(line.decode('utf-8'))
+                metadata = (event.get('object') or {}).get('metadata') or {}
+                if (event.get('type') != 'ADDED' or
+                        metadata.get('uid') in seen or
+                        metadata.get('namespace') != namespace or
+                        (metadata.get('labels') or {}).get(
+                            REPLICA_GROUP_LABEL) != name):
+                    continue
+                seen.add(metadata['uid'])
+                yield self._to_container(event['object'])
+                if count is not None and len(seen) >= count:
+                    return
+        finally:
+            response.release_conn()
+
+    @instrumentation.instrumented
     def start(self, container_uuid):
         pass
 
+    @instrumentation.instrumented
     def stop(self, container_uuid):
         pass
 
+    @instrumentation.instrumented
     def restart(self, container_uuid):
         pass
 
+    @instrumentation.instrumented
     def pause(self, container_uuid):
         pass
 
+    @instrumentation.instrumented
     def unpause(self, container_uuid):
         pass
 
+    @instrumentation.instrumented
     def delete(self, container_uuid):
-        pass
+        with self.k8s_for_container() as api:
+            return api.delete_namespaced_pod(body=DELETE_OPTIONS,
+                                             namespace='default',
+                                             name=container_uuid)
+
+    @instrumentation.instrumented
+    def delete_many(self, container_uuids=None,
+                    concurrency=mincntr_api.DEFAULT_CONCURRENCY,
+                    label_selector=None):
+        """Delete pods by name, or all pods matching label_selector.
 
+        With a label selector the pods are removed by a single
+        deletecollection call instead of one delete per pod.
+        """
+        if label_selector is None:
+            return super(KubernetesAPI, self).delete_many(container_uuids,
+                                                          concurrency)
+        if container_uuids is not None:
+            raise ValueError("Pass either container_uuids or "
+                             "label_selector, not both")
+        with self.k8s_for_container() as api:
+            names = [item.metadata.name for item in api.list_namespaced_pod(
+                'default', label_selector=label_selector).items]
+            try:
+                result = api.deletecollection_namespaced_pod(
+                    'default', label_selector=label_selector)
+            except Exception as e:
+                return [mincntr_api.BulkResult(name, None, e)
+                        for name in names]
+            return [mincntr_api.BulkResult(name, result, None)
+                    for name in names]
+
+    @instrumentation.instrumented
     def inspect(self, container_uuid):
         pass
 
+    def _sample_stat(self, container_uuid):
+        return _metrics_sample(self._get_json(
+            (METRICS_PATH % 'default') + '/' + container_uuid))
+
+    def _sample_stats(self, container_uuids, concurrency):
+        """Sample all pods with one metrics list call."""
+        if len(container_uuids) == 1:
+            return super(KubernetesAPI, self)._sample_stats(container_uuids,
+                                                            concurrency)
+        wanted = set(container_uuids)
+        try:
+            metrics = self._get_json(METRICS_PATH % 'default')
+        except Exception:
+            LOG.debug("Could not list pod metrics", exc_info=True)
+            return []
+        return [_metrics_sample(item) for item in metrics.get('items') or []
+                if item['metadata']['name'] in wanted]
+
+    @instrumentation.instrumented
+    def wait_for(self, containers, state, timeout=None):
+        """See APIBase.wait_for.  Pods are never PAUSED."""
+        return self.informer().wait_for(containers, state, timeout)
+
+    @instrumentation.instrumented
     def logs(self, container_uuid):
         with self.k8s_for_container() as api:
             response = api.read_namespaced_pod_log(
                 'default', container_uuid)
             return {'output': self._client.last_response.data}
 
+    def _stream(self, path, query_params):
+        """Issue a GET whose body is read incrementally by the caller.
+
+        The generated client always reads whole responses into memory,
+        so go through its connection pool directly.
+        """
+        url = self._client.host.rstrip('/') + path
+        rest = self._client.RESTClient.IMPL
+        with rest.slot('GET') as ticket:
+            response = rest.agent(url).request(
+                'GET', url, fields=query_params,
+                headers=dict(self._client.default_headers),
+                preload_content=False)
+            ticket.status = response.status
+        # The body is read later by the caller; only its announced length
+        # is known here.
+        instrumentation.record_request(
+            0, int(response.headers.get('Content-Length') or 0))
+        if response.status not in range(200, 206):
+            try:
+                raise rest_api.ApiException(
+                    http_resp=rest_api.RESTResponse(response))
+            finally:
+                response.release_conn()
+        return response
+
+    def _get_json(self, path, query_params=None):
+        """GET path and decode the JSON body."""
+        with self.k8s_for_container():
+            response = self._stream(path, query_params or {})
+        try:
+            return json.loads(response.data.decode('utf-8'))
+        finally:
+            response.release_conn()
+
+    @instrumentation.instrumented
+    def stream_logs(self, container_uuid, since=None, tail=None,
+                    timestamps=False, follow=False, lines=False):
+        query_params = {}
+        if since is not None:
+            since = datetime.datetime.utcfromtimestamp(
+                utils.to_timestamp(since))
+            query_params['sinceTime'] = since.strftime('%Y-%m-%dT%H:%M:%SZ')
+        if tail is not None:
+            query_params['tailLines'] = tail
+        if timestamps:
+            query_params['timestamps'] = 'true'
+        if follow:
+            query_params['follow'] = 'true'
+        with self.k8s_for_container():
+            response = self._stream(
+                '/api/v1/namespaces/default/pods/%s/log' % container_uuid,
+                query_params)
+
+        def chunks():
+            try:
+                for chunk in response.stream(STREAM_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                response.release_conn()
+
+        if lines:
+            return utils.iter_lines(chunks())
+        return chunks()
+
+    @instrumentation.instrumented
     def execute(self, container_uuid, command):
         with self.k8s_for_container() as api:
             response = api.connect_get_namespaced_pod_exec(
                 'default', container_uuid, command=command)
             return {'output': self._client.last_response.data}
+
+    @instrumentation.instrumented
+    def stream_execute(self, container_uuid, command, stdin=None,
+                       timeout=None):
+        if isinstance(command, six.string_types):
+            command = shlex.split(command)
+        query_params = [('command', arg) for arg in command]
+        query_params += [('stdout', 'true'), ('stderr', 'true')]
+        if stdin is not None:
+            query_params.append(('stdin', 'true'))
+        with self.k8s_for_container():
+            url = '%s/api/v1/namespaces/default/pods/%s/exec?%s' % (
+                self._client.host.rstrip('/'), container_uuid,
+                urlparse.urlencode(query_params))
+            # http:// becomes ws:// and https:// becomes wss://
+            with self._client.RESTClient.IMPL.slot('GET') as ticket:
+                ws = websocket.create_connection(
+                    'ws' + url[len('http'):], timeout=timeout,
+                    subprotocols=EXEC_PROTOCOLS,
+                    header=['%s: %s' % header for header
+                            in self._client.default_headers.items()],
+                    sslopt=_sslopt(**self._tls_kwargs))
+                ticket.status = ws.status
+        instrumentation.record_request()
+        if stdin is not None:
+            writer = threading.Thread(target=_write_stdin, args=(ws, stdin))
+            writer.daemon = True
+            writer.start()
+
+        status = {}
+
+        def chunks():
+            while True:
+                try:
+                    opcode, data = ws.recv_data()
+                except websocket.WebSocketConnectionClosedException:
+                    return
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    return
+                if not data:
+                    continue
+                channel = six.indexbytes(data, 0)
+                if channel == ERROR_CHANNEL:
+                    status.update(json.loads(data[1:].decode('utf-8')))
+                elif channel in (mincntr_api.STDOUT, mincntr_api.STDERR):
+                    yield channel, data[1:]
+
+        return mincntr_api.ExecStream(chunks(), lambda: _exit_code(status),
+                                      close=ws.close, timeout=timeout)
@@ -0,0 +1,374 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Docker backend spread over a fleet of daemons.
+
+Every host is driven by its own DockerAPI, so each keeps its pooled
+client, event-fed container index and image cache.  Calls that touch
+several hosts run in parallel with a deadline: a host that hangs is
+skipped, and one that cannot be reached is left alone for
+retry_interval seconds.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+from concurrent import futures
+import six
+
+from mincntr import api
+from mincntr import docker_api
+from mincntr import instrumentation
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_RETRY_INTERVAL = 30
+
+
+class DockerHost(object):
+    """One daemon of a MultiDockerAPI."""
+
+    def __init__(self, url, retry_interval=DEFAULT_RETRY_INTERVAL,
+                 **api_kwargs):
+        self.url = url
+        self.api = docker_api.DockerAPI(url=url, **api_kwargs)
+        self._retry_interval = retry_interval
+
+    @property
+    def available(self):
+        """False for retry_interval seconds after a connection failure."""
+        failed = self.api.last_failure
+        return failed is None or time.time() - failed >= self._retry_interval
+
+    def load(self):
+        """Number of running containers, or None while not known yet."""
+        return self.api.count(api.RUNNING)
+
+    def __repr__(self):
+        return 'DockerHost(%r)' % self.url
+
+
+def least_loaded(hosts):
+    """Placement policy picking the host running the fewest containers.
+
+    Hosts whose load is not known yet are only picked if no load is.
+    """
+    def key(host):
+        load = host.load()
+        return (load is None, load or 0)
+
+    return min(hosts, key=key)
+
+
+def round_robin():
+    """Return a placement policy that takes the hosts in turn."""
+    counter = itertools.count()
+
+    def policy(hosts):
+        return hosts[next(counter) % len(hosts)]
+
+    return policy
+
+
+class MultiDockerAPI(api.APIBase):
+    BACKEND = 'multi-docker'
+
+    def __init__(self, urls=None, placement=least_loaded,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, locate_timeout=5,
+                 list_timeout=10, instrumentation=None, **api_kwargs):
+        """Docker backend over several daemons.
+
+        urls defaults to the comma separated DOCKER_HOSTS.  placement is
+        called with the reachable DockerHosts and returns the one a new
+        container goes to.  list() and locating a container give up on
+        hosts that do not answer within list_timeout and locate_timeout
+        seconds.  The remaining keyword arguments are passed on to the
+        DockerAPI of every host.
+        """
+        if urls is None:
+            urls = [url.strip()
+                    for url in os.getenv('DOCKER_HOSTS', '').split(',')
+                    if url.strip()]
+        if not urls:
+            raise ValueError("No Docker hosts configured")
+        if instrumentation is not None:
+            self._instrumentation = instrumentation
+        self.hosts = [DockerHost(url, retry_interval,
+                                 instrumentation=instrumentation,
+                                 **api_kwargs)
+                      for url in urls]
+        self._placement = placement
+        self._locate_timeout = locate_timeout
+        self._list_timeout = list_timeout
+        self._lock = threading.Lock()
+        self._locations = {}
+        # Shared and never shut down by a call, so that no call has to
+        # wait for the worker stuck on a hung host.
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        return futures.ThreadPoolExecutor(max_workers=4 * len(self.hosts))
+
+    def close(self):
+        """Close the DockerAPI of every host and stop the fan-out pool.
+
+        Workers stuck on a hung host are not waited for.  Like DockerAPI,
+        the object can still be used afterwards.
+        """
+        pool, self._pool = self._pool, self._new_pool()
+        pool.shutdown(wait=False)
+        for host in self.hosts:
+            host.api.close()
+
+    def _available_hosts(self):
+        hosts = [host for host in self.hosts if host.available]
+        if not hosts:
+            raise Exception("Docker internal Error: no Docker host "
+                            "is reachable")
+        return hosts
+
+    def _fan_out(self, hosts, func, timeout):
+        """Call func(host) on all hosts at once.
+
+        Returns (host, result) for the hosts that answered in time and
+        without error, in host order; the others are logged and left out.
+        """
+        func = instrumentation.propagate(func)
+        fs = [(host, self._pool.submit(func, host)) for host in hosts]
+        futures.wait([f for _, f in fs], timeout=timeout)
+        results = []
+        for host, f in fs:
+            if not f.done():
+                LOG.warning("Docker host %s did not answer within %ss, "
+                            "skipping it", host.url, timeout)
+            elif f.exception() is not None:
+                LOG.warning("Docker host %s failed, skipping it: %s",
+                            host.url, f.exception())
+            else:
+                results.append((host, f.result()))
+        return results
+
+    def locate(self, container_uuid):
+        """Return the DockerHost owning a container, or None.
+
+        Locations are cached; an unknown container is looked up on all
+        reachable hosts at once, which normally only hits their indexes.
+        """
+        with self._lock:
+            host = self._locations.get(container_uuid)
+        if host is not None and host.available:
+            return host
+
+        func = instrumentation.propagate(
+            lambda host: host.api.find(container_uuid))
+        fs = dict((self._pool.submit(func, host), host)
+                  for host in self._available_hosts())
+        try:
+            for f in futures.as_completed(fs, timeout=self._locate_timeout):
+                if f.exception() is None and f.result():
+                    host = fs[f]
+                    with self._lock:
+                        self._locations[container_uuid] = host
+                    return host
+        except futures.TimeoutError:
+            LOG.warning("Container %s not found on the hosts that "
+                        "answered within %ss", container_uuid,
+                        self._locate_timeout)
+        return None
+
+    def _forget(self, container_uuids):
+        with self._lock:
+            for container_uuid in container_uuids:
+                self._locations.pop(container_uuid, None)
+
+    def _group(self, container_uuids):
+        """Map DockerHost (None if not found) -> list of containers."""
+        groups = {}
+        for container_uuid in container_uuids:
+            groups.setdefault(self.locate(container_uuid),
+                              []).append(container_uuid)
+        return groups
+
+    def _call(self, method, container_uuid, *args, **kwargs):
+        host = self.locate(container_uuid)
+        if host is None:
+            raise Exception("Docker internal Error: container %s not "
+                            "found on any host" % container_uuid)
+        return getattr(host.api, method)(container_uuid, *args, **kwargs)
+
+    # Container operations
+
+    @instrumentation.instrumented
+    def list(self):
+        """List the containers of every reachable host, in host order."""
+        res = []
+        for host, containers in self._fan_out(self._available_hosts(),
+                                              lambda host: host.api.list(),
+                                              self._list_timeout):
+            res.extend(containers)
+        return res
+
+    @instrumentation.instrumented
+    def create(self, name, image, **kwargs):
+        """Create a container on the host picked by the placement policy.
+
+        When that host turns out to be unreachable the policy picks
+        again among the remaining ones.
+        """
+        hosts = self._available_hosts()
+        while True:
+            host = self._placement(hosts)
+            try:
+                result = host.api.create(name, image, **kwargs)
+            except Exception:
+                hosts = [h for h in hosts if h is not host]
+                if host.available or not hosts:
+                    raise
+                LOG.warning("Docker host %s is unreachable, placing %s "
+                            "elsewhere", host.url, name)
+                continue
+            if result and name:
+                with self._lock:
+                    self._locations[name] = host
+            return result
+
+    @instrumentation.instrumented
+    def delete(self, container_uuid):
+        host = self.locate(container_uuid)
+        if host is None:
+            return None
+        result = host.api.delete(container_uuid)
+        self._forget([container_uuid])
+        return result
+
+    @instrumentation.instrumented
+    def inspect(self, container_uuid):
+        host = self.locate(container_uuid)
+        if host is None:
+            return None
+        return host.api.inspect(container_uuid)
+
+    @instrumentation.instrumented
+    def start(self, container_uuid):
+        return self._call('start', container_uuid)
+
+    @instrumentation.instrumented
+    def stop(self, container_uuid):
+        return self._call('stop', container_uuid)
+
+    @instrumentation.instrumented
+    def restart(self, container_uuid):
+        return self._call('restart', container_uuid)
+
+    @instrumentation.instrumented
+    def pause(self, container_uuid):
+        return self._call('pause', container_uuid)
+
+    @instrumentation.instrumented
+    def unpause(self, container_uuid):
+        return self._call('unpause', container_uuid)
+
+    @instrumentation.instrumented
+    def logs(self, container_uuid):
+        return self._call('logs', container_uuid)
+
+    @instrumentation.instrumented
+    def stream_logs(self, container_uuid, since=None, tail=None,
+                    timestamps=False, follow=False, lines=False):
+        return self._call('stream_logs', container_uuid, since=since,
+                          tail=tail, timestamps=timestamps, follow=follow,
+                          lines=lines)
+
+    @instrumentation.instrumented
+    def execute(self, container_uuid, command):
+        return self._call('execute', container_uuid, command)
+
+    @instrumentation.instrumented
+    def stream_execute(self, container_uuid, command, stdin=None,
+                       timeout=None):
+        return self._call('stream_execute', container_uuid, command,
+                          stdin=stdin, timeout=timeout)
+
+    @instrumentation.instrumented
+    def get_archive(self, container_uuid, path,
+                    chunk_size=api.STREAM_CHUNK_SIZE):
+        return self._call('get_archive', container_uuid, path, chunk_size)
+
+    @instrumentation.instrumented
+    def put_archive(self, container_uuid, path, data,
+                    chunk_size=api.STREAM_CHUNK_SIZE):
+        return self._call('put_archive', container_uuid, path, data,
+                          chunk_size)
+
+    @instrumentation.instrumented
+    def stats(self, container_uuid, interval=None):
+        return self._call('stats', container_uuid, interval)
+
+    def _sample_stat(self, container_uuid):
+        host = self.locate(container_uuid)
+        if host is None:
+            return None
+        return host.api._sample_stat(container_uuid)
+
+    @instrumentation.instrumented
+    def wait_for(self, containers, state, timeout=None):
+        """See APIBase.wait_for.
+
+        Containers that cannot be located count as DELETED, so waiting
+        for any other state of one returns False right away.
+        """
+        if isinstance(containers, six.string_types):
+            containers = [containers]
+        groups = self._group(containers)
+        if groups.pop(None, None) and state != api.DELETED:
+            return False
+        deadline = None if timeout is None else time.time() + timeout
+        for host, names in six.iteritems(groups):
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            if not host.api.wait_for(names, state, remaining):
+                return False
+        return True
+
+    def _action_many(self, action, container_uuids, concurrency):
+        """One bulk call per owning host, all hosts at once."""
+        container_uuids = list(container_uuids)
+        groups = self._group(set(container_uuids))
+        results = {}
+        for container_uuid in groups.pop(None, []):
+            error = None
+            if action != 'delete':
+                error = Exception("Docker internal Error: container %s "
+                                  "not found on any host" % container_uuid)
+            results[container_uuid] = api.BulkResult(container_uuid, None,
+                                                     error)
+
+        def run(group):
+            host, names = group
+            return getattr(host.api, action + '_many')(names, concurrency)
+
+        for group in api.run_many(run, groups.items(), len(groups) or 1):
+            host, names = group.item
+            if group.error is not None:
+                for name in names:
+                    results[name] = api.BulkResult(name, None, group.error)
+            else:
+                for result in group.result:
+                    results[result.item] = result
+            if action == 'delete':
+                self._forget(names)
+        return [results[container_uuid]
+                for container_uuid in container_uuids]
@@ -0,0 +1,248 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Client side rate and concurrency limits for the HTTP requests of
+backends.
+
+One Scheduler can be shared by any number of backends::
+
+    shared = scheduler.Scheduler(rate=50)
+    docker = DockerAPI(scheduler=shared)
+    k8s = KubernetesAPI(scheduler=shared)
+
+Each endpoint, i.e. daemon or apiserver URL, gets its own:
+
+* token bucket: at most rate requests a second, in bursts of up to
+  burst;
+* concurrency limit, adapted the way TCP adapts its congestion window:
+  it grows by one for every limit requests answered, and is cut by
+  backoff, at most once per round trip, when a request gets no answer
+  or is answered 429 or 5xx;
+* priority classes: reads (GET, HEAD) go before waiting writes, so bulk
+  creates do not starve list() and inspect().
+
+A Docker request frees its slot once the response headers are in, and
+the body, streamed or not, is read outside it; so do the streaming
+Kubernetes requests (lists, logs, watches, exec).  Other calls through
+the generated Kubernetes client hold their slot until the client has
+read the whole, small, JSON answer.
+"""
+
+import contextlib
+import threading
+import time
+
+import six
+
+READ = 0
+WRITE = 1
+
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+DEFAULT_LIMIT = 16
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 256
+# Many writes are slow by design (stop waits for the container to
+# exit, pulls and exec_start run until done), so latency alone does not
+# signal overload unless asked to.
+DEFAULT_LATENCY_TARGET = None
+DEFAULT_BACKOFF = 0.7
+
+
+def priority(method):
+    """Priority class of an HTTP method: READ or WRITE."""
+    return READ if method.upper() in READ_METHODS else WRITE
+
+
+def overloaded(status):
+    """True if a response status asks the client to back off.
+
+    A falsy status means no response came at all.
+    """
+    return not status or status == 429 or status >= 500
+
+
+class TokenBucket(object):
+    """rate tokens a second, of which up to burst are saved up."""
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token; return the seconds to wait before using it.
+
+        Tokens are handed out ahead of time, in order, so waiting
+        callers are served first come first served.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0, -self._tokens / self.rate)
+
+
+class Ticket(object):
+    """A request admitted by Scheduler.acquire().
+
+    Set status to the HTTP status of the response before handing it
+    back to Scheduler.release().
+    """
+
+    def __init__(self, endpoint, started, priority=READ):
+        self.endpoint = endpoint
+        self.started = started
+        self.priority = priority
+        self.status = None
+
+
+class _Endpoint(object):
+
+    def __init__(self, bucket, limit):
+        self.bucket = bucket
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.waiting = [0, 0]
+        self.backed_off = 0
+        self.throttled = 0
+
+    def admits(self, priority):
+        if self.in_flight >= max(1, int(self.limit)):
+            return False
+        return priority == READ or not self.waiting[READ]
+
+
+class Scheduler(object):
+
+    def __init__(self, rate=None, burst=None, rates=None,
+                 limit=DEFAULT_LIMIT, min_limit=DEFAULT_MIN_LIMIT,
+                 max_limit=DEFAULT_MAX_LIMIT,
+                 latency_target=DEFAULT_LATENCY_TARGET,
+                 backoff=DEFAULT_BACKOFF):
+        """Limit the requests sent to each endpoint.
+
+        rate and burst apply to every endpoint, unless rates maps its
+        URL to a (rate, burst) pair; a rate of None means no rate limit.
+        limit is the concurrency every endpoint starts with; it then
+        moves between min_limit and max_limit.  With a latency_target, a
+        read that takes more than that many seconds counts as a sign of
+        overload too; writes are never judged by their latency.
+        """
+        if not min_limit <= limit <= max_limit:
+            raise ValueError("limit must be between min_limit and "
+                             "max_limit")
+        if not 0 < backoff < 1:
+            raise ValueError("backoff must be between 0 and 1")
+        self._rate = rate
+        self._burst = burst
+        self._rates = dict(rates or {})
+        self._limit = limit
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._latency_target = latency_target
+        self._backoff = backoff
+        self._cond = threading.Condition()
+        self._endpoints = {}
+
+    def _endpoint(self, url):
+        state = self._endpoints.get(url)
+        if state is None:
+            rate, burst = self._rates.get(url, (self._rate, self._burst))
+            bucket = TokenBucket(rate, burst) if rate else None
+            state = self._endpoints[url] = _Endpoint(bucket, self._limit)
+        return state
+
+    def acquire(self, endpoint, method='GET'):
+        """Wait until a request to endpoint may be sent.
+
+        Returns the Ticket to hand to release() once the response
+        headers are in, or the request failed.
+        """
+        cls = priority(method)
+        with self._cond:
+            state = self._endpoint(endpoint)
+        delay = state.bucket.reserve() if state.bucket else 0
+        if delay > 0:
+            time.sleep(delay)
+        with self._cond:
+            if delay > 0 or not state.admits(cls):
+                state.throttled += 1
+            state.waiting[cls] += 1
+            try:
+                while not state.admits(cls):
+                    self._cond.wait()
+            finally:
+                state.waiting[cls] -= 1
+            state.in_flight += 1
+        return Ticket(endpoint, time.time(), cls)
+
+    def release(self, ticket):
+        """Free the slot of ticket and adapt the concurrency limit."""
+        now = time.time()
+        with self._cond:
+            state = self._endpoints[ticket.endpoint]
+            state.in_flight -= 1
+            slow = (self._latency_target is not None and
+                    ticket.priority == READ and
+                    now - ticket.started > self._latency_target)
+            if overloaded(ticket.status) or slow:
+                # The requests in flight were all sent under the old
+                # limit: back off once for all of them.
+                if ticket.started >= state.backed_off:
+                    state.limit = max(self._min_limit,
+                                      state.limit * self._backoff)
+                    state.backed_off = now
+            else:
+                state.limit = min(self._max_limit,
+                                  state.limit + 1.0 / state.limit)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, endpoint, method='GET'):
+        """Context manager holding a slot for one request.
+
+        Yields the Ticket, whose status the request should set.
+        """
+        ticket = self.acquire(endpoint, method)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def snapshot(self):
+        """Map endpoint -> dict of its limit, in_flight, waiting and
+        throttled (requests that had to wait for a token or a slot)
+        counts.
+        """
+        with self._cond:
+            return dict((url, {'limit': state.limit,
+                               'in_flight': state.in_flight,
+                               'waiting': sum(state.waiting),
+                               'throttled': state.throttled})
+                        for url, state in six.iteritems(self._endpoints))
+
+
+@contextlib.contextmanager
+def slot(scheduler, endpoint, method='GET'):
+    """Scheduler.slot(), or a throwaway Ticket if scheduler is None."""
+    if scheduler is None:
+        yield Ticket(endpoint, None)
+        return
+    with scheduler.slot(endpoint, method) as ticket:
+        yield ticket
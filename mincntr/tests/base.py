@@ -15,9 +15,22 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import threading
+import time
+
 from oslotest import base
 
 
+def wait_threads_gone(name, timeout=5):
+    """Wait until no thread called name is alive; False on timeout."""
+    deadline = time.time() + timeout
+    while any(t.name == name for t in threading.enumerate()):
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
 class TestCase(base.BaseTestCase):
 
     """Test case base class for all unit tests."""
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+benchmark
+----------------------------------
+
+Runs every APIBase operation of both backends against the fake servers
+in `mincntr.tests.fakes` and reports throughput, latency percentiles and
+daemon round trips per operation as JSON::
+
+    python -m mincntr.tests.benchmark --containers 2000 --latency 0.001
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from mincntr import docker_api
+from mincntr import k8s_api
+from mincntr.tests import fakes
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(backend, operation, fake, func, iterations):
+    """Call func(i) iterations times and summarise the timings."""
+    samples = []
+    requests_before = fake.requests
+    started = time.time()
+    for i in range(iterations):
+        begin = time.time()
+        func(i)
+        samples.append(time.time() - begin)
+    elapsed = time.time() - started
+    return {'backend': backend,
+            'operation': operation,
+            'iterations': iterations,
+            'ops_per_sec': iterations / elapsed if elapsed else None,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'requests_per_op': float(fake.requests - requests_before) /
+            iterations}
+
+
+def _operations(api, name):
+    """(operation, func, is_list) for every APIBase method."""
+    return [
+        ('create', lambda i: api.create(name(i), 'busybox:1',
+                                        command='true'), False),
+        ('list', lambda i: api.list(), True),
+        ('start', lambda i: api.start(name(i)), False),
+        ('inspect', lambda i: api.inspect(name(i)), False),
+        ('pause', lambda i: api.pause(name(i)), False),
+        ('unpause', lambda i: api.unpause(name(i)), False),
+        ('restart', lambda i: api.restart(name(i)), False),
+        ('logs', lambda i: api.logs(name(i)), False),
+        ('execute', lambda i: api.execute(name(i), 'echo hello'), False),
+        ('stop', lambda i: api.stop(name(i)), False),
+        ('delete', lambda i: api.delete(name(i)), False),
+    ]
+
+
+def run(backend, api, fake, iterations, list_iterations):
+    results = []
+
+    def name(i):
+        return 'bench-%d' % i
+
+    for operation, func, is_list in _operations(api, name):
+        results.append(measure(backend, operation, fake, func,
+                               list_iterations if is_list else iterations))
+    return results
+
+
+def bench_docker(args):
+    with fakes.FakeDocker(containers=args.containers,
+                          latency=args.latency) as fake:
+        api = docker_api.DockerAPI(url=fake.url)
+        try:
+            return run('docker', api, fake, args.iterations,
+                       args.list_iterations)
+        finally:
+            api.close()
+
+
+def bench_kubernetes(args):
+    with fakes.FakeKubernetes(pods=args.containers,
+                              latency=args.latency) as fake:
+        api = k8s_api.KubernetesAPI(url=fake.url)
+        try:
+            return run('kubernetes', api, fake, args.iterations,
+                       args.list_iterations)
+        finally:
+            api.close()
+
+
+BACKENDS = {'docker': bench_docker, 'kubernetes': bench_kubernetes}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        action='append',
+                        help='Backend to benchmark (default: all)')
+    parser.add_argument('--containers', type=int, default=100,
+                        help='Containers or pods the fakes start with')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds added to every fake request')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--list-iterations', type=int, default=5)
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    args = parser.parse_args(argv)
+
+    results = []
+    for backend in args.backend or sorted(BACKENDS):
+        results.extend(BACKENDS[backend](args))
+    json.dump({'containers': args.containers,
+               'latency': args.latency,
+               'results': results}, args.output, indent=2, sort_keys=True)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
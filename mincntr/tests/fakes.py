@@ -0,0 +1,895 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+fakes
+----------------------------------
+
+In-process stand-ins for the Docker Engine API and the Kubernetes
+apiserver.  They keep just enough state for the mincntr backends to run
+every APIBase operation, can be pre-filled with any number of
+containers or pods, add a configurable latency to each request, and
+count the requests they serve.
+"""
+
+import base64
+import calendar
+import hashlib
+import itertools
+import json
+import os
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+import uuid
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse as urlparse
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Dispatches requests to the routes of the owning fake server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'fake'
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        fake.count_request()
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self._read_chunked()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+        path = urlparse.unquote(url.path)
+        for route_method, pattern, func in fake.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                return func(self, query, body, *match.groups())
+        self.send_json({'message': 'no route %s %s' % (method, path)}, 404)
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                self.rfile.readline()
+                return b''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def send_body(self, body, status=200,
+                  content_type='application/octet-stream'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, obj, status=200):
+        self.send_body(json.dumps(obj).encode('utf-8'), status,
+                       'application/json')
+
+    def start_chunked(self, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def send_chunk(self, data):
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii') +
+                         data + b'\r\n')
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class FakeTCPHandler(FakeHandler):
+
+    # Headers and body go out in separate writes; without this every
+    # response waits for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('fake', 0)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """Base class running a route table in a background thread."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.RLock()
+        self.routes = []
+        self._server = None
+        self._watchers = []
+        self.log_entries = {}
+
+    def route(self, method, pattern, func):
+        self.routes.append((method, re.compile('^' + pattern + '$'), func))
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def _serve(self, server):
+        server.fake = self
+        self._server = server
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            for watcher in list(self._watchers):
+                watcher.put(None)
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def wait_for_watchers(self, count=1, timeout=5):
+        """Wait until count clients follow the event/watch stream."""
+        deadline = time.time() + timeout
+        while len(self._watchers) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self._watchers) >= count
+
+    def _notify(self, event):
+        for watcher in list(self._watchers):
+            watcher.put(event)
+
+    # Every container or pod starts out with LOG_LINES lines of log,
+    # written a second apart from LOG_START on.
+    LOG_START = 1451606400
+    LOG_LINES = 10
+
+    def _log(self, key, prefix):
+        """The log entries (time, stream, line) of a container or pod."""
+        with self.lock:
+            if key not in self.log_entries:
+                self.log_entries[key] = [
+                    (self.LOG_START + i, 1 + i % 2,
+                     ('%s line %d\n' % (prefix, i)).encode('utf-8'))
+                    for i in six.moves.range(self.LOG_LINES)]
+            return self.log_entries[key]
+
+    def _append_log(self, key, prefix, line, stream=1):
+        with self.lock:
+            self._log(key, prefix).append((time.time(), stream, line))
+
+    def _send_logs(self, handler, key, prefix, tail, since, follow, encode,
+                   alive, content_type):
+        """Send the log selected by tail and since; if follow, go on with
+        the lines added later until alive() turns false.
+        """
+        with self.lock:
+            entries = self._log(key, prefix)
+            position = len(entries)
+            selected = [entry for entry in entries
+                        if since is None or entry[0] >= since]
+        if tail is not None:
+            selected = selected[len(selected) - tail:] if tail else []
+        if not follow:
+            return handler.send_body(b''.join(encode(entry)
+                                              for entry in selected),
+                                     content_type=content_type)
+        try:
+            handler.start_chunked(content_type)
+            for entry in selected:
+                handler.send_chunk(encode(entry))
+            while self._server is not None and alive():
+                with self.lock:
+                    added = self.log_entries[key][position:]
+                position += len(added)
+                for entry in added:
+                    handler.send_chunk(encode(entry))
+                if not added:
+                    time.sleep(0.01)
+            handler.end_chunked()
+        except (IOError, socket.error):
+            pass
+
+    def _stream_events(self, handler, encode):
+        """Stream notifications to a watching client until stopped."""
+        watcher = six.moves.queue.Queue()
+        with self.lock:
+            self._watchers.append(watcher)
+        try:
+            handler.start_chunked()
+            while True:
+                event = watcher.get()
+                if event is None:
+                    break
+                handler.send_chunk(encode(event))
+            handler.end_chunked()
+        except (IOError, socket.error):
+            pass
+        finally:
+            with self.lock:
+                self._watchers.remove(watcher)
+
+
+def _frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+def run_command(command, stdin=b''):
+    """Output and exit code of a command run by the fakes' exec.
+
+    sleep N and exit N do what they say, cat echoes stdin back and
+    anything else echoes the command line.
+    """
+    command = list(command or [])
+    if command[:1] == ['sleep']:
+        time.sleep(float(command[1]))
+        return b'', 0
+    if command[:1] == ['exit']:
+        return b'', int(command[1])
+    if command == ['cat']:
+        return stdin, 0
+    return (' '.join(command) + '\n').encode('utf-8'), 0
+
+
+_WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def _ws_frame(opcode, payload):
+    header = bytearray([0x80 | opcode])
+    if len(payload) < 126:
+        header.append(len(payload))
+    elif len(payload) < 2 ** 16:
+        header.append(126)
+        header.extend(struct.pack('>H', len(payload)))
+    else:
+        header.append(127)
+        header.extend(struct.pack('>Q', len(payload)))
+    return bytes(header) + payload
+
+
+def _ws_read_frame(rfile):
+    """(opcode, payload) of the next frame from a client."""
+    first, second = bytearray(rfile.read(2))
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('>H', rfile.read(2))
+    elif length == 127:
+        length, = struct.unpack('>Q', rfile.read(8))
+    mask = bytearray(rfile.read(4)) if second & 0x80 else None
+    payload = bytearray(rfile.read(length))
+    if mask:
+        for i in six.moves.range(length):
+            payload[i] ^= mask[i % 4]
+    return first & 0x0f, bytes(payload)
+
+
+class FakeDocker(FakeServer):
+    """Docker Engine API stub listening on a unix socket."""
+
+    VERSION_PREFIX = '(?:/v[0-9.]+)?'
+
+    def __init__(self, containers=0, latency=0, api_version='1.22',
+                 socket_path=None):
+        super(FakeDocker, self).__init__(latency)
+        self.api_version = api_version
+        self._tempdir = None
+        if socket_path is None:
+            self._tempdir = tempfile.mkdtemp(prefix='mincntr-fake-')
+            socket_path = os.path.join(self._tempdir, 'docker.sock')
+        self.socket_path = socket_path
+        self.url = 'unix://' + self.socket_path
+        self.containers = {}
+        self.images = {}
+        self.execs = {}
+        self.stats_samples = 5
+        self.stats_interval = 0.01
+        for i in six.moves.range(containers):
+            self.add_container('fake-%d' % i, running=True)
+
+        p = self.VERSION_PREFIX
+        cid = '/containers/([^/]+)'
+        self.route('GET', p + '/version', self.version)
+        self.route('GET', p + '/events', self.events)
+        self.route('GET', p + '/containers/json', self.list_containers)
+        self.route('POST', p + '/containers/create', self.create)
+        self.route('GET', p + cid + '/json', self.inspect)
+        self.route('POST', p + cid + '/(start|stop|restart|pause|unpause)',
+                   self.action)
+        self.route('DELETE', p + cid, self.remove)
+        self.route('GET', p + cid + '/logs', self.logs)
+        self.route('POST', p + cid + '/exec', self.exec_create)
+        self.route('POST', p + '/exec/([^/]+)/start', self.exec_start)
+        self.route('GET', p + '/exec/([^/]+)/json', self.exec_inspect)
+        self.route('GET', p + '/containers/([^/]+)/stats', self.stats)
+        self.route('GET', p + cid + '/archive', self.get_archive)
+        self.route('PUT', p + cid + '/archive', self.put_archive)
+        self.route('POST', p + '/images/create', self.pull)
+        self.route('GET', p + '/images/(.+)/json', self.inspect_image)
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._serve(_UnixServer(self.socket_path, FakeHandler))
+
+    def stop(self):
+        super(FakeDocker, self).stop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self._tempdir is not None:
+            os.rmdir(self._tempdir)
+            self._tempdir = None
+
+    def add_container(self, name, image='busybox:latest', running=False,
+                      command=None, hostname=None):
+        docker_id = uuid.uuid4().hex + uuid.uuid4().hex
+        info = {'Id': docker_id,
+                'Name': '/' + name,
+                'Created': '2016-01-01T00:00:00Z',
+                'Image': image,
+                'Config': {'Hostname': hostname or docker_id[:12],
+                           'Image': image,
+                           'Cmd': command,
+                           'Tty': False},
+                'State': {'Running': running,
+                          'Paused': False,
+                          'Error': '',
+                          'ExitCode': 0,
+                          'Status': 'running' if running else 'created'}}
+        with self.lock:
+            self.containers[docker_id] = info
+        self._notify({'status': 'create', 'id': docker_id, 'from': image,
+                      'time': int(time.time())})
+        return info
+
+    def _find(self, name_or_id):
+        with self.lock:
+            if name_or_id in self.containers:
+                return self.containers[name_or_id]
+            for info in self.containers.values():
+                if (info['Name'] == '/' + name_or_id or
+                        info['Id'].startswith(name_or_id)):
+                    return info
+        return None
+
+    def _with_container(func):
+        def wrapped(self, handler, query, body, name_or_id, *args):
+            info = self._find(name_or_id)
+            if info is None:
+                return handler.send_json(
+                    {'message': 'No such container: %s' % name_or_id}, 404)
+            return func(self, handler, query, body, info, *args)
+        return wrapped
+
+    def version(self, handler, query, body):
+        handler.send_json({'ApiVersion': self.api_version,
+                           'Version': '1.10.0'})
+
+    def events(self, handler, query, body):
+        self._stream_events(handler,
+                            lambda event: json.dumps(event).encode('utf-8'))
+
+    def list_containers(self, handler, query, body):
+        with self.lock:
+            summary = [{'Id': info['Id'],
+                        'Names': [info['Name']],
+                        'Image': info['Image'],
+                        'Created': 1451606400,
+                        'State': info['State']['Status'],
+                        'Status': info['State']['Status']}
+                       for info in self.containers.values()]
+        handler.send_json(summary)
+
+    def create(self, handler, query, body):
+        config = json.loads(body.decode('utf-8'))
+        name = query.get('name', [uuid.uuid4().hex[:8]])[0]
+        if self._find(name) is not None:
+            return handler.send_json({'message': 'Conflict'}, 409)
+        info = self.add_container(name, image=config.get('Image'),
+                                  command=config.get('Cmd'),
+                                  hostname=config.get('Hostname'))
+        handler.send_json({'Id': info['Id'], 'Warnings': None}, 201)
+
+    @_with_container
+    def inspect(self, handler, query, body, info):
+        handler.send_json(info)
+
+    @_with_container
+    def action(self, handler, query, body, info, action):
+        state = info['State']
+        with self.lock:
+            if action in ('start', 'restart', 'unpause'):
+                state.update(Running=True, Paused=False, Status='running')
+            elif action == 'stop':
+                state.update(Running=False, Paused=False, Status='exited')
+            elif action == 'pause':
+                state.update(Paused=True, Status='paused')
+        self._notify({'status': action == 'stop' and 'die' or action,
+                      'id': info['Id'], 'from': info['Image'],
+                      'time': int(time.time())})
+        handler.send_body(b'', 204)
+
+    @_with_container
+    def remove(self, handler, query, body, info):
+        force = query.get('force', ['false'])[0].lower() in ('1', 'true')
+        with self.lock:
+            if info['State']['Running'] and not force:
+                return handler.send_json(
+                    {'message': 'You cannot remove a running container '
+                                '%s. Stop the container before attempting '
+                                'removal or force remove' % info['Id']},
+                    409)
+            self.containers.pop(info['Id'], None)
+        self._notify({'status': 'destroy', 'id': info['Id'],
+                      'from': info['Image'], 'time': int(time.time())})
+        handler.send_body(b'', 204)
+
+    def add_log(self, name_or_id, line, stream=1):
+        """Append a line to the log of a container."""
+        info = self._find(name_or_id)
+        self._append_log(info['Id'], info['Name'], line, stream)
+
+    @_with_container
+    def logs(self, handler, query, body, info):
+        tail = query.get('tail', ['all'])[0]
+        since = query.get('since')
+        self._send_logs(
+            handler, info['Id'], info['Name'],
+            tail=None if tail == 'all' else int(tail),
+            since=since and int(since[0]),
+            follow=query.get('follow', ['0'])[0] in ('1', 'true'),
+            encode=lambda entry: _frame(entry[1], entry[2]),
+            alive=lambda: (info['State']['Running'] and
+                           self._find(info['Id']) is not None),
+            content_type='application/vnd.docker.raw-stream')
+
+    @_with_container
+    def exec_create(self, handler, query, body, info):
+        config = json.loads(body.decode('utf-8'))
+        exec_id = uuid.uuid4().hex
+        with self.lock:
+            self.execs[exec_id] = {'Cmd': config.get('Cmd'),
+                                   'AttachStdin': bool(
+                                       config.get('AttachStdin')),
+                                   'ContainerID': info['Id'],
+                                   'ExitCode': None, 'Running': False}
+        handler.send_json({'Id': exec_id}, 201)
+
+    def exec_start(self, handler, query, body, exec_id):
+        with self.lock:
+            exec_info = self.execs.get(exec_id)
+        if exec_info is None:
+            return handler.send_json({'message': 'No such exec'}, 404)
+        # The connection is hijacked: stdin comes in until the client
+        # half-closes it, the output goes out until we close it.
+        handler.send_response(200)
+        handler.send_header('Content-Type',
+                            'application/vnd.docker.raw-stream')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+        stdin = handler.rfile.read() if exec_info['AttachStdin'] else b''
+        output, exit_code = run_command(exec_info['Cmd'], stdin)
+        with self.lock:
+            exec_info['ExitCode'] = exit_code
+        handler.wfile.write(_frame(1, output))
+
+    def exec_inspect(self, handler, query, body, exec_id):
+        with self.lock:
+            exec_info = self.execs.get(exec_id)
+        if exec_info is None:
+            return handler.send_json({'message': 'No such exec'}, 404)
+        handler.send_json(exec_info)
+
+    @staticmethod
+    def stats_sample(i):
+        """The i-th stats sample of every container: 2% CPU, growing IO."""
+        return {'read': '2016-01-01T00:00:%02dZ' % (i % 60),
+                'cpu_stats': {'cpu_usage': {'total_usage': 1000 * (i + 2)},
+                              'system_cpu_usage': 100000 * (i + 2),
+                              'online_cpus': 2},
+                'precpu_stats': {'cpu_usage': {'total_usage':
+                                               1000 * (i + 1)},
+                                 'system_cpu_usage': 100000 * (i + 1)},
+                'memory_stats': {'usage': 1024 * (i + 1), 'limit': 4096},
+                'networks': {'eth0': {'rx_bytes': 10 * i,
+                                      'tx_bytes': 20 * i},
+                             'eth1': {'rx_bytes': 1, 'tx_bytes': 2}},
+                'blkio_stats': {'io_service_bytes_recursive': [
+                    {'op': 'Read', 'value': 100 * i},
+                    {'op': 'Write', 'value': 50 * i}]}}
+
+    @_with_container
+    def stats(self, handler, query, body, info):
+        if query.get('stream', ['1'])[0] in ('0', 'false'):
+            return handler.send_json(self.stats_sample(0))
+        # Streams stats_samples samples stats_interval seconds apart.
+        handler.start_chunked()
+        for i in six.moves.range(self.stats_samples):
+            if i:
+                time.sleep(self.stats_interval)
+            handler.send_chunk(json.dumps(self.stats_sample(i)).encode(
+                'utf-8') + b'\n')
+        handler.end_chunked()
+
+    @_with_container
+    def get_archive(self, handler, query, body, info):
+        handler.send_body(info.get('Archive', b''),
+                          content_type='application/x-tar')
+
+    @_with_container
+    def put_archive(self, handler, query, body, info):
+        with self.lock:
+            info['Archive'] = body
+        handler.send_body(b'', 200)
+
+    def pull(self, handler, query, body):
+        image = query['fromImage'][0]
+        tag = query.get('tag', ['latest'])[0]
+        with self.lock:
+            self.images['%s:%s' % (image, tag)] = 'sha256:' + uuid.uuid4().hex
+        handler.send_json({'status': 'Downloaded newer image'})
+
+    def inspect_image(self, handler, query, body, image):
+        if ':' not in image:
+            image += ':latest'
+        with self.lock:
+            image_id = self.images.get(image)
+        if image_id is None:
+            return handler.send_json({'message': 'No such image'}, 404)
+        handler.send_json({'Id': image_id})
+
+
+class FakeKubernetes(FakeServer):
+    """Kubernetes apiserver stub listening on localhost."""
+
+    def __init__(self, pods=0, latency=0, namespace='default'):
+        super(FakeKubernetes, self).__init__(latency)
+        self.namespace = namespace
+        self.pods = {}
+        self.controllers = {}
+        self._resource_version = itertools.count(1)
+        self.resource_version = '0'
+        for i in six.moves.range(pods):
+            self.add_pod('fake-%d' % i)
+
+        ns = '/api/v1/namespaces/([^/]+)/pods'
+        self.route('GET', '/api/v1/pods', self.list_pods)
+        self.route('GET', ns, self.list_pods)
+        self.route('POST', ns, self.create)
+        self.route('DELETE', ns, self.delete_collection)
+        self.route('GET', ns + '/([^/]+)', self.read)
+        self.route('DELETE', ns + '/([^/]+)', self.delete)
+        self.route('GET', ns + '/([^/]+)/log', self.log)
+        self.route('GET', ns + '/([^/]+)/exec', self.exec_pod)
+        self.route('POST', ns + '/([^/]+)/exec', self.exec_pod)
+        metrics = '/apis/metrics.k8s.io/v1beta1/namespaces/([^/]+)/pods'
+        self.route('GET', metrics, self.list_metrics)
+        self.route('GET', metrics + '/([^/]+)', self.read_metrics)
+        rc = '/api/v1/namespaces/([^/]+)/replicationcontrollers'
+        self.route('POST', rc, self.create_controller)
+        self.route('GET', rc + '/([^/]+)', self.read_controller)
+        self.route('PATCH', rc + '/([^/]+)', self.patch_controller)
+        self.route('DELETE', rc + '/([^/]+)', self.delete_controller)
+
+    def start(self):
+        self._serve(_TCPServer(('127.0.0.1', 0), FakeTCPHandler))
+        self.url = 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+    def _bump(self):
+        self.resource_version = str(next(self._resource_version))
+        return self.resource_version
+
+    def add_pod(self, name, namespace=None, image='busybox:latest',
+                labels=None, containers=None):
+        namespace = namespace or self.namespace
+        with self.lock:
+            pod = {'kind': 'Pod', 'apiVersion': 'v1',
+                   'metadata': {'name': name, 'namespace': namespace,
+                                'uid': str(uuid.uuid4()),
+                                'creationTimestamp': '2016-01-01T00:00:00Z',
+                                'labels': labels or {},
+                                'resourceVersion': self._bump()},
+                   'spec': {'containers': containers or [
+                       {'name': name, 'image': image}]},
+                   'status': {'phase': 'Running'}}
+            self.pods[(namespace, name)] = pod
+        self._notify({'type': 'ADDED', 'object': pod})
+        return pod
+
+    def _remove_pod(self, key):
+        with self.lock:
+            pod = self.pods.pop(key, None)
+            if pod is not None:
+                pod['metadata']['resourceVersion'] = self._bump()
+        if pod is not None:
+            self._notify({'type': 'DELETED', 'object': pod})
+        return pod
+
+    def _select(self, namespace, query):
+        labels = {}
+        for term in (query.get('labelSelector') or [''])[0].split(','):
+            if '=' in term:
+                key, value = term.split('=', 1)
+                labels[key] = value
+        with self.lock:
+            return [pod for (ns, _), pod in sorted(self.pods.items())
+                    if namespace in (None, ns) and
+                    all(pod['metadata']['labels'].get(k) == v
+                        for k, v in labels.items())]
+
+    def list_pods(self, handler, query, body, namespace=None):
+        if query.get('watch', [''])[0] == 'true':
+            return self._stream_events(
+                handler,
+                lambda event: json.dumps(event).encode('utf-8') + b'\n')
+        pods = self._select(namespace, query)
+        metadata = {'resourceVersion': self.resource_version}
+        if 'limit' in query:
+            start = int(query.get('continue', ['0'])[0])
+            end = start + int(query['limit'][0])
+            if end < len(pods):
+                metadata['continue'] = str(end)
+            pods = pods[start:end]
+        handler.send_json({'kind': 'PodList', 'apiVersion': 'v1',
+                           'metadata': metadata, 'items': pods})
+
+    def create(self, handler, query, body, namespace):
+        manifest = json.loads(body.decode('utf-8'))
+        metadata = manifest.get('metadata') or {}
+        name = metadata.get('name')
+        if (namespace, name) in self.pods:
+            return handler.send_json({'kind': 'Status', 'code': 409}, 409)
+        image = manifest['spec']['containers'][0]['image']
+        pod = self.add_pod(name, namespace, image=image,
+                           labels=metadata.get('labels'),
+                           containers=manifest['spec']['containers'])
+        handler.send_json(pod, 201)
+
+    def read(self, handler, query, body, namespace, name):
+        with self.lock:
+            pod = self.pods.get((namespace, name))
+        if pod is None:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        handler.send_json(pod)
+
+    def delete(self, handler, query, body, namespace, name):
+        if self._remove_pod((namespace, name)) is None:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        handler.send_json({'kind': 'Status', 'status': 'Success'})
+
+    def delete_collection(self, handler, query, body, namespace):
+        for pod in self._select(namespace, query):
+            self._remove_pod((namespace, pod['metadata']['name']))
+        handler.send_json({'kind': 'Status', 'status': 'Success'})
+
+    def add_log(self, name, line, namespace=None):
+        """Append a line to the log of a pod."""
+        self._append_log((namespace or self.namespace, name), name, line)
+
+    def log(self, handler, query, body, namespace, name):
+        if (namespace, name) not in self.pods:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        tail = query.get('tailLines')
+        since = query.get('sinceTime')
+        self._send_logs(
+            handler, (namespace, name), name,
+            tail=tail and int(tail[0]),
+            since=since and calendar.timegm(time.strptime(
+                since[0], '%Y-%m-%dT%H:%M:%SZ')),
+            follow=query.get('follow', [''])[0] == 'true',
+            encode=lambda entry: entry[2],
+            alive=lambda: (namespace, name) in self.pods,
+            content_type='text/plain')
+
+    @staticmethod
+    def _pod_metrics(pod):
+        """Every pod uses 20 millicores and 1 MiB."""
+        return {'kind': 'PodMetrics',
+                'metadata': {'name': pod['metadata']['name'],
+                             'namespace': pod['metadata']['namespace']},
+                'timestamp': '2016-01-01T00:00:00Z',
+                'window': '30s',
+                'containers': [{'name': c['name'],
+                                'usage': {'cpu': '20m', 'memory': '1Mi'}}
+                               for c in pod['spec']['containers']]}
+
+    def list_metrics(self, handler, query, body, namespace):
+        handler.send_json({'kind': 'PodMetricsList',
+                           'items': [self._pod_metrics(pod) for pod
+                                     in self._select(namespace, query)]})
+
+    def read_metrics(self, handler, query, body, namespace, name):
+        with self.lock:
+            pod = self.pods.get((namespace, name))
+        if pod is None:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        handler.send_json(self._pod_metrics(pod))
+
+    def _reconcile(self, namespace, name, selector):
+        """Create or delete pods of a controller, one at a time."""
+        while True:
+            with self.lock:
+                controller = self.controllers.get((namespace, name))
+                wanted = 0 if controller is None else (
+                    controller['spec']['replicas'])
+            pods = self._select(namespace, {'labelSelector': [','.join(
+                '%s=%s' % item for item in selector.items())]})
+            if len(pods) == wanted:
+                return
+            time.sleep(0.005)
+            if len(pods) < wanted:
+                template = controller['spec']['template']
+                self.add_pod('%s-%s' % (name, uuid.uuid4().hex[:5]),
+                             namespace,
+                             image=template['spec']['containers'][0]['image'],
+                             labels=dict(template['metadata']['labels']))
+            else:
+                self._remove_pod((namespace, pods[-1]['metadata']['name']))
+
+    def _start_reconcile(self, namespace, controller):
+        thread = threading.Thread(target=self._reconcile,
+                                  args=(namespace,
+                                        controller['metadata']['name'],
+                                        controller['spec']['selector']))
+        thread.daemon = True
+        thread.start()
+
+    def create_controller(self, handler, query, body, namespace):
+        controller = json.loads(body.decode('utf-8'))
+        name = controller['metadata']['name']
+        with self.lock:
+            if (namespace, name) in self.controllers:
+                return handler.send_json({'kind': 'Status', 'code': 409},
+                                         409)
+            controller['metadata'].update({'namespace': namespace,
+                                           'uid': str(uuid.uuid4()),
+                                           'resourceVersion': self._bump()})
+            self.controllers[(namespace, name)] = controller
+        self._start_reconcile(namespace, controller)
+        handler.send_json(controller, 201)
+
+    def read_controller(self, handler, query, body, namespace, name):
+        with self.lock:
+            controller = self.controllers.get((namespace, name))
+        if controller is None:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        handler.send_json(controller)
+
+    def patch_controller(self, handler, query, body, namespace, name):
+        content_type = handler.headers.get('Content-Type', '')
+        patch = json.loads(body.decode('utf-8'))
+        if content_type == 'application/json-patch+json':
+            valid = isinstance(patch, list)
+        elif content_type in ('application/merge-patch+json',
+                              'application/strategic-merge-patch+json'):
+            valid = isinstance(patch, dict)
+        else:
+            return handler.send_json({'kind': 'Status', 'code': 415}, 415)
+        if not valid:
+            return handler.send_json({'kind': 'Status', 'code': 400}, 400)
+        with self.lock:
+            controller = self.controllers.get((namespace, name))
+            if controller is not None:
+                if isinstance(patch, list):
+                    for op in patch:
+                        if op['path'] == '/spec/replicas':
+                            controller['spec']['replicas'] = op['value']
+                elif 'replicas' in (patch.get('spec') or {}):
+                    controller['spec']['replicas'] = (
+                        patch['spec']['replicas'])
+        if controller is None:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        self._start_reconcile(namespace, controller)
+        handler.send_json(controller)
+
+    def delete_controller(self, handler, query, body, namespace, name):
+        with self.lock:
+            controller = self.controllers.pop((namespace, name), None)
+        if controller is None:
+            return handler.send_json({'kind': 'Status', 'code': 404}, 404)
+        # Background propagation: the pods follow their controller.
+        self._start_reconcile(namespace, controller)
+        handler.send_json({'kind': 'Status', 'status': 'Success'})
+
+    def exec_pod(self, handler, query, body, namespace, name):
+        if handler.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._exec_websocket(handler, query)
+        output, _ = run_command(query.get('command'))
+        handler.send_body(output, content_type='text/plain')
+
+    def _exec_websocket(self, handler, query):
+        """Run the command over the channel.k8s.io exec subprotocols."""
+        offered = [protocol.strip() for protocol in handler.headers.get(
+            'Sec-WebSocket-Protocol', '').split(',')]
+        protocol = ('v5.channel.k8s.io' if 'v5.channel.k8s.io' in offered
+                    else 'v4.channel.k8s.io')
+        key = handler.headers['Sec-WebSocket-Key'] + _WEBSOCKET_GUID
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', base64.b64encode(
+            hashlib.sha1(key.encode('ascii')).digest()).decode('ascii'))
+        handler.send_header('Sec-WebSocket-Protocol', protocol)
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+
+        stdin = []
+        if query.get('stdin', [''])[0] == 'true':
+            # Until the client closes stdin (v5) or the connection.
+            while True:
+                opcode, data = _ws_read_frame(handler.rfile)
+                if opcode == 8 or data == b'\xff\x00':
+                    break
+                if data[:1] == b'\x00':
+                    stdin.append(data[1:])
+        output, exit_code = run_command(query.get('command'), b''.join(stdin))
+        if exit_code:
+            status = {'status': 'Failure', 'reason': 'NonZeroExitCode',
+                      'details': {'causes': [{'reason': 'ExitCode',
+                                              'message': str(exit_code)}]}}
+        else:
+            status = {'status': 'Success'}
+        handler.wfile.write(_ws_frame(2, b'\x01' + output))
+        handler.wfile.write(_ws_frame(2, b'\x03' +
+                                      json.dumps(status).encode('utf-8')))
+        handler.wfile.write(_ws_frame(8, struct.pack('>H', 1000)))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_aio_docker_api
+----------------------------------
+
+Tests for `mincntr.aio_docker_api` against a fake daemon on a unix
+socket.
+"""
+
+import re
+
+import testtools
+
+try:
+    import asyncio
+
+    from mincntr import aio_docker_api
+except (ImportError, SyntaxError):
+    aio_docker_api = None
+
+from mincntr import docker_api
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+@testtools.skipIf(aio_docker_api is None, "needs Python 3.5 and aiohttp")
+class TestAsyncDockerAPI(base.TestCase):
+
+    def setUp(self):
+        super(TestAsyncDockerAPI, self).setUp()
+        self.fake = fakes.FakeDocker(containers=2)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.api = aio_docker_api.AsyncDockerAPI(url=self.fake.url)
+        self.addCleanup(lambda: self._run(self.api.close()))
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_list(self):
+        names = [c.name for c in self._run(self.api.list())]
+        self.assertEqual(['fake-0', 'fake-1'], sorted(names))
+
+    def test_list_records_match_docker_api(self):
+        blocking = docker_api.DockerAPI(url=self.fake.url)
+        self.addCleanup(blocking.close)
+
+        def fields(containers):
+            return sorted((c.uuid, c.name, c.image, c.state, c.created)
+                          for c in containers)
+
+        self.assertEqual(fields(blocking.list()),
+                         fields(self._run(self.api.list())))
+
+    def test_create(self):
+        self.assertTrue(self._run(self.api.create(
+            'new', 'busybox:1', command='sleep 10', environment={'A': 1},
+            memory=1024)))
+        info = self.fake._find('new')
+        self.assertEqual(['sleep', '10'], info['Config']['Cmd'])
+        self.assertIn('busybox:1', self.fake.images)
+
+    def test_actions_and_inspect(self):
+        self._run(self.api.start('fake-0'))
+        self.assertTrue(self._run(self.api.inspect('fake-0'))['Running'])
+        self._run(self.api.pause('fake-0'))
+        self.assertEqual('paused',
+                         self._run(self.api.inspect('fake-0'))['Status'])
+        self._run(self.api.unpause('fake-0'))
+        self._run(self.api.stop('fake-0'))
+        self.assertFalse(self._run(self.api.inspect('fake-0'))['Running'])
+        self._run(self.api.restart('fake-0'))
+        self.assertTrue(self._run(self.api.inspect('fake-0'))['Running'])
+
+    def test_missing_container(self):
+        self.assertIsNone(self._run(self.api.inspect('missing')))
+        self.assertIsNone(self._run(self.api.delete('missing')))
+        for action in ('start', 'stop', 'restart', 'pause', 'unpause'):
+            self.assertRaises(Exception, self._run,
+                              getattr(self.api, action)('missing'))
+        self.assertRaises(Exception, self._run,
+                          self.api.execute('missing', 'ls'))
+
+    def test_delete(self):
+        self._run(self.api.stop('fake-1'))
+        self._run(self.api.delete('fake-1'))
+        self.assertIsNone(self.fake._find('fake-1'))
+
+    def test_error(self):
+        self.fake.routes.insert(0, ('POST', re.compile('^.*/start$'),
+                                    lambda handler, *args: handler.send_json(
+                                        {'message': 'boom'}, 500)))
+        self.assertRaises(Exception, self._run, self.api.start('fake-0'))
+
+    def test_logs(self):
+        output = self._run(self.api.logs('fake-0'))['output']
+        self.assertEqual(b''.join(('/fake-0 line %d\n' % i).encode('utf-8')
+                                  for i in range(10)), output)
+
+    def test_execute(self):
+        output = self._run(self.api.execute('fake-0', 'echo hi'))
+        self.assertEqual({'output': b'echo hi\n'}, output)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_aio_k8s_api
+----------------------------------
+
+Tests for `mincntr.aio_k8s_api` against a fake apiserver.
+"""
+
+import fixtures
+import testtools
+
+try:
+    import asyncio
+
+    from mincntr import aio_k8s_api
+except (ImportError, SyntaxError):
+    aio_k8s_api = None
+
+from mincntr import k8s_api
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+@testtools.skipIf(aio_k8s_api is None, "needs Python 3.5 and aiohttp")
+class TestAsyncKubernetesAPI(base.TestCase):
+
+    def setUp(self):
+        super(TestAsyncKubernetesAPI, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=2)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.api = aio_k8s_api.AsyncKubernetesAPI(url=self.fake.url)
+        self.addCleanup(lambda: self._run(self.api.close()))
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_url_from_environment(self):
+        self.useFixture(fixtures.EnvironmentVariable('KUBERNETES_MASTER',
+                                                     self.fake.url))
+        k8s = aio_k8s_api.AsyncKubernetesAPI()
+        self.addCleanup(lambda: self._run(k8s.close()))
+        self.assertEqual(2, len(self._run(k8s.list())))
+
+    def test_list(self):
+        names = [c.name for c in self._run(self.api.list())]
+        self.assertEqual(['fake-0', 'fake-1'], sorted(names))
+
+    def test_list_records_match_kubernetes_api(self):
+        blocking = k8s_api.KubernetesAPI(url=self.fake.url)
+        self.addCleanup(blocking.close)
+
+        def fields(containers):
+            return sorted((c.uuid, c.name, c.image, c.state, c.created)
+                          for c in containers)
+
+        self.assertEqual(fields(blocking.list()),
+                         fields(self._run(self.api.list())))
+
+    def test_create(self):
+        self._run(self.api.create('new', 'busybox', command='sleep 10',
+                                  environment={'A': 1}, memory='64Mi'))
+        pod = self.fake.pods[('default', 'new')]
+        self.assertEqual([{'name': 'new', 'image': 'busybox',
+                           'command': ['sleep', '10'],
+                           'env': [{'name': 'A', 'value': '1'}],
+                           'resources': {'limits': {'memory': '64Mi'}}}],
+                         pod['spec']['containers'])
+
+    def test_inspect(self):
+        self.assertEqual({'phase': 'Running'},
+                         self._run(self.api.inspect('fake-0')))
+        self.assertIsNone(self._run(self.api.inspect('missing')))
+
+    def test_delete(self):
+        self._run(self.api.delete('fake-1'))
+        self.assertNotIn(('default', 'fake-1'), self.fake.pods)
+        self.assertIsNone(self._run(self.api.delete('fake-1')))
+
+    def test_logs(self):
+        output = self._run(self.api.logs('fake-0'))['output']
+        self.assertEqual(b''.join(('fake-0 line %d\n' % i).encode('utf-8')
+                                  for i in range(10)), output)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_api
+----------------------------------
+
+Tests for the backend independent helpers in `mincntr.api`.
+"""
+
+import threading
+import time
+
+from mincntr import api
+from mincntr.tests import base
+from mincntr import utils
+
+
+class TestRunMany(base.TestCase):
+
+    def test_results_keep_order_and_errors(self):
+        def func(item):
+            if item == 3:
+                raise ValueError(item)
+            return item * 2
+
+        results = api.run_many(func, range(6), concurrency=3)
+        self.assertEqual([0, 1, 2, 3, 4, 5], [r.item for r in results])
+        self.assertEqual([0, 2, 4, None, 8, 10],
+                         [r.result for r in results])
+        self.assertIsInstance(results[3].error, ValueError)
+        self.assertEqual([None] * 5,
+                         [r.error for r in results if r.item != 3])
+
+    def test_empty(self):
+        self.assertEqual([], api.run_many(lambda item: item, []))
+
+
+class TestContainer(base.TestCase):
+
+    def test_details_loaded_once(self):
+        loads = []
+
+        def load(container):
+            loads.append(container.uuid)
+            return {'Id': container.uuid}
+
+        container = api.Container('id-1', 'web', state=api.RUNNING,
+                                  load=load)
+        self.assertEqual({'Id': 'id-1'}, container.details)
+        self.assertEqual({'Id': 'id-1'}, container.details)
+        self.assertEqual(['id-1'], loads)
+        self.assertIsNone(api.Container('id-2', 'db').details)
+
+    def test_compact_and_comparable(self):
+        container = api.Container('id-1', 'web', image='busybox')
+        self.assertFalse(hasattr(container, '__dict__'))
+        self.assertEqual(api.Container('id-1', 'web'), container)
+        self.assertNotEqual(api.Container('id-2', 'web'), container)
+        self.assertEqual(('id-1', 'web'), tuple(container))
+        self.assertEqual(1, len(set([container, api.Container('id-1',
+                                                              'web')])))
+
+    def test_pair_interface(self):
+        container = api.Container('id-1', 'web', image='busybox')
+        uuid, name = container
+        self.assertEqual(('id-1', 'web'), (uuid, name))
+        self.assertEqual(2, len(container))
+        self.assertEqual('web', container[1])
+        self.assertEqual(('id-1',), container[:1])
+        self.assertEqual(('id-1', 'web'), container)
+        self.assertEqual({'uuid': 'id-1', 'name': 'web'},
+                         dict(container._asdict()))
+
+
+class TestIterLines(base.TestCase):
+
+    def test_lines_span_chunks(self):
+        chunks = [b'a\nb', b'', b'c\n\nd', b'e']
+        self.assertEqual([b'a\n', b'bc\n', b'\n', b'de'],
+                         list(utils.iter_lines(chunks)))
+
+
+class TestBackendHelpers(base.TestCase):
+
+    def test_parse_docker_image(self):
+        self.assertEqual(('busybox', None),
+                         utils.parse_docker_image('busybox'))
+        self.assertEqual(('busybox', '1.2'),
+                         utils.parse_docker_image('busybox:1.2'))
+
+    def test_pod_container_spec(self):
+        self.assertEqual({'name': 'web', 'image': 'busybox',
+                          'command': ['sleep', '10'],
+                          'env': [{'name': 'A', 'value': '1'}],
+                          'resources': {'limits': {'memory': '64Mi'}}},
+                         utils.pod_container_spec(
+                             'web', 'busybox', command='sleep 10',
+                             environment={'A': 1}, memory='64Mi',
+                             uuid='ignored'))
+
+
+class TestExecStream(base.TestCase):
+
+    def test_exit_code_after_exhaustion(self):
+        closed = []
+        stream = api.ExecStream(iter([(api.STDOUT, b'out'),
+                                      (api.STDERR, b'err')]),
+                                lambda: 7, close=lambda: closed.append(1))
+        self.assertIsNone(stream.exit_code)
+        self.assertEqual([(api.STDOUT, b'out'), (api.STDERR, b'err')],
+                         list(stream))
+        self.assertEqual(7, stream.exit_code)
+        self.assertEqual([1], closed)
+
+    def test_timeout(self):
+        def chunks():
+            yield api.STDOUT, b'first'
+            raise IOError('read timed out')
+
+        stream = api.ExecStream(chunks(), lambda: 0, timeout=0)
+        self.assertRaises(api.ExecTimeout, list, stream)
+        self.assertIsNone(stream.exit_code)
+
+
+class TestExecManyStream(base.TestCase):
+
+    def setUp(self):
+        super(TestExecManyStream, self).setUp()
+        self.active = 0
+        self.peak = 0
+        self.closed = []
+        self.lock = threading.Lock()
+
+    def _open(self, item):
+        if item == 'bad':
+            raise ValueError(item)
+
+        def chunks():
+            with self.lock:
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            try:
+                for i in range(3):
+                    time.sleep(0.01)
+                    yield api.STDOUT, ('%s%d' % (item, i)).encode('ascii')
+            finally:
+                with self.lock:
+                    self.active -= 1
+
+        return api.ExecStream(chunks(), lambda: len(item),
+                              close=lambda: self.closed.append(item))
+
+    def test_tagged_output_and_exit_codes(self):
+        items = ['a', 'bb', 'bad', 'ccc', 'dddd']
+        stream = api.ExecManyStream(items, self._open, concurrency=2)
+        events = list(stream)
+        for item in ['a', 'bb', 'ccc', 'dddd']:
+            mine = [e for e in events if e.item == item]
+            self.assertEqual(
+                [(api.STDOUT, ('%s%d' % (item, i)).encode('ascii'))
+                 for i in range(3)] + [(api.EXIT, len(item))],
+                [(e.stream, e.data) for e in mine])
+        self.assertEqual({'a': 1, 'bb': 2, 'ccc': 3, 'dddd': 4},
+                         stream.exit_codes)
+        self.assertEqual(['bad'], list(stream.errors))
+        self.assertIsInstance(stream.errors['bad'], ValueError)
+        self.assertEqual(2, self.peak)
+
+    def test_stopping_early_closes_streams(self):
+        stream = api.ExecManyStream(['a', 'b'], self._open, concurrency=2,
+                                    buffer_size=1)
+        events = iter(stream)
+        next(events)
+        events.close()
+        deadline = time.time() + 5
+        while len(self.closed) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(['a', 'b'], sorted(self.closed))
+
+
+class _TarExecAPI(api.APIBase):
+    """Backend whose only working method is a scripted stream_execute."""
+
+    list = create = start = stop = restart = pause = unpause = None
+    delete = inspect = logs = execute = None
+
+    def __init__(self, output, exit_code=0):
+        self.output = output
+        self.exit_code = exit_code
+        self.commands = []
+        self.stdin = []
+
+    def stream_execute(self, container_uuid, command, stdin=None,
+                       timeout=None):
+        self.commands.append(command)
+        if stdin is not None:
+            self.stdin.extend(stdin)
+        return api.ExecStream(iter(self.output), lambda: self.exit_code)
+
+
+class TestDefaultArchive(base.TestCase):
+
+    def test_get_archive_runs_tar(self):
+        backend = _TarExecAPI([(api.STDOUT, b'tar'), (api.STDERR, b'warn'),
+                               (api.STDOUT, b'data')])
+        self.assertEqual([b'tar', b'data'],
+                         list(backend.get_archive('web', '/var/log/')))
+        self.assertEqual([['tar', 'cf', '-', '-C', '/var', 'log']],
+                         backend.commands)
+
+    def test_put_archive_streams_stdin(self):
+        backend = _TarExecAPI([])
+        self.assertTrue(backend.put_archive('web', '/srv', b'abcde',
+                                            chunk_size=2))
+        self.assertEqual([['tar', 'xf', '-', '-C', '/srv']],
+                         backend.commands)
+        self.assertEqual([b'ab', b'cd', b'e'], backend.stdin)
+
+    def test_tar_failure(self):
+        backend = _TarExecAPI([(api.STDERR, b'No such file')], exit_code=2)
+        self.assertRaises(Exception, list,
+                          backend.get_archive('web', '/missing'))
+
+
+def _sample(item, timestamp, cpu, memory):
+    return api.StatsSample(item, timestamp, cpu, memory, 100, timestamp,
+                           None, None, None)
+
+
+class TestStatsAggregation(base.TestCase):
+
+    def test_downsample(self):
+        samples = [_sample(item, t, 1.0, 1)
+                   for t in (0, 0.5, 1, 1.5, 2) for item in 'ab']
+        kept = list(api.downsample(samples, 1))
+        self.assertEqual([('a', 0), ('b', 0), ('a', 1), ('b', 1),
+                          ('a', 2), ('b', 2)],
+                         [(s.item, s.timestamp) for s in kept])
+
+    def test_aggregate(self):
+        samples = [_sample('a', 10, 1.0, 5), _sample('b', 11, 4.0, 1),
+                   _sample('a', 12, 3.0, 7), _sample('a', 15, 5.0, 2),
+                   _sample('a', 19, None, 1)]
+        windows = list(api.aggregate(samples, 5))
+        self.assertEqual(
+            [('a', 10, 2.0, 7, 12), ('a', 15, 5.0, 2, 19),
+             ('b', 10, 4.0, 1, 11)],
+            sorted((w.item, w.timestamp, w.cpu_percent, w.memory_usage,
+                    w.rx_bytes) for w in windows))
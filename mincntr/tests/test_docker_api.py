@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_docker_api
+----------------------------------
+
+Tests for `mincntr.docker_api`: its helpers against stub clients and
+DockerAPI against the fake daemon in `mincntr.tests.fakes`.
+"""
+
+import io
+import itertools
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+
+from docker import errors
+import requests
+
+from mincntr import api
+from mincntr import docker_api
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+class FakeDocker(object):
+
+    def __init__(self, containers):
+        self._containers = containers
+        self.calls = []
+
+    def containers(self, all=False):
+        self.calls.append('containers')
+        return self._containers
+
+    def inspect_container(self, docker_id):
+        self.calls.append('inspect_container')
+        return {'Id': docker_id, 'Name': '/inspected'}
+
+
+class TestContainerIndex(base.TestCase):
+
+    def setUp(self):
+        super(TestContainerIndex, self).setUp()
+        self.docker = FakeDocker([
+            {'Id': 'a' * 64, 'Names': ['/web'], 'State': 'running'},
+            {'Id': 'b' * 64, 'Names': ['/db', '/web/db'],
+             'Status': 'Exited (0) 2 hours ago'},
+        ])
+        self.index = docker_api.ContainerIndex(self.docker)
+        self.index.resync()
+
+    def test_lookup_by_name_and_id(self):
+        self.assertEqual('a' * 64, self.index.lookup('web'))
+        self.assertEqual('a' * 64, self.index.lookup('/web'))
+        self.assertEqual('b' * 64, self.index.lookup('b' * 12))
+        self.assertEqual('b' * 64, self.index.lookup('b' * 64))
+        self.assertIsNone(self.index.lookup('web/db'))
+        self.assertEqual(['containers'], self.docker.calls)
+
+    def test_events_update_index(self):
+        self.index.handle_event({'status': 'create', 'id': 'c' * 64})
+        self.assertEqual('c' * 64, self.index.lookup('inspected'))
+        self.index.handle_event({'Type': 'container', 'Action': 'rename',
+                                 'id': 'c' * 64,
+                                 'Actor': {'Attributes': {'name': 'new'}}})
+        self.assertIsNone(self.index.lookup('inspected'))
+        self.assertEqual('c' * 64, self.index.lookup('new'))
+        self.index.handle_event({'status': 'destroy', 'id': 'a' * 64})
+        self.assertIsNone(self.index.lookup('web'))
+        self.assertIsNone(self.index.lookup('a' * 12))
+
+    def test_states(self):
+        self.assertEqual(api.RUNNING, self.index.state('web'))
+        self.assertEqual(api.STOPPED, self.index.state('db'))
+        self.assertEqual(api.DELETED, self.index.state('missing'))
+        self.index.handle_event({'status': 'pause', 'id': 'a' * 64})
+        self.assertEqual(api.PAUSED, self.index.state('web'))
+
+    def test_wait_for_many(self):
+        self.assertTrue(self.index.wait_for('web', api.RUNNING, timeout=0))
+        self.assertFalse(self.index.wait_for(['web', 'db'], api.RUNNING,
+                                             timeout=0.01))
+
+        def start_db():
+            time.sleep(0.05)
+            self.index.handle_event({'status': 'start', 'id': 'b' * 64})
+            self.index.handle_event({'status': 'die', 'id': 'b' * 64})
+
+        threading.Thread(target=start_db).start()
+        # Running only briefly still counts as reached.
+        self.assertTrue(self.index.wait_for(['web', 'db'], api.RUNNING,
+                                            timeout=5))
+        self.assertEqual(['containers'], self.docker.calls)
+
+
+class InspectCountingClient(docker_api.DockerHTTPClient):
+
+    def __init__(self, containers, **kwargs):
+        super(InspectCountingClient, self).__init__(**kwargs)
+        self._containers = containers
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def containers(self, all=False):
+        return self._containers
+
+    def inspect_container(self, docker_id):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.01)
+        with self._lock:
+            self.active -= 1
+        if docker_id == 'gone':
+            raise errors.NotFound('gone', None, explanation='gone')
+        return {'Id': docker_id, 'Config': {'Hostname': docker_id[:4]}}
+
+
+class TestListInstances(base.TestCase):
+
+    def setUp(self):
+        super(TestListInstances, self).setUp()
+        self.containers = [{'Id': '%04d' % i} for i in range(20)]
+        self.containers.insert(5, {'Id': 'gone'})
+        self.docker = InspectCountingClient(self.containers,
+                                            inspect_workers=4)
+
+    def test_summary_does_not_inspect(self):
+        self.assertEqual(self.containers,
+                         self.docker.list_instances(summary=True))
+        self.assertEqual(0, self.docker.peak)
+
+    def test_inspect_is_bounded_and_ordered(self):
+        infos = self.docker.list_instances(inspect=True)
+        self.assertEqual(['%04d' % i for i in range(20)],
+                         [info['Id'] for info in infos])
+        self.assertEqual(4, self.docker.peak)
+        self.assertEqual(['0000', '0001'],
+                         self.docker.list_instances(max_workers=2)[:2])
+
+
+class PullCountingDocker(object):
+
+    def __init__(self):
+        self.pulls = 0
+        self.present = set()
+
+    def inspect_image(self, image):
+        if image not in self.present:
+            raise errors.NotFound(image, None, explanation=image)
+        return {'Id': 'sha256:' + image}
+
+    def pull(self, repo, tag=None):
+        self.pulls += 1
+        time.sleep(0.05)
+        self.present.add('%s:%s' % (repo, tag))
+
+
+class TestImageCache(base.TestCase):
+
+    def setUp(self):
+        super(TestImageCache, self).setUp()
+        self.docker = PullCountingDocker()
+        self.cache = docker_api.ImageCache(ttl=60)
+
+    def test_concurrent_pulls_are_merged(self):
+        threads = [threading.Thread(target=self.cache.ensure,
+                                    args=(self.docker, 'ubuntu:14.04',
+                                          docker_api.PULL_ALWAYS))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.docker.pulls)
+
+    def test_if_not_present_uses_cache(self):
+        self.docker.present.add('ubuntu:14.04')
+        self.assertEqual('sha256:ubuntu:14.04',
+                         self.cache.ensure(self.docker, 'ubuntu:14.04'))
+        self.docker.present.clear()
+        self.assertEqual('sha256:ubuntu:14.04',
+                         self.cache.ensure(self.docker, 'ubuntu:14.04'))
+        self.assertEqual(0, self.docker.pulls)
+
+    def test_never_does_not_pull(self):
+        self.assertRaises(errors.NotFound, self.cache.ensure, self.docker,
+                          'ubuntu:14.04', docker_api.PULL_NEVER)
+        self.assertEqual(0, self.docker.pulls)
+
+
+class VersionCountingClient(docker_api.DockerHTTPClient):
+
+    def __init__(self, server_version, **kwargs):
+        super(VersionCountingClient, self).__init__(**kwargs)
+        self.server_version = server_version
+        self.version_calls = 0
+
+    def version(self, api_version=True):
+        self.version_calls += 1
+        return {'ApiVersion': self.server_version}
+
+
+class TestFeatures(base.TestCase):
+
+    def test_negotiated_once_per_connection(self):
+        docker = VersionCountingClient('1.22', ver='1.18')
+        self.assertEqual('1.18', docker.features.api_version)
+        self.assertFalse(docker.features.supports_host_config)
+        self.assertTrue(docker.features.supports_stats)
+        self.assertEqual(1, docker.version_calls)
+
+        docker.server_version = '1.16'
+        docker.reconnect()
+        self.assertEqual('1.16', docker.features.api_version)
+        self.assertFalse(docker.features.supports_stats)
+        self.assertEqual(2, docker.version_calls)
+
+    def test_renegotiated_after_connection_failure(self):
+        tempdir = tempfile.mkdtemp(prefix='mincntr-dead-')
+        self.addCleanup(shutil.rmtree, tempdir)
+        docker = VersionCountingClient(
+            '1.22', url='unix://' + os.path.join(tempdir, 'docker.sock'))
+        self.assertEqual('1.20', docker.features.api_version)
+        self.assertRaises(requests.ConnectionError, docker.containers)
+        self.assertIsNotNone(docker.last_failure)
+        docker.server_version = '1.16'
+        self.assertEqual('1.16', docker.features.api_version)
+        self.assertEqual(2, docker.version_calls)
+
+
+class TestDemultiplexStream(base.TestCase):
+
+    def test_frames_are_split_into_bounded_chunks(self):
+        raw = io.BytesIO(struct.pack('>BxxxL', 1, 10) + b'0123456789' +
+                         struct.pack('>BxxxL', 2, 3) + b'err' +
+                         struct.pack('>BxxxL', 1, 5) + b'trun')
+        self.assertEqual([(1, b'0123'), (1, b'4567'), (1, b'89'),
+                          (2, b'err'), (1, b'trun')],
+                         list(docker_api.demultiplex_stream(raw,
+                                                            chunk_size=4)))
+
+
+class TestDockerAPIRoundTrips(base.TestCase):
+
+    def setUp(self):
+        super(TestDockerAPIRoundTrips, self).setUp()
+        self.fake = fakes.FakeDocker(containers=50)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.api = docker_api.DockerAPI(url=self.fake.url)
+        self.addCleanup(self.api.close)
+
+    def test_list_records(self):
+        self.fake.add_container('idle')
+        self.assertTrue(self.api.wait_for('idle', api.CREATED, timeout=5))
+        self.assertTrue(self.fake.wait_for_watchers())
+        before = self.fake.requests
+        containers = dict((c.name, c) for c in self.api.list())
+        self.assertEqual(1, self.fake.requests - before)
+        self.assertEqual(51, len(containers))
+        idle = containers['idle']
+        self.assertEqual(self.fake._find('idle')['Id'], idle.uuid)
+        self.assertEqual('busybox:latest', idle.image)
+        self.assertEqual(api.CREATED, idle.state)
+        self.assertEqual(api.RUNNING, containers['fake-0'].state)
+        self.assertEqual(1451606400, idle.created)
+
+        self.assertEqual('/idle', idle.details['Name'])
+        self.assertEqual('/idle', idle.details['Name'])
+        self.assertEqual(2, self.fake.requests - before)
+        self.fake.containers.clear()
+        self.assertIsNone(containers['fake-0'].details)
+
+    def test_inspect_cache(self):
+        self.api = docker_api.DockerAPI(url=self.fake.url,
+                                        inspect_cache_ttl=60)
+        self.addCleanup(self.api.close)
+        self.assertTrue(self.api.wait_for('fake-1', api.RUNNING, timeout=5))
+        self.assertTrue(self.fake.wait_for_watchers())
+        before = self.fake.requests
+        for _ in range(3):
+            self.assertTrue(self.api.inspect('fake-1')['Running'])
+        self.assertEqual(1, self.fake.requests - before)
+        self.assertEqual({'hits': 2, 'misses': 1, 'requests': 1, 'size': 1},
+                         self.api.inspect_cache_stats())
+
+        # Our own changes are seen right away.
+        self.api.stop('fake-1')
+        self.assertFalse(self.api.inspect('fake-1')['Running'])
+        self.assertEqual(3, self.fake.requests - before)
+        # Others' once invalidated.
+        self.fake._find('fake-1')['State']['Running'] = True
+        self.assertFalse(self.api.inspect('fake-1')['Running'])
+        self.api.invalidate_inspect('fake-1')
+        self.assertTrue(self.api.inspect('fake-1')['Running'])
+        self.assertIsNone(self.api.inspect('missing'))
+
+        # Callers get copies.
+        self.api.inspect('fake-1')['Running'] = False
+        self.assertTrue(self.api.inspect('fake-1')['Running'])
+        # Acting on an unknown container drops nothing.
+        self.assertRaises(Exception, self.api.start, 'missing')
+        self.assertEqual(1, self.api.inspect_cache_stats()['size'])
+
+    def test_concurrent_inspects_are_merged(self):
+        self.assertTrue(self.api.wait_for('fake-1', api.RUNNING, timeout=5))
+        self.assertTrue(self.fake.wait_for_watchers())
+        self.fake.latency = 0.2
+        before = self.fake.requests
+        results = api.run_many(self.api.inspect, ['fake-1'] * 10, 10)
+        self.assertTrue(all(r.result['Running'] for r in results))
+        self.assertEqual(1, self.fake.requests - before)
+        stats = self.api.inspect_cache_stats()
+        self.assertEqual(1, stats['requests'])
+        self.assertEqual(10, stats['hits'] + stats['misses'])
+
+    def test_close_stops_following_events(self):
+        self.assertTrue(self.api.wait_for('fake-1', api.RUNNING, timeout=5))
+        self.assertTrue(self.fake.wait_for_watchers())
+        with self.api.docker_for_container() as docker:
+            features = docker.features
+        self.api.close()
+        self.assertTrue(base.wait_threads_gone('mincntr-docker-events'))
+        with self.api.docker_for_container() as docker:
+            self.assertIsNot(features, docker.features)
+        # Usable again afterwards.
+        self.assertTrue(self.api.wait_for('fake-1', api.RUNNING, timeout=5))
+
+    def test_wait_for_follows_events(self):
+        self.assertTrue(self.api.wait_for('fake-1', api.RUNNING, timeout=5))
+        self.assertTrue(self.fake.wait_for_watchers())
+        before = self.fake.requests
+        threading.Timer(0.05, self.fake.add_container, ['late']).start()
+        self.assertTrue(self.api.wait_for('late', api.CREATED, timeout=5))
+        self.api.stop('fake-2')
+        self.api.delete('late')
+        self.assertFalse(self.api.wait_for(['fake-2', 'late'],
+                                           api.STOPPED, timeout=0.05))
+        self.assertTrue(self.api.wait_for('fake-2', api.STOPPED, timeout=5))
+        self.assertTrue(self.api.wait_for('late', api.DELETED, timeout=5))
+        self.assertFalse(self.api.wait_for('fake-4', api.STOPPED,
+                                           timeout=0.05))
+        # Inspecting the new container, the stop and the delete only.
+        self.assertEqual(3, self.fake.requests - before)
+
+    def test_actions_do_not_scan_the_host(self):
+        self.api.start('fake-1')
+        self.assertTrue(self.fake.wait_for_watchers())
+        before = self.fake.requests
+        self.api.stop('fake-7')
+        self.api.start('fake-7')
+        self.assertEqual(2, self.fake.requests - before)
+
+    def test_execute_many(self):
+        stream = self.api.execute_many(['fake-1', 'fake-2', 'missing'],
+                                       'echo hi', concurrency=2)
+        output = dict((e.item, e.data) for e in stream
+                      if e.stream == api.STDOUT)
+        self.assertEqual({'fake-1': b'echo hi\n', 'fake-2': b'echo hi\n'},
+                         output)
+        self.assertEqual({'fake-1': 0, 'fake-2': 0}, stream.exit_codes)
+        self.assertEqual(['missing'], list(stream.errors))
+
+    def _log_lines(self, name, numbers):
+        return [('/%s line %d\n' % (name, i)).encode('utf-8')
+                for i in numbers]
+
+    def test_stream_logs_tail_and_since(self):
+        self.assertEqual(self._log_lines('fake-1', [8, 9]),
+                         list(self.api.stream_logs('fake-1', tail=2,
+                                                   lines=True)))
+        self.assertEqual(self._log_lines('fake-1', [7, 8, 9]),
+                         list(self.api.stream_logs(
+                             'fake-1', since=fakes.FakeServer.LOG_START + 7,
+                             lines=True)))
+
+    def test_stream_logs_missing(self):
+        e = self.assertRaises(Exception, self.api.stream_logs, 'missing')
+        self.assertIn('not found', str(e))
+
+    def test_stream_logs_follow(self):
+        self.api.start('fake-1')
+        lines = self.api.stream_logs('fake-1', tail=1, follow=True,
+                                     lines=True)
+        self.assertEqual(self._log_lines('fake-1', [9]), [next(lines)])
+        self.fake.add_log('fake-1', b'late\n')
+        self.assertEqual(b'late\n', next(lines))
+        # Following ends with the container.
+        self.api.stop('fake-1')
+        self.assertEqual([], list(lines))
+
+    def test_stream_execute_stdin(self):
+        stream = self.api.stream_execute('fake-1', 'cat',
+                                         stdin=[b'hello ', b'world'],
+                                         timeout=5)
+        # cat only ends once stdin is half-closed.
+        self.assertEqual([(api.STDOUT, b'hello world')], list(stream))
+        self.assertEqual(0, stream.exit_code)
+
+    def test_stream_execute_exit_code(self):
+        stream = self.api.stream_execute('fake-1', 'exit 3')
+        self.assertIsNone(stream.exit_code)
+        list(stream)
+        self.assertEqual(3, stream.exit_code)
+
+    def test_stream_execute_timeout(self):
+        stream = self.api.stream_execute('fake-1', 'sleep 0.5', timeout=0.05)
+        self.assertRaises(api.ExecTimeout, list, stream)
+        self.assertIsNone(stream.exit_code)
+
+    def test_archive_round_trip(self):
+        content = b'x' * (3 * 1024 + 5)
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tar:
+            info = tarfile.TarInfo('artifact.bin')
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        buf.seek(0)
+        self.assertTrue(self.api.put_archive('fake-1', '/tmp', buf,
+                                             chunk_size=1024))
+        chunks = list(self.api.get_archive('fake-1', '/tmp/artifact.bin',
+                                           chunk_size=1024))
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in chunks))
+        with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as tar:
+            self.assertEqual(content,
+                             tar.extractfile('artifact.bin').read())
+
+    def test_stats_stream(self):
+        samples = list(self.api.stats('fake-1'))
+        self.assertEqual(5, len(samples))
+        self.assertEqual(['fake-1'] * 5, [s.item for s in samples])
+        self.assertAlmostEqual(2.0, samples[0].cpu_percent)
+        self.assertEqual((4096, 41, 82, 400, 200),
+                         (samples[4].memory_limit, samples[4].rx_bytes,
+                          samples[4].tx_bytes, samples[4].read_bytes,
+                          samples[4].write_bytes))
+        self.fake.stats_interval = 0.1
+        samples = list(self.api.stats('fake-1', interval=0.15))
+        self.assertEqual(3, len(samples))
+
+    def test_stats_many_polls_one_shot(self):
+        self.api.start('fake-1')
+        stream = self.api.stats_many(['fake-1', 'fake-2', 'missing'],
+                                     interval=0.01)
+        first = list(itertools.islice(stream, 2))
+        before = self.fake.requests
+        second = list(itertools.islice(stream, 2))
+        self.assertEqual(['fake-1', 'fake-2'] * 2,
+                         [s.item for s in first + second])
+        # A one-shot request per container, plus looking up the missing
+        # one again; no streams are left open.
+        self.assertEqual(3, self.fake.requests - before)
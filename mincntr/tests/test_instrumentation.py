@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_instrumentation
+----------------------------------
+
+Tests for `mincntr.instrumentation`.
+"""
+
+from mincntr import api
+from mincntr import docker_api
+from mincntr import instrumentation
+from mincntr import k8s_api
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+class _Backend(object):
+    BACKEND = 'fake'
+
+    def __init__(self, collector):
+        self._instrumentation = collector
+
+    @instrumentation.instrumented
+    def get(self, requests):
+        for i in range(requests):
+            instrumentation.record_request(10, 100)
+        return requests
+
+    @instrumentation.instrumented
+    def nested(self):
+        return self.get(2)
+
+    @instrumentation.instrumented
+    def fail(self):
+        raise ValueError()
+
+    @instrumentation.instrumented
+    def fan_out(self, requests):
+        return api.run_many(self.get, [1] * requests)
+
+
+class TestMetricsCollector(base.TestCase):
+
+    def setUp(self):
+        super(TestMetricsCollector, self).setUp()
+        self.collector = instrumentation.MetricsCollector()
+        self.backend = _Backend(self.collector)
+
+    def test_counts_requests_per_operation(self):
+        self.backend.get(3)
+        self.backend.nested()
+        self.assertRaises(ValueError, self.backend.fail)
+        stats = self.collector.snapshot()
+        self.assertEqual(1, stats[('fake', 'get')]['count'])
+        self.assertEqual(3, stats[('fake', 'get')]['requests'])
+        self.assertEqual(300, stats[('fake', 'get')]['bytes_received'])
+        self.assertEqual(2, stats[('fake', 'nested')]['requests'])
+        self.assertEqual(1, stats[('fake', 'fail')]['errors'])
+
+    def test_bulk_workers_report_to_caller(self):
+        self.backend.fan_out(5)
+        stats = self.collector.snapshot()
+        self.assertEqual(5, stats[('fake', 'fan_out')]['requests'])
+        self.assertNotIn(('fake', 'get'), stats)
+
+    def test_export(self):
+        self.backend.get(1)
+        text = self.collector.export()
+        self.assertIn('# TYPE mincntr_operation_duration_seconds histogram',
+                      text)
+        self.assertIn('mincntr_operation_duration_seconds_bucket{'
+                      'backend="fake",method="get",le="+Inf"} 1', text)
+        self.assertIn('mincntr_http_requests_total{'
+                      'backend="fake",method="get"} 1', text)
+
+    def test_noop_records_nothing(self):
+        backend = _Backend(instrumentation.NOOP)
+        self.assertEqual(2, backend.get(2))
+        self.assertIsNone(instrumentation.current_operation())
+
+
+class TestDockerInstrumentation(base.TestCase):
+
+    def test_round_trips(self):
+        collector = instrumentation.MetricsCollector()
+        with fakes.FakeDocker(containers=5) as fake:
+            api = docker_api.DockerAPI(url=fake.url,
+                                       instrumentation=collector)
+            api.list()
+            api.stop_many(['fake-1', 'fake-2'])
+            api.close()
+        stats = collector.snapshot()
+        # One listing; containers are inspected on demand only.
+        self.assertEqual(1, stats[('docker', 'list')]['requests'])
+        self.assertGreater(stats[('docker', 'list')]['bytes_received'], 0)
+        self.assertGreaterEqual(stats[('docker', 'stop_many')]['requests'],
+                                2)
+
+
+class TestKubernetesInstrumentation(base.TestCase):
+
+    def setUp(self):
+        super(TestKubernetesInstrumentation, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=3)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.collector = instrumentation.MetricsCollector()
+        self.api = k8s_api.KubernetesAPI(url=self.fake.url,
+                                         instrumentation=self.collector)
+        self.addCleanup(self.api.close)
+
+    def test_rest_client_requests(self):
+        self.api.create('new', 'busybox')
+        self.assertRaises(Exception, self.api.delete, 'missing')
+        stats = self.collector.snapshot()
+        create = stats[('kubernetes', 'create')]
+        self.assertEqual(1, create['requests'])
+        self.assertGreater(create['bytes_sent'], 0)
+        self.assertGreater(create['bytes_received'], 0)
+        delete = stats[('kubernetes', 'delete')]
+        self.assertEqual((1, 1), (delete['requests'], delete['errors']))
+        self.assertGreater(delete['bytes_received'], 0)
+
+    def test_streamed_requests(self):
+        self.api.list(namespace='default')
+        b''.join(self.api.stream_logs('fake-0'))
+        stats = self.collector.snapshot()
+        for method in ('list', 'stream_logs'):
+            self.assertEqual(1, stats[('kubernetes', method)]['requests'])
+            # The announced length of the body.
+            self.assertGreater(
+                stats[('kubernetes', method)]['bytes_received'], 0)
+
+    def test_execute_many_covers_the_call_only(self):
+        stream = self.api.execute_many(['fake-0', 'fake-1'], 'echo hi')
+        self.assertEqual(2, len([event for event in stream
+                                 if event.stream == api.EXIT]))
+        stats = self.collector.snapshot()
+        # The execs ran after the call returned, each as a call of its own.
+        self.assertEqual({('kubernetes', 'execute_many'),
+                          ('kubernetes', 'stream_execute')}, set(stats))
+        self.assertEqual(0, stats[('kubernetes', 'execute_many')]['requests'])
+        self.assertEqual(2, stats[('kubernetes', 'stream_execute')]['count'])
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_k8s_api
+----------------------------------
+
+Tests for `mincntr.k8s_api`: the pod informer on its own and
+KubernetesAPI against the fake apiserver in `mincntr.tests.fakes`.
+"""
+
+import datetime
+import itertools
+import re
+import ssl
+import time
+
+import fixtures
+
+from mincntr import api
+from mincntr import instrumentation
+from mincntr import k8s_api
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+def pod_event(event_type, uid, name, resource_version, phase='Pending'):
+    return {'type': event_type,
+            'object': {'metadata': {'uid': uid, 'name': name,
+                                    'namespace': 'default',
+                                    'resourceVersion': resource_version},
+                       'status': {'phase': phase}}}
+
+
+class TestPodInformer(base.TestCase):
+
+    def setUp(self):
+        super(TestPodInformer, self).setUp()
+        self.lists = 0
+        self.informer = k8s_api.PodInformer(self._list_pods,
+                                            lambda rv: iter([]))
+        self.informer.relist()
+
+    def _list_pods(self):
+        self.lists += 1
+        return [pod_event('ADDED', 'uid-1', 'web', '10',
+                          'Running')['object']], '10'
+
+    def test_serves_from_memory(self):
+        self.assertTrue(self.informer.synced)
+        self.assertEqual([api.Container('uid-1', 'web')],
+                         self.informer.list())
+        self.assertEqual(api.Container('uid-1', 'web'),
+                         self.informer.get_by_name('web'))
+        self.assertIsNone(self.informer.get_by_name('web', 'other'))
+        self.assertEqual(1, self.lists)
+
+    def test_watch_events(self):
+        self.assertTrue(self.informer.handle_event(
+            pod_event('ADDED', 'uid-2', 'db', '11')))
+        self.assertEqual(api.Container('uid-2', 'db'),
+                         self.informer.get_by_uid('uid-2'))
+        self.assertTrue(self.informer.handle_event(
+            pod_event('DELETED', 'uid-1', 'web', '12')))
+        self.assertIsNone(self.informer.get_by_name('web'))
+        self.assertEqual(['uid-2'],
+                         [c.uuid for c in self.informer.list()])
+
+    def test_wait_for(self):
+        self.assertTrue(self.informer.wait_for('web', api.RUNNING, 0))
+        self.assertFalse(self.informer.wait_for(['web', 'db'], api.RUNNING,
+                                                0.01))
+        self.informer.handle_event(pod_event('ADDED', 'uid-2', 'db', '11'))
+        self.assertEqual(api.CREATED, self.informer.state('db'))
+        self.informer.handle_event(pod_event('MODIFIED', 'uid-2', 'db', '12',
+                                             phase='Running'))
+        self.assertTrue(self.informer.wait_for(['web', 'db'], api.RUNNING,
+                                               0))
+        self.informer.handle_event(pod_event('DELETED', 'uid-1', 'web', '13'))
+        self.assertTrue(self.informer.wait_for('web', api.DELETED, 0))
+
+    def test_too_old_resource_version(self):
+        self.assertFalse(self.informer.handle_event(
+            {'type': 'ERROR', 'object': {'code': 410,
+                                         'message': 'too old'}}))
+
+
+class TestList(base.TestCase):
+
+    def setUp(self):
+        super(TestList, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=3)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.api = k8s_api.KubernetesAPI(url=self.fake.url)
+        self.addCleanup(self.api.close)
+
+    def test_records(self):
+        self.fake.add_pod('db', namespace='other', image='postgres:9')
+        containers = dict((c.name, c) for c in self.api.list())
+        self.assertEqual(['db', 'fake-0', 'fake-1', 'fake-2'],
+                         sorted(containers))
+        db = containers['db']
+        self.assertEqual(self.fake.pods[('other', 'db')]['metadata']['uid'],
+                         db.uuid)
+        self.assertEqual('postgres:9', db.image)
+        self.assertEqual(api.RUNNING, db.state)
+        self.assertEqual(1451606400, db.created)
+        self.assertEqual([db], self.api.list(namespace='other'))
+
+        self.assertTrue(self.fake.wait_for_watchers())
+        before = self.fake.requests
+        self.assertEqual('other', db.details['metadata']['namespace'])
+        self.assertEqual('other', db.details['metadata']['namespace'])
+        self.assertEqual(1, self.fake.requests - before)
+
+    def _record_queries(self):
+        queries = []
+
+        def list_pods(handler, query, body, *args):
+            queries.append(query)
+            return self.fake.list_pods(handler, query, body, *args)
+
+        for pattern in ('/api/v1/pods', '/api/v1/namespaces/([^/]+)/pods'):
+            self.fake.routes.insert(0, ('GET', re.compile('^%s$' % pattern),
+                                        list_pods))
+        return queries
+
+    def test_iter_pods_pages(self):
+        for i in range(3, 5):
+            self.fake.add_pod('fake-%d' % i)
+        queries = self._record_queries()
+        self.assertEqual(['fake-%d' % i for i in range(5)],
+                         sorted(c.name for c in self.api.iter_pods(
+                             page_size=2)))
+        self.assertEqual([['2']] * 3, [q['limit'] for q in queries])
+        self.assertEqual([None, ['2'], ['4']],
+                         [q.get('continue') for q in queries])
+
+    def test_iter_pods_selectors(self):
+        self.fake.add_pod('web', labels={'app': 'web'})
+        queries = self._record_queries()
+        self.assertEqual(['web'], [c.name for c in self.api.iter_pods(
+            namespace='default', label_selector='app=web',
+            field_selector='status.phase=Running')])
+        self.assertEqual(['app=web'], queries[0]['labelSelector'])
+        self.assertEqual(['status.phase=Running'],
+                         queries[0]['fieldSelector'])
+
+    def test_iter_pods_stops_early(self):
+        queries = self._record_queries()
+        pods = self.api.iter_pods(page_size=1)
+        next(pods)
+        next(pods)
+        pods.close()
+        self.assertEqual(2, len(queries))
+
+    def test_filtered_list_is_a_list(self):
+        self.assertIsInstance(self.api.list(namespace='default'), list)
+        self.assertIsInstance(self.api.list(), list)
+
+    def test_close_stops_the_informer(self):
+        self.assertEqual(3, len(self.api.list()))
+        self.assertTrue(self.fake.wait_for_watchers())
+        self.api.close()
+        self.assertTrue(base.wait_threads_gone('mincntr-pod-informer'))
+
+
+class TestReplicas(base.TestCase):
+
+    def setUp(self):
+        super(TestReplicas, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=3)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.collector = instrumentation.MetricsCollector()
+        self.api = k8s_api.KubernetesAPI(url=self.fake.url,
+                                         instrumentation=self.collector)
+        self.addCleanup(self.api.close)
+
+    def _pods(self, name):
+        return self.fake._select('default', {'labelSelector': [
+            '%s=%s' % (k8s_api.REPLICA_GROUP_LABEL, name)]})
+
+    def _wait_for_pods(self, name, count):
+        deadline = time.time() + 5
+        while len(self._pods(name)) != count and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self._pods(name)) == count
+
+    def test_create_scale_delete(self):
+        pods = list(self.api.create_replicas('workers', 'busybox:1',
+                                             replicas=20,
+                                             command='sleep 60',
+                                             timeout=10))
+        self.assertEqual(20, len(set(pod.uuid for pod in pods)))
+        self.assertTrue(all(pod.name.startswith('workers-')
+                            for pod in pods))
+        stats = self.collector.snapshot()
+        self.assertEqual(1, stats[('kubernetes', 'create_replicas')][
+            'requests'])
+        controller = self.fake.controllers[('default', 'workers')]
+        self.assertEqual(['sleep', '60'], controller['spec']['template'][
+            'spec']['containers'][0]['command'])
+
+        self.api.scale_replicas('workers', 5)
+        self.assertTrue(self._wait_for_pods('workers', 5))
+        self.api.delete_replicas('workers')
+        self.assertTrue(self._wait_for_pods('workers', 0))
+        self.assertEqual(3, len(self.fake.pods))
+        self.assertEqual(3, sum(
+            s['requests'] for s in self.collector.snapshot().values()))
+
+    def test_iter_replicas_lists_existing_pods(self):
+        list(self.api.create_replicas('web', 'busybox:1', replicas=2))
+        self.assertEqual(
+            sorted(pod['metadata']['name'] for pod in self._pods('web')),
+            sorted(pod.name for pod in self.api.iter_replicas('web', 2)))
+
+
+class TestLogs(base.TestCase):
+
+    def setUp(self):
+        super(TestLogs, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=1)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.api = k8s_api.KubernetesAPI(url=self.fake.url)
+        self.addCleanup(self.api.close)
+
+    def _log_lines(self, numbers):
+        return [('fake-0 line %d\n' % i).encode('utf-8') for i in numbers]
+
+    def test_tail_and_since(self):
+        self.assertEqual(self._log_lines([8, 9]),
+                         list(self.api.stream_logs('fake-0', tail=2,
+                                                   lines=True)))
+        since = datetime.datetime.utcfromtimestamp(
+            fakes.FakeServer.LOG_START + 7)
+        self.assertEqual(self._log_lines([7, 8, 9]),
+                         list(self.api.stream_logs('fake-0', since=since,
+                                                   lines=True)))
+
+    def test_follow(self):
+        lines = self.api.stream_logs('fake-0', tail=1, follow=True,
+                                     lines=True)
+        self.assertEqual(self._log_lines([9]), [next(lines)])
+        self.fake.add_log('fake-0', b'late\n')
+        self.assertEqual(b'late\n', next(lines))
+        # Following ends with the pod.
+        self.api.delete('fake-0')
+        self.assertEqual([], list(lines))
+
+
+class TestExecute(base.TestCase):
+
+    def setUp(self):
+        super(TestExecute, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=1)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.api = k8s_api.KubernetesAPI(url=self.fake.url)
+        self.addCleanup(self.api.close)
+
+    def test_stream_execute(self):
+        stream = self.api.stream_execute('fake-0', 'echo hi')
+        self.assertEqual([(api.STDOUT, b'echo hi\n')], list(stream))
+        self.assertEqual(0, stream.exit_code)
+
+    def test_stream_execute_stdin(self):
+        stream = self.api.stream_execute('fake-0', 'cat',
+                                         stdin=[b'hello ', b'world'],
+                                         timeout=5)
+        self.assertEqual(b'hello world', b''.join(d for _, d in stream))
+
+    def test_exit_code_from_error_channel(self):
+        stream = self.api.stream_execute('fake-0', 'exit 3')
+        list(stream)
+        self.assertEqual(3, stream.exit_code)
+
+    def test_stream_execute_timeout(self):
+        stream = self.api.stream_execute('fake-0', 'sleep 0.5', timeout=0.05)
+        self.assertRaises(api.ExecTimeout, list, stream)
+        self.assertIsNone(stream.exit_code)
+
+    def test_tls_options_reach_the_websocket(self):
+        k8s = k8s_api.KubernetesAPI(url=self.fake.url, key_file='key.pem',
+                                    cert_file='cert.pem', ca_certs='ca.pem')
+        self.addCleanup(k8s.close)
+        calls = []
+
+        def create_connection(url, **kwargs):
+            calls.append(kwargs)
+            raise IOError("no websocket")
+
+        self.useFixture(fixtures.MonkeyPatch(
+            'websocket.create_connection', create_connection))
+        self.assertRaises(IOError, k8s.stream_execute, 'fake-0', 'ls')
+        self.assertEqual({'keyfile': 'key.pem', 'certfile': 'cert.pem',
+                          'ca_certs': 'ca.pem',
+                          'cert_reqs': ssl.CERT_REQUIRED},
+                         calls[0]['sslopt'])
+
+
+class TestStats(base.TestCase):
+
+    def setUp(self):
+        super(TestStats, self).setUp()
+        self.fake = fakes.FakeKubernetes(pods=50)
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.api = k8s_api.KubernetesAPI(url=self.fake.url)
+        self.addCleanup(self.api.close)
+
+    def test_parse_quantity(self):
+        self.assertEqual(0.25, k8s_api.parse_quantity('250m'))
+        self.assertEqual(64 * 2 ** 20, k8s_api.parse_quantity('64Mi'))
+        self.assertEqual(2.0, k8s_api.parse_quantity('2'))
+
+    def test_stats_many_lists_metrics_once_per_round(self):
+        names = ['fake-%d' % i for i in range(50)]
+        before = self.fake.requests
+        samples = list(itertools.islice(
+            self.api.stats_many(names, interval=0.01), 100))
+        self.assertEqual(2, self.fake.requests - before)
+        self.assertEqual(sorted(names) * 2, [s.item for s in samples])
+        self.assertAlmostEqual(2.0, samples[0].cpu_percent)
+        self.assertEqual(2 ** 20, samples[0].memory_usage)
+
+    def test_stats_polls_one_pod(self):
+        sample = next(self.api.stats('fake-3', interval=0.01))
+        self.assertEqual('fake-3', sample.item)
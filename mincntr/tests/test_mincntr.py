@@ -18,12 +18,58 @@ test_mincntr
 
 Tests for `mincntr` module.
 """
+import json
+import subprocess
+import sys
 import uuid
 
+import mincntr
 from mincntr import k8s_api
 from mincntr import docker_api
 from mincntr.tests import base
 
+# Seconds `import mincntr` may take, measured in a fresh interpreter.
+IMPORT_TIME_BUDGET = 0.05
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.time()
+import mincntr
+elapsed = time.time() - started
+print(json.dumps([elapsed, sorted(sys.modules)]))
+"""
+
+HEAVY_MODULES = ('docker', 'k8sclient', 'distutils', 'pkg_resources',
+                 'requests', 'websocket', 'aiohttp', 'mincntr.docker_api',
+                 'mincntr.k8s_api')
+
+
+class TestRegistry(base.TestCase):
+
+    def test_import_is_cheap(self):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          IMPORT_PROBE])
+        elapsed, modules = json.loads(output.decode('utf-8'))
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+        loaded = [m for m in modules
+                  if m.split('.')[0] in HEAVY_MODULES or m in HEAVY_MODULES]
+        self.assertEqual([], loaded)
+
+    def test_get_backend(self):
+        self.assertIs(docker_api.DockerAPI, mincntr.get_backend('docker'))
+        self.assertIs(k8s_api.KubernetesAPI,
+                      mincntr.get_backend('kubernetes'))
+        self.assertIn('multi-docker', mincntr.backends())
+        self.assertRaises(ValueError, mincntr.get_backend, 'nonexistent')
+
+    def test_register_backend(self):
+        self.addCleanup(mincntr._BACKENDS.pop, 'test', None)
+        mincntr.register_backend('test', 'mincntr.api:APIBase')
+        self.assertEqual('APIBase', mincntr.get_backend('test').__name__)
+        mincntr.register_backend('test', docker_api.DockerAPI)
+        api = mincntr.get_api('test', url='unix:///nonexistent')
+        self.assertIsInstance(api, docker_api.DockerAPI)
+
 
 class TestMincntr(base.TestCase):
 
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_multi_docker_api
+----------------------------------
+
+Tests for `mincntr.multi_docker_api` against several fake daemons.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from mincntr import api
+from mincntr import instrumentation
+from mincntr import multi_docker_api
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+class FakeHost(object):
+
+    def __init__(self, load):
+        self._load = load
+
+    def load(self):
+        return self._load
+
+
+class TestPlacement(base.TestCase):
+
+    def test_least_loaded(self):
+        hosts = [FakeHost(None), FakeHost(3), FakeHost(1)]
+        self.assertIs(hosts[2], multi_docker_api.least_loaded(hosts))
+        hosts = [FakeHost(None), FakeHost(None)]
+        self.assertIs(hosts[0], multi_docker_api.least_loaded(hosts))
+
+    def test_round_robin(self):
+        hosts = [FakeHost(0), FakeHost(0)]
+        policy = multi_docker_api.round_robin()
+        self.assertEqual([hosts[0], hosts[1], hosts[0]],
+                         [policy(hosts) for _ in range(3)])
+
+
+class TestMultiDockerAPI(base.TestCase):
+
+    def setUp(self):
+        super(TestMultiDockerAPI, self).setUp()
+        self.fakes = []
+        for containers in (3, 1):
+            fake = fakes.FakeDocker(containers=containers)
+            fake.start()
+            self.addCleanup(fake.stop)
+            self.fakes.append(fake)
+        # Same names on both hosts would be ambiguous.
+        self.fakes[1].containers.clear()
+        self.fakes[1].add_container('other', running=True)
+        tempdir = tempfile.mkdtemp(prefix='mincntr-dead-')
+        self.addCleanup(shutil.rmtree, tempdir)
+        dead = 'unix://' + os.path.join(tempdir, 'docker.sock')
+        self.api = multi_docker_api.MultiDockerAPI(
+            [fake.url for fake in self.fakes] + [dead], locate_timeout=1,
+            list_timeout=5)
+        self.addCleanup(self.api.close)
+
+    def test_list_merges_hosts(self):
+        started = time.time()
+        names = sorted(info['Name'][1:]
+                       for fake in self.fakes
+                       for info in fake.containers.values())
+        self.assertEqual(names, sorted(c.name for c in self.api.list()))
+        self.assertLess(time.time() - started, 5)
+        self.assertFalse(self.api.hosts[2].available)
+
+    def test_actions_are_routed_to_the_owner(self):
+        self.assertTrue(self.api.wait_for(['fake-0', 'other'], api.RUNNING,
+                                          timeout=5))
+        self.assertTrue(self.api.create('new', 'busybox:latest'))
+        owner = self.api.locate('new')
+        self.assertIs(self.api.hosts[1], owner)
+        before = self.fakes[0].requests
+        self.api.start('new')
+        # The location is cached: the other host is not asked.
+        self.assertEqual(before, self.fakes[0].requests)
+        self.assertTrue(self.fakes[1]._find('new')['State']['Running'])
+
+    def test_create_on_least_loaded(self):
+        self.assertTrue(self.api.wait_for(['fake-0', 'other'], api.RUNNING,
+                                          timeout=5))
+        self.assertEqual([3, 1], [host.load()
+                                  for host in self.api.hosts[:2]])
+        self.assertTrue(self.api.create('new', 'busybox:latest'))
+        self.assertIs(self.api.hosts[1], self.api.locate('new'))
+
+    def test_bulk_groups_by_host(self):
+        results = self.api.stop_many(['fake-0', 'other', 'missing'])
+        self.assertEqual(['fake-0', 'other', 'missing'],
+                         [result.item for result in results])
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].error)
+        self.assertIsNotNone(results[2].error)
+
+    def test_close_stops_the_pool(self):
+        self.api.list()
+        pool = self.api._pool
+        self.api.close()
+        for thread in list(pool._threads):
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        # Still usable after close(), as DockerAPI is.
+        self.assertEqual(4, len(self.api.list()))
+
+    def test_instrumented_apart_from_its_hosts(self):
+        collector = instrumentation.MetricsCollector()
+        multi = multi_docker_api.MultiDockerAPI(
+            [fake.url for fake in self.fakes], instrumentation=collector)
+        self.addCleanup(multi.close)
+        multi.list()
+        stats = collector.snapshot()
+        # The round trips to every host count toward the one call.
+        self.assertEqual([('multi-docker', 'list')], list(stats))
+        self.assertEqual(1, stats[('multi-docker', 'list')]['count'])
+        self.assertGreaterEqual(
+            stats[('multi-docker', 'list')]['requests'], 2)
+
+    def test_requires_hosts(self):
+        self.assertRaises(ValueError, multi_docker_api.MultiDockerAPI, [])
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_scheduler
+----------------------------------
+
+Tests for `mincntr.scheduler`.
+"""
+
+import re
+import threading
+import time
+
+from mincntr import docker_api
+from mincntr import k8s_api
+from mincntr import scheduler
+from mincntr.tests import base
+from mincntr.tests import fakes
+
+
+class TestScheduler(base.TestCase):
+
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.scheduler = scheduler.Scheduler(limit=4)
+
+    def _limit(self, endpoint='a'):
+        return self.scheduler.snapshot()[endpoint]['limit']
+
+    def _wait_waiting(self, count):
+        deadline = time.time() + 5
+        while self.scheduler.snapshot()['a']['waiting'] < count:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.001)
+
+    def test_limit_grows_on_success(self):
+        for _ in range(4):
+            with self.scheduler.slot('a') as ticket:
+                ticket.status = 200
+        # One more for every limit successes.
+        self.assertGreater(self._limit(), 4.9)
+        self.assertLess(self._limit(), 5)
+
+    def test_backs_off_once_per_round_trip(self):
+        tickets = [self.scheduler.acquire('a') for _ in range(4)]
+        for ticket in tickets:
+            ticket.status = 503
+            self.scheduler.release(ticket)
+        self.assertAlmostEqual(4 * scheduler.DEFAULT_BACKOFF, self._limit())
+        # A failure to connect is a sign of overload too.
+        with self.scheduler.slot('a'):
+            pass
+        self.assertAlmostEqual(4 * scheduler.DEFAULT_BACKOFF ** 2,
+                               self._limit())
+
+    def test_slow_response_backs_off(self):
+        self.scheduler = scheduler.Scheduler(limit=4, latency_target=0)
+        with self.scheduler.slot('a') as ticket:
+            time.sleep(0.01)
+            ticket.status = 200
+        self.assertLess(self._limit(), 4)
+
+    def test_slow_writes_do_not_back_off(self):
+        self.scheduler = scheduler.Scheduler(limit=4, latency_target=0)
+        with self.scheduler.slot('a', 'POST') as ticket:
+            time.sleep(0.01)
+            ticket.status = 204
+        self.assertGreater(self._limit(), 4)
+        # Nor do slow reads by default.
+        self.scheduler = scheduler.Scheduler(limit=4)
+        with self.scheduler.slot('a') as ticket:
+            time.sleep(0.01)
+            ticket.status = 200
+        self.assertGreater(self._limit(), 4)
+
+    def test_endpoints_are_independent(self):
+        with self.scheduler.slot('a') as ticket:
+            ticket.status = 429
+        with self.scheduler.slot('b') as ticket:
+            ticket.status = 200
+        self.assertLess(self._limit('a'), 4)
+        self.assertGreater(self._limit('b'), 4)
+
+    def test_reads_go_before_writes(self):
+        self.scheduler = scheduler.Scheduler(limit=1, min_limit=1)
+        held = self.scheduler.acquire('a', 'POST')
+        order = []
+
+        def send(method):
+            with self.scheduler.slot('a', method) as ticket:
+                order.append(method)
+                ticket.status = 200
+
+        threads = []
+        for i, method in enumerate(['POST', 'GET']):
+            thread = threading.Thread(target=send, args=(method,))
+            thread.start()
+            threads.append(thread)
+            self._wait_waiting(i + 1)
+        held.status = 200
+        self.scheduler.release(held)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['GET', 'POST'], order)
+        self.assertEqual(2, self.scheduler.snapshot()['a']['throttled'])
+
+    def test_rate_limit(self):
+        self.scheduler = scheduler.Scheduler(rate=50, burst=1)
+        started = time.time()
+        for _ in range(6):
+            with self.scheduler.slot('a') as ticket:
+                ticket.status = 200
+        self.assertGreaterEqual(time.time() - started, 0.09)
+
+    def test_bad_limits(self):
+        self.assertRaises(ValueError, scheduler.Scheduler, limit=0)
+        self.assertRaises(ValueError, scheduler.Scheduler, backoff=1)
+
+
+class TestBackends(base.TestCase):
+
+    def setUp(self):
+        super(TestBackends, self).setUp()
+        self.scheduler = scheduler.Scheduler(limit=4)
+
+    def test_shared_by_docker_and_kubernetes(self):
+        docker = fakes.FakeDocker(containers=2)
+        k8s = fakes.FakeKubernetes(pods=2)
+        for fake in (docker, k8s):
+            fake.start()
+            self.addCleanup(fake.stop)
+        for api in (docker_api.DockerAPI(url=docker.url,
+                                         scheduler=self.scheduler),
+                    k8s_api.KubernetesAPI(url=k8s.url,
+                                          scheduler=self.scheduler)):
+            self.addCleanup(api.close)
+            api.list()
+        snapshot = self.scheduler.snapshot()
+        self.assertEqual(set([docker.url, k8s.url]), set(snapshot))
+        for endpoint in snapshot.values():
+            self.assertGreater(endpoint['limit'], 4)
+
+    def test_docker_throttling_backs_off(self):
+        fake = fakes.FakeDocker(containers=1)
+        fake.start()
+        self.addCleanup(fake.stop)
+        fake.routes.insert(0, ('POST', re.compile('^.*/start$'),
+                               lambda handler, *args: handler.send_json(
+                                   {'message': 'slow down'}, 429)))
+        api = docker_api.DockerAPI(url=fake.url, scheduler=self.scheduler)
+        self.addCleanup(api.close)
+        self.assertRaises(Exception, api.start, 'fake-0')
+        self.assertLess(self.scheduler.snapshot()[fake.url]['limit'], 4)
+
+    def test_docker_body_is_read_outside_the_slot(self):
+        fake = fakes.FakeDocker(containers=1)
+        fake.start()
+        self.addCleanup(fake.stop)
+        body_sent = threading.Event()
+
+        def version(handler, query, body):
+            handler.send_response(200)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', '2')
+            handler.end_headers()
+            handler.wfile.flush()
+            # Free once the headers are in.
+            deadline = time.time() + 5
+            while self.scheduler.snapshot()[fake.url]['in_flight']:
+                if time.time() > deadline:
+                    break
+                time.sleep(0.001)
+            handler.wfile.write(b'{}')
+            body_sent.set()
+
+        fake.routes.insert(0, ('GET', re.compile('^.*/version$'), version))
+        docker = docker_api.DockerHTTPClient(url=fake.url,
+                                             scheduler=self.scheduler)
+        self.addCleanup(docker.close)
+        started = time.time()
+        self.assertEqual({}, docker.version())
+        self.assertTrue(body_sent.is_set())
+        self.assertLess(time.time() - started, 4)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_warm_pool
+----------------------------------
+
+Tests for `mincntr.warm_pool` against the fake Docker daemon.
+"""
+
+import re
+
+from mincntr import docker_api
+from mincntr import instrumentation
+from mincntr.tests import base
+from mincntr.tests import fakes
+from mincntr import warm_pool
+
+
+class TestWarmPool(base.TestCase):
+
+    def setUp(self):
+        super(TestWarmPool, self).setUp()
+        self.fake = fakes.FakeDocker()
+        self.fake.start()
+        self.addCleanup(self.fake.stop)
+        self.collector = instrumentation.MetricsCollector()
+        self.api = docker_api.DockerAPI(url=self.fake.url,
+                                        instrumentation=self.collector)
+        self.addCleanup(self.api.close)
+        self.pool = warm_pool.WarmPool(
+            self.api, {'sleep': {'image': 'busybox:latest',
+                                 'command': 'sleep 60'}},
+            size=2, max_size=3)
+        self.pool.start()
+        self.addCleanup(self.pool.stop)
+
+    def _running(self, name):
+        return self.fake._find(name)['State']['Running']
+
+    def test_acquire_is_one_start(self):
+        self.assertTrue(self.pool.wait_ready(timeout=5))
+        name = self.pool.acquire('sleep')
+        self.assertTrue(self._running(name))
+        stats = self.collector.snapshot()
+        self.assertEqual(1, stats[('docker', 'start')]['requests'])
+        self.assertTrue(self.pool.wait_ready(timeout=5))
+        self.assertEqual(2, self.pool.ready('sleep'))
+
+        self.pool.release(name)
+        self.assertIsNone(self.fake._find(name))
+
+    def test_empty_pool_grows_up_to_max_size(self):
+        self.assertTrue(self.pool.wait_ready(timeout=5))
+        names = [self.pool.acquire('sleep') for _ in range(4)]
+        self.assertTrue(all(self._running(name) for name in names))
+        self.assertTrue(self.pool.wait_ready(timeout=5))
+        self.assertEqual(3, self.pool.ready('sleep'))
+
+    def test_stop_deletes_ready_containers(self):
+        self.assertTrue(self.pool.wait_ready(timeout=5))
+        self.pool.stop()
+        self.assertEqual({}, self.fake.containers)
+
+    def _names(self):
+        return set(info['Name'][1:] for info in self.fake.containers.values())
+
+    def test_failed_start_deletes_the_container(self):
+        self.assertTrue(self.pool.wait_ready(timeout=5))
+        before = self._names()
+        self.fake.routes.insert(0, ('POST', re.compile('^.*/start$'),
+                                    lambda handler, *args: handler.send_json(
+                                        {'message': 'cannot start'}, 500)))
+        self.assertRaises(Exception, self.pool.acquire, 'sleep')
+        self.assertEqual(1, len(before - self._names()))
+
+    def test_unknown_template(self):
+        self.assertRaises(ValueError, self.pool.acquire, 'missing')
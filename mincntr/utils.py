@@ -0,0 +1,152 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import calendar
+import datetime
+import shlex
+import threading
+
+import six
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls that share a key into one execution.
+
+    The first caller for a key runs the function; callers arriving while
+    it is in flight wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def iter_lines(chunks):
+    """Re-chunk an iterator of byte strings into lines, keeping the ends.
+
+    Only the current partial line is held in memory.
+    """
+    pending = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pending += chunk
+        start = 0
+        end = pending.find(b'\n')
+        while end != -1:
+            yield pending[start:end + 1]
+            start = end + 1
+            end = pending.find(b'\n', start)
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+
+def to_timestamp(value):
+    """Return a datetime or number as integer seconds since the epoch."""
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return int(value)
+
+
+def iter_chunks(data, chunk_size=64 * 1024):
+    """Yield byte strings from a byte string, file object or iterable."""
+    if data is None:
+        return
+    if isinstance(data, bytes):
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+    elif hasattr(data, 'read'):
+        chunk = data.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = data.read(chunk_size)
+    else:
+        for chunk in data:
+            yield chunk
+
+
+# Helpers shared by the blocking and the asyncio backends.
+
+def parse_docker_image(image):
+    image_parts = image.split(':', 1)
+
+    image_repo = image_parts[0]
+    image_tag = None
+
+    if len(image_parts) > 1:
+        image_tag = image_parts[1]
+
+    return image_repo, image_tag
+
+
+def container_error(error, args, kwargs, log):
+    """Log the failure of a Docker backend call; return what to raise.
+
+    args and kwargs are those of the call; they name the container in
+    the log message.
+    """
+    container_uuid = kwargs.get('container_uuid')
+    if container_uuid is None and 'container' in kwargs:
+        container_uuid = kwargs['container'].uuid
+    if container_uuid is None and args:
+        container_uuid = args[0]
+    log.exception("Error while connect to docker "
+                  "container %s", container_uuid)
+    return Exception("Docker internal Error: %s" % str(error))
+
+
+def pod_container_spec(name, image, command=None, environment=None,
+                       memory=None, **kwargs):
+    """Container entry of a pod spec from create() keyword arguments."""
+    spec = {'image': image, 'name': name}
+    if command:
+        if isinstance(command, six.string_types):
+            command = shlex.split(command)
+        spec['command'] = command
+    if environment:
+        spec['env'] = [{'name': key, 'value': str(value)}
+                       for key, value in sorted(environment.items())]
+    if memory is not None:
+        spec['resources'] = {'limits': {'memory': memory}}
+    return spec
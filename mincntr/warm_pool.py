@@ -0,0 +1,205 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""Pools of containers created ahead of time.
+
+A WarmPool keeps, for each configured template, a number of created but
+not started containers.  acquire() hands one out by starting it; with
+DockerAPI the image is already there and the name already indexed, so
+that is a single round trip.  A background thread creates the
+replacements.  Every time a template runs dry its pool grows by one, up
+to max_size.
+
+Only useful with backends whose create() does not start the container,
+i.e. Docker.
+"""
+
+import collections
+import logging
+import threading
+import time
+import uuid
+
+import six
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 2
+DEFAULT_MAX_SIZE = 10
+
+
+class _Template(object):
+
+    def __init__(self, name, spec, size, max_size):
+        self.name = name
+        self.spec = spec
+        self.size = size
+        self.max_size = max_size
+        self.ready = collections.deque()
+        self.creating = 0
+
+    def missing(self):
+        return self.size - len(self.ready) - self.creating
+
+
+class WarmPool(object):
+
+    def __init__(self, api, templates, size=DEFAULT_SIZE,
+                 max_size=DEFAULT_MAX_SIZE, prefix='warm',
+                 retry_interval=1):
+        """Keep containers of templates ready on api.
+
+        templates maps a template name to the create() keyword arguments
+        of its containers: image, command, environment, memory, ...
+        size is the number of containers kept ready per template at
+        first; the pool of a template that runs dry grows up to
+        max_size.  Containers are named <prefix>-<template>-<random>.
+        """
+        if size > max_size:
+            raise ValueError("size must not exceed max_size")
+        self._api = api
+        self._prefix = prefix
+        self._retry_interval = retry_interval
+        self._templates = dict(
+            (name, _Template(name, spec, size, max_size))
+            for name, spec in six.iteritems(templates))
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Start filling the pools in the background."""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run,
+                                            name='mincntr-warm-pool')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop refilling and delete the containers still in the pools."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+            names = []
+            for template in six.itervalues(self._templates):
+                names.extend(template.ready)
+                template.ready.clear()
+        if thread is not None:
+            thread.join()
+        for name in names:
+            self._delete(name)
+
+    def ready(self, template):
+        """Number of containers of template ready to be handed out."""
+        with self._cond:
+            return len(self._get(template).ready)
+
+    def wait_ready(self, timeout=None):
+        """Wait until every pool is full; False if timeout passes first."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while any(len(t.ready) < t.size
+                      for t in six.itervalues(self._templates)):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+            return True
+
+    def acquire(self, template):
+        """Start a container of template and return its name.
+
+        When none is ready one is created on the spot, and the pool of
+        the template grows by one.
+        """
+        with self._cond:
+            t = self._get(template)
+            name = t.ready.popleft() if t.ready else None
+            if name is None and t.size < t.max_size:
+                t.size += 1
+            self._cond.notify_all()
+        if name is None:
+            LOG.debug("Warm pool of %s is empty, creating a container",
+                      template)
+            name = self._create(t)
+        try:
+            self._api.start(name)
+        except Exception:
+            self._delete(name)
+            raise
+        return name
+
+    def release(self, container_uuid):
+        """Stop and delete a container handed out by acquire()."""
+        self._api.stop(container_uuid)
+        return self._api.delete(container_uuid)
+
+    def _get(self, template):
+        try:
+            return self._templates[template]
+        except KeyError:
+            raise ValueError("Unknown warm pool template %r" % template)
+
+    def _create(self, template):
+        name = '%s-%s-%s' % (self._prefix, template.name,
+                             uuid.uuid4().hex[:12])
+        if not self._api.create(name, **template.spec):
+            raise Exception("Warm pool could not create a %s container"
+                            % template.name)
+        return name
+
+    def _delete(self, name):
+        try:
+            self._api.delete(name)
+        except Exception:
+            LOG.warning("Could not delete warm container %s", name,
+                        exc_info=True)
+
+    def _next_missing(self):
+        for template in six.itervalues(self._templates):
+            if template.missing() > 0:
+                return template
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                template = self._next_missing()
+                while not self._stopped and template is None:
+                    self._cond.wait()
+                    template = self._next_missing()
+                if self._stopped:
+                    return
+                template.creating += 1
+            name = None
+            try:
+                name = self._create(template)
+            except Exception:
+                LOG.warning("Could not refill the warm pool of %s",
+                            template.name, exc_info=True)
+            with self._cond:
+                template.creating -= 1
+                stopped = self._stopped
+                if name is not None and not stopped:
+                    template.ready.append(name)
+                self._cond.notify_all()
+            if name is None:
+                time.sleep(self._retry_interval)
+            elif stopped:
+                # Stopped while it was being created.
+                self._delete(name)